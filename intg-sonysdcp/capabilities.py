@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""Module that includes the capability probe which checks which setting items are supported by the projector model"""
+
+import json
+import os
+import time
+import logging
+
+import commands
+import config
+import connection
+import retry
+
+_LOG = logging.getLogger(__name__)
+
+SUPPORTED = "supported"
+UNSUPPORTED = "unsupported"
+UNKNOWN = "unknown"
+
+INVALID_ITEM = 0x101 #The projector model doesn't know this item at all
+NOT_APPLICABLE = 0x180 #The item exists but can't be read in the current projector state (e.g. standby or no signal)
+INVALID_DATA = 0x104 #The projector model knows the item but not the value that has been set
+
+#All items from the COMMANDS table that are changed by simple commands. INPUT is supported by all models
+PROBE_ITEMS = [item for item, _ in commands.SETTINGS.values() if item != "INPUT"]
+
+
+
+class Capabilities:
+    """Runtime storage of the probed capabilities of each projector (model and serial number). The storage is mirrored to a capabilities file
+    in the same directory as the config file to only probe a projector once"""
+
+    __models = {}
+
+    @staticmethod
+    def path():
+        """Get the path of the capabilities file which is located in the same directory as the config file"""
+        return os.path.join(os.path.dirname(config.Setup.get("cfg_path")), "capabilities.json")
+
+    @staticmethod
+    def load():
+        """Load all probed capabilities from the capabilities file into the runtime storage"""
+        capabilities_path = Capabilities.path()
+        if not os.path.isfile(capabilities_path):
+            _LOG.debug(capabilities_path + " does not exist (yet). No probed capabilities available")
+            return
+
+        try:
+            with open(capabilities_path, "r", encoding="utf-8") as f:
+                Capabilities.__models = json.load(f)
+        except Exception as e:
+            Capabilities.__models = {}
+            raise OSError("Error while reading " + capabilities_path) from e
+
+        _LOG.debug("Loaded probed capabilities for " + str(list(Capabilities.__models)) + " from " + capabilities_path)
+
+    @staticmethod
+    def save():
+        """Store all probed capabilities from the runtime storage in the capabilities file"""
+        capabilities_path = Capabilities.path()
+        try:
+            with open(capabilities_path, "w", encoding="utf-8") as f:
+                json.dump(Capabilities.__models, f)
+        except Exception as e:
+            raise OSError("Error while storing probed capabilities into " + capabilities_path) from e
+
+    @staticmethod
+    def get(item: str) -> str:
+        """Get the capability of an item from the COMMANDS table for the configured projector"""
+        try:
+            model_id = config.Setup.get("id")
+        except ValueError:
+            return UNKNOWN
+        return Capabilities.__models.get(model_id, {}).get("items", {}).get(item, UNKNOWN)
+
+    @staticmethod
+    def pending() -> bool:
+        """Check if the configured projector has not been probed yet or if there are items with an unknown capability"""
+        return [item for item in PROBE_ITEMS if Capabilities.get(item) == UNKNOWN] != []
+
+    @staticmethod
+    def value_key(cmd_name: str, params: dict = None):
+        """Get the key for the item and value that a setting command sets or None if it's not a setting command"""
+        cmd_setting = commands.setting(cmd_name, params)
+        if cmd_setting is None:
+            return None
+        return cmd_setting[0] + ":" + str(cmd_setting[1])
+
+    @staticmethod
+    def is_supported(cmd_name: str, params: dict = None) -> bool:
+        """Check if a command is supported by the configured projector. Commands with an unknown capability are treated as supported"""
+        item = commands.item(cmd_name, params)
+        if item is None:
+            return True
+        if Capabilities.get(item) == UNSUPPORTED:
+            return False
+        key = Capabilities.value_key(cmd_name, params)
+        try:
+            model_id = config.Setup.get("id")
+        except ValueError:
+            return True
+        return Capabilities.__models.get(model_id, {}).get("values", {}).get(key, UNKNOWN) != UNSUPPORTED
+
+    @staticmethod
+    def learn(cmd_name: str, e: Exception, params: dict = None):
+        """Remember that the projector model doesn't support the value of a setting command if the projector rejected it as invalid data.
+        Values can't be probed without changing the setting, so they are only learned once a command has been rejected.
+        The command will be rejected without sending it and removed from the entities after the next restart"""
+        key = Capabilities.value_key(cmd_name, params)
+        if key is None or retry.nak_code(retry.unwrap(e)) != INVALID_DATA:
+            return
+        try:
+            model_id = config.Setup.get("id")
+        except ValueError:
+            return
+        model = Capabilities.__models.setdefault(model_id, {"items": {}, "timestamp": time.time()})
+        model.setdefault("values", {})[key] = UNSUPPORTED
+        _LOG.info("The projector model " + model_id + " doesn't support " + cmd_name + ". It will be removed after the next restart")
+
+        try:
+            Capabilities.save()
+        except OSError as o:
+            _LOG.warning(o)
+
+    @staticmethod
+    def prune(simple_commands: list[str]) -> list[str]:
+        """Remove all commands that are not supported by the configured projector from a list of simple commands"""
+        return [cmd_name for cmd_name in simple_commands if Capabilities.is_supported(cmd_name)]
+
+    @staticmethod
+    def probe(ip: str) -> bool:
+        """Get each setting item once from the projector to find out which items are supported by the model. Only an invalid item error
+        means that the item is not supported. Items that are not applicable in the current state stay unknown and will be probed again later.
+        Returns True if a capability has changed. Raises an exception if the projector is not reachable"""
+        model_id = config.Setup.get("id")
+        known = Capabilities.__models.get(model_id, {}).get("items", {})
+        items = {}
+
+        with connection.Session(ip) as session:
+            for item in PROBE_ITEMS:
+                if known.get(item, UNKNOWN) != UNKNOWN:
+                    items[item] = known[item]
+                    continue
+                try:
+                    session.get(item)
+                    items[item] = SUPPORTED
+                except connection.NakError as n:
+                    items[item] = UNSUPPORTED if n.code == INVALID_ITEM else UNKNOWN
+
+        if items == known:
+            return False
+
+        Capabilities.__models[model_id] = {"items": items, "values": Capabilities.__models.get(model_id, {}).get("values", {}), "timestamp": time.time()}
+        _LOG.info("Probed capabilities of " + model_id + ". Unsupported: " + str([item for item, value in items.items() if value == UNSUPPORTED]) \
+                  + ". Unknown: " + str([item for item, value in items.items() if value == UNKNOWN]))
+
+        try:
+            Capabilities.save()
+        except OSError as o:
+            _LOG.warning(o)
+
+        return True
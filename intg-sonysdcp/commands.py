@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""Module that includes the command tables which map the supported commands to their SDCP requests"""
+
+import ucapi
+from pysdcp_extended.protocol import *
+
+import config
+
+#Simple command prefix: (Item from the COMMANDS table, table with all values for this item)
+SETTINGS = {
+    "INPUT_HDMI_": ("INPUT", {"1": INPUTS["HDMI1"], "2": INPUTS["HDMI2"]}),
+    "MODE_PRESET_": ("CALIBRATION_PRESET", CALIBRATION_PRESETS),
+    "MODE_ASPECT_RATIO_": ("ASPECT_RATIO", ASPECT_RATIOS),
+    "MODE_MOTIONFLOW_": ("MOTIONFLOW", MOTIONFLOW),
+    "MODE_HDR_": ("HDR", HDR),
+    "MODE_2D_3D_SELECT_": ("2D_3D_DISPLAY_SELECT", TWO_D_THREE_D_SELECT),
+    "MODE_3D_FORMAT_": ("3D_FORMAT", THREE_D_FORMATS),
+    "MODE_ADVANCED_IRIS_": ("ADVANCED_IRIS", ADVANCED_IRIS),
+    "MODE_PICTURE_POSITION_": ("PICTURE_POSITION", PICTURE_POSITIONS),
+    "LAMP_CONTROL_": ("LAMP_CONTROL", LAMP_CONTROL),
+    "INPUT_LAG_REDUCTION_": ("INPUT_LAG_REDUCTION", INPUT_LAG_REDUCTION),
+    "MENU_POSITION_": ("MENU_POSITION", MENU_POSITIONS),
+}
+
+#Commands that are mapped to another simulated ir command
+IR_ALIASES = {
+    "HOME": "MENU",
+    "BACK": "CURSOR_LEFT"
+}
+
+#All command names that are supported by projector.send_cmd in addition to the simple commands
+KNOWN = [
+    ucapi.media_player.Commands.ON,
+    ucapi.media_player.Commands.OFF,
+    ucapi.media_player.Commands.TOGGLE,
+    ucapi.media_player.Commands.MUTE_TOGGLE,
+    ucapi.media_player.Commands.MUTE,
+    ucapi.media_player.Commands.UNMUTE,
+    ucapi.media_player.Commands.HOME,
+    ucapi.media_player.Commands.BACK,
+    ucapi.media_player.Commands.CURSOR_ENTER,
+    ucapi.media_player.Commands.CURSOR_UP,
+    ucapi.media_player.Commands.CURSOR_DOWN,
+    ucapi.media_player.Commands.CURSOR_LEFT,
+    ucapi.media_player.Commands.CURSOR_RIGHT,
+    "PICTURE_MUTING_TOGGLE",
+    "MUTE",
+    "UNMUTE",
+    "HOME",
+    "MENU",
+    "BACK",
+    "CURSOR_ENTER",
+    "CURSOR_UP",
+    "CURSOR_DOWN",
+    "CURSOR_LEFT",
+    "CURSOR_RIGHT"
+]
+
+#Prefixes of commands that save or apply a picture scene. The scene name follows the prefix
+SCENE_SAVE = "SCENE_SAVE:"
+SCENE_APPLY = "SCENE_APPLY:"
+
+#Prefix of commands that are sent to all projectors of a group. The syntax is GROUP:<name>:<command>
+GROUP = "GROUP:"
+
+#Acknowledgement policies. Commands with the policy ACK_SYNC wait for the confirmation from the projector before the command handler returns,
+#commands with ACK_NONE are sent in the background and errors are only logged
+ACK_SYNC = "sync"
+ACK_NONE = "none"
+
+#Commands that depend on the current projector state and can therefore not be expressed as a fixed item and value
+STATEFUL = ["MODE_HDR_TOGGLE"]
+
+
+
+def setting(cmd_name: str, params: dict = None):
+    """Get the item from the COMMANDS table and the value that a simple command sets as a tuple or None if it's not a setting command"""
+    if cmd_name == ucapi.media_player.Commands.SELECT_SOURCE:
+        if params and params.get("source") in ("HDMI 1", "HDMI 2"):
+            cmd_name = "INPUT_" + params["source"].replace(" ", "_")
+        else:
+            return None
+    for prefix, (item, values) in SETTINGS.items():
+        if cmd_name.startswith(prefix):
+            value = values.get(cmd_name.replace(prefix, "", 1))
+            if value is None:
+                return None
+            return item, value
+    return None
+
+
+def item(cmd_name: str, params: dict = None):
+    """Get the item from the COMMANDS table that a setting or stateful command changes or None if it doesn't change a setting"""
+    cmd_setting = setting(cmd_name, params)
+    if cmd_setting is not None:
+        return cmd_setting[0]
+    if cmd_name == "MODE_HDR_TOGGLE":
+        return "HDR"
+    return None
+
+
+def is_known(cmd_name: str) -> bool:
+    """Check if a command name is supported by projector.send_cmd"""
+    return cmd_name in KNOWN or cmd_name in config.simple_commands or is_scene_command(cmd_name) or is_group_command(cmd_name)
+
+
+def is_scene_command(cmd_name: str) -> bool:
+    """Check if a command saves or applies a picture scene and contains a scene name"""
+    for prefix in (SCENE_SAVE, SCENE_APPLY):
+        if cmd_name.startswith(prefix) and cmd_name[len(prefix):].strip() != "":
+            return True
+    return False
+
+
+def group_command(cmd_name: str):
+    """Get the group name and the command from a group command as a tuple or None if it's not a group command"""
+    if not cmd_name.startswith(GROUP):
+        return None
+    parts = cmd_name[len(GROUP):].split(":", 1)
+    if len(parts) != 2 or parts[0].strip() == "" or parts[1].strip() == "":
+        return None
+    return parts[0].strip(), parts[1].strip()
+
+
+def is_group_command(cmd_name: str) -> bool:
+    """Check if a command is a group command with a command that can be sent to all group members as a single request"""
+    command = group_command(cmd_name)
+    return command is not None and group_frame(command[1]) is not None
+
+
+def ir(cmd_name: str):
+    """Get the name from the COMMANDS_IR table for a command that is sent as a simulated ir command or None if it's not an ir command"""
+    name = cmd_name.upper()
+    name = IR_ALIASES.get(name, name)
+    if name in COMMANDS_IR:
+        return name
+    return None
+
+
+def frame(cmd_name: str):
+    """Get the action, command and data of the single SDCP request that a command consists of.
+    Returns None if the command needs more than a single fixed request or updates entity attributes (e.g. power, mute, input or toggles)"""
+    ir_name = ir(cmd_name)
+    if ir_name is not None:
+        return ACTIONS["SET"], COMMANDS_IR[ir_name], None
+    cmd_setting = setting(cmd_name)
+    if cmd_setting is not None and cmd_setting[0] != "INPUT":
+        return ACTIONS["SET"], COMMANDS[cmd_setting[0]], cmd_setting[1]
+    return None
+
+
+def group_frame(cmd_name: str):
+    """Get the action, command and data of the single SDCP request that is sent to all members of a projector group or None
+    if the command can't be sent to a group. Besides the commands from frame this includes power, mute and input commands.
+    Toggles are not supported as the members could be in different states"""
+    if cmd_name in (ucapi.media_player.Commands.ON, ucapi.media_player.Commands.OFF):
+        return ACTIONS["SET"], COMMANDS["SET_POWER"], POWER_STATUS["START_UP"] if cmd_name == ucapi.media_player.Commands.ON else POWER_STATUS["STANDBY"]
+    if cmd_name in (ucapi.media_player.Commands.MUTE, ucapi.media_player.Commands.UNMUTE):
+        return ACTIONS["SET"], COMMANDS["PICTURE_MUTING"], PICTURE_MUTING["ON"] if cmd_name == ucapi.media_player.Commands.MUTE else PICTURE_MUTING["OFF"]
+    cmd_setting = setting(cmd_name)
+    if cmd_setting is not None:
+        return ACTIONS["SET"], COMMANDS[cmd_setting[0]], cmd_setting[1]
+    return frame(cmd_name)
+
+
+def ack_policy(cmd_name: str) -> str:
+    """Get the acknowledgement policy of a command. Navigation and lens commands that are sent as simulated ir commands don't change
+    any entity attributes and are therefore not confirmed. All other commands keep the synchronous confirmation"""
+    if ir(cmd_name) is not None:
+        return ACK_NONE
+    return ACK_SYNC
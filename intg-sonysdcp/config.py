@@ -122,6 +122,16 @@ class LTSensorDef:
 
 
 
+class PictureSensorDef:
+    """Picture setting sensor entity definition class that includes the device class and attributes"""
+    device_class = ucapi.sensor.DeviceClasses.CUSTOM
+    attributes = {
+        ucapi.sensor.Attributes.STATE: ucapi.sensor.States.UNKNOWN,
+        ucapi.sensor.Attributes.VALUE: ""
+        }
+
+
+
 class Setup:
     """Setup class which includes all fixed and customizable variables including functions to set() and get() them from a runtime storage
     which includes storing them in a json config file and as well as load() them from this file"""
@@ -142,12 +152,87 @@ class Setup:
     "sdcp_port": 53484,
     "sdap_port": 53862,
     "pjtalk_community": "SONY",
-    "cfg_path": "config.json"
+    "cfg_path": "config.json",
+    "power_burst_interval": 2, #Power status poll interval in seconds while the projector is warming up or cooling down
+    "power_burst_timeout": 120, #Stop burst polling if the projector has not finished warming up or cooling down after this time in seconds
+    "warmup_queue": True, #Hold back setting commands while the projector is warming up and send them once it's ready
+    "warmup_queue_timeout": 90, #Discard held back commands if the projector is not ready after this time in seconds
+    "hold_interval": 250, #Interval in milliseconds in which a command is resent while it's being held (e.g. for lens or cursor movements)
+    "command_coalescing": True, #Merge or drop rapid duplicate commands that are waiting to be sent to the projector
+    "navigation_backlog": 2, #Maximum number of pending cursor/menu/lens commands. Older commands will be dropped
+    "navigation_max_age": 1500, #Drop pending cursor/menu/lens commands that have been waiting longer than this time in milliseconds
+    "optimistic_updates": True, #Show the expected power/mute/input attributes right away and roll them back if the command fails
+    "optimistic_timeout": 10, #Roll back an optimistic update if the command has not been confirmed by the projector within this time in seconds
+    "timeout_min": 0.5, #Lower bound in seconds for the request timeout that is derived from the measured round trip times
+    "timeout_max": 4, #Upper bound in seconds for the request timeout that is derived from the measured round trip times
+    "retry_deadline": 5, #Overall time in seconds in which a failed request to the projector can be retried
+    "retry_backoff": 100, #Base backoff in milliseconds between retries. Doubled for each retry with a random jitter
+    "scenes": {}, #Picture scenes with the raw values of all picture settings that are saved with the SCENE_SAVE:<name> command
+    "picture_poller_interval": 300, #Interval in seconds in which the picture setting sensors are updated while the projector is on. Use 0 to deactivate
+    "lt_resync_interval": 86400, #Seconds after which the estimated lamp hours are read again from the projector
+    "sdap_listener": True, #Listen for the SDAP advertisements of the projector to receive power changes without polling
+    "prewarm_connection": True, #Open a connection to the projector in the background when the remote wakes up
+    "low_power": False, #Use the low power profile. Always used in bundle mode
+    "memory_report_interval": 0, #Interval in seconds in which the memory usage is logged. Use 0 to deactivate
+    "memory_budget": 48, #Resident set size in MB above which a warning is logged by the memory report
+    "config_reload": True, #Apply external changes of the config file without a restart
+    "groups": {}, #Projector groups with the group name and a list of the ip addresses of all members. Used with GROUP:<name>:<command>
+    "group_parallelism": 4, #Maximum number of group members that a command is sent to at the same time
+    "event_port": 0, #TCP port of the line-delimited JSON event stream with all entity attribute changes. Use 0 to deactivate
+    "proxy_port": 0, #Port of the local SDCP proxy. 0 deactivates the proxy
+    "proxy_cache_age": 10 #Max age in seconds of a cached response that the SDCP proxy uses to answer a GET request
     }
     __setters = ["ip", "id", "name", "rt-id", "lt-id", "lt-name", "setup_complete", "setup_reconfigure", "standby", "bundle_mode",\
-                 "mp_poller_interval", "lt_poller_interval", "cfg_path", "sdcp_port", "sdap_port", "pjtalk_community"]
-    __storers = ["setup_complete", "ip", "id", "name", "sdcp_port", "sdap_port", "pjtalk_community", \
-                 "mp_poller_interval", "lt_poller_interval"] #Skip runtime only related keys in config file
+                 "mp_poller_interval", "lt_poller_interval", "cfg_path", "sdcp_port", "sdap_port", "pjtalk_community", \
+                 "power_burst_interval", "power_burst_timeout", "warmup_queue", "warmup_queue_timeout", "hold_interval", \
+                 "command_coalescing", "navigation_backlog", "navigation_max_age", "optimistic_updates", "optimistic_timeout", \
+                 "timeout_min", "timeout_max", "retry_deadline", "retry_backoff", "scenes", "picture_poller_interval", "lt_resync_interval", \
+                 "sdap_listener", "prewarm_connection", "low_power", "memory_report_interval", "memory_budget", \
+                 "config_reload", "groups", "group_parallelism", "event_port", "proxy_port", "proxy_cache_age"]
+    __storers = ["setup_complete", "ip", "id", "name", "rt-id", "lt-id", "lt-name", "sdcp_port", "sdap_port", "pjtalk_community", \
+                 "mp_poller_interval", "lt_poller_interval", "scenes"] #Skip runtime only related keys in config file
+    __advanced = ["power_burst_interval", "power_burst_timeout", "warmup_queue", "warmup_queue_timeout", "hold_interval", \
+                 "command_coalescing", "navigation_backlog", "navigation_max_age", "optimistic_updates", "optimistic_timeout", \
+                 "timeout_min", "timeout_max", "retry_deadline", "retry_backoff", "picture_poller_interval", "lt_resync_interval", \
+                 "sdap_listener", "prewarm_connection", "low_power", "memory_report_interval", "memory_budget", \
+                 "config_reload", "groups", "group_parallelism", "event_port", "proxy_port", "proxy_cache_age"] #Advanced settings that can only be changed manually in the config file
+    __reloadable = ["sdcp_port", "sdap_port", "pjtalk_community", "mp_poller_interval", "lt_poller_interval"] #Settings besides the advanced settings that can be changed without a new setup
+    __written = None #Modification time and size of the config file after the last change by the integration
+    __limits = {
+    "mp_poller_interval": (int, 0, None),
+    "lt_poller_interval": (int, 0, None),
+    "sdcp_port": (int, 1, 65535),
+    "sdap_port": (int, 1, 65535),
+    "pjtalk_community": (str, None, None),
+    "power_burst_interval": ((int, float), 0.1, None),
+    "power_burst_timeout": ((int, float), 0, None),
+    "warmup_queue": (bool, None, None),
+    "warmup_queue_timeout": ((int, float), 0, None),
+    "hold_interval": ((int, float), 1, None),
+    "command_coalescing": (bool, None, None),
+    "navigation_backlog": (int, 1, None),
+    "navigation_max_age": ((int, float), 0, None),
+    "optimistic_updates": (bool, None, None),
+    "optimistic_timeout": ((int, float), 0, None),
+    "timeout_min": ((int, float), 0.05, None),
+    "timeout_max": ((int, float), 0.05, None),
+    "retry_deadline": ((int, float), 0, None),
+    "retry_backoff": ((int, float), 0, None),
+    "picture_poller_interval": (int, 0, None),
+    "lt_resync_interval": ((int, float), 0, None),
+    "sdap_listener": (bool, None, None),
+    "prewarm_connection": (bool, None, None),
+    "low_power": (bool, None, None),
+    "memory_report_interval": (int, 0, None),
+    "memory_budget": ((int, float), 1, None),
+    "config_reload": (bool, None, None),
+    "groups": (dict, None, None),
+    "group_parallelism": (int, 1, None),
+    "event_port": (int, 0, 65535),
+    "proxy_port": (int, 0, 65535),
+    "proxy_cache_age": ((int, float), 0, None)
+    } #Type and allowed range of settings that can be changed manually in the config file. None means no limit
+    __ordered = [("timeout_min", "timeout_max")] #Pairs of settings where the first value must not be greater than the second
 
 
     @staticmethod
@@ -157,6 +242,33 @@ class Setup:
             raise ValueError("Got empty value for key " + key + " from runtime storage")
         return Setup.__conf[key]
 
+    @staticmethod
+    def validate(key, value):
+        """Check the type and range of a setting that has been changed manually in the config file. Raises a ValueError if the value is invalid"""
+        if key not in Setup.__limits:
+            return
+        value_type, minimum, maximum = Setup.__limits[key]
+        if value_type is bool:
+            if not isinstance(value, bool):
+                raise ValueError("Invalid value " + str(value) + " for " + key + ". The value has to be true or false")
+            return
+        if isinstance(value, bool) or not isinstance(value, value_type):
+            raise ValueError("Invalid value " + json.dumps(value) + " for " + key + ". The value has the wrong type")
+        if minimum is not None and value < minimum:
+            raise ValueError("Invalid value " + str(value) + " for " + key + ". The value has to be at least " + str(minimum))
+        if maximum is not None and value > maximum:
+            raise ValueError("Invalid value " + str(value) + " for " + key + ". The value has to be at most " + str(maximum))
+
+    @staticmethod
+    def validate_order(low: str, high: str, values: dict):
+        """Check that the value of the setting low is not greater than the value of the setting high. Settings that are not included in values
+        are taken from the runtime storage. Raises a ValueError if the values are in the wrong order"""
+        low_value = values.get(low, Setup.__conf[low])
+        high_value = values.get(high, Setup.__conf[high])
+        if low_value > high_value:
+            raise ValueError("Invalid values " + str(low_value) + " for " + low + " and " + str(high_value) + " for " + high + ". " + low + \
+                             " has to be at most " + high)
+
     @staticmethod
     def set_lt_name_id(mp_entity_id: str, mp_entity_name: str):
         """Generate lamp timer sensor entity id and name and store it"""
@@ -198,6 +310,7 @@ class Setup:
                                     f.truncate() #Needed when the new value has less characters than the old value (e.g. false to true)
                                     json.dump(l, f)
                                     _LOG.debug("Stored " + key + ": " + str(value) + " into " + Setup.__conf["cfg_path"])
+                                Setup.__written = Setup.signature()
                             except OSError as o:
                                 raise OSError(o) from o
                             except Exception as e:
@@ -211,6 +324,7 @@ class Setup:
                                     with open(Setup.__conf["cfg_path"], "w", encoding="utf-8") as f:
                                         json.dump(jsondata, f)
                                     _LOG.debug("Stored " + key + ": " + str(value) + " into " + Setup.__conf["cfg_path"])
+                                    Setup.__written = Setup.signature()
                                 except OSError as o:
                                     raise OSError(o) from o
                                 except Exception as e:
@@ -232,6 +346,7 @@ class Setup:
                 raise OSError("Error while reading " + Setup.__conf["cfg_path"]) from e
             if configfile == "":
                 raise OSError("Error in " + Setup.__conf["cfg_path"] + ". No data")
+            Setup.__written = Setup.signature()
 
             Setup.__conf["setup_complete"] = configfile["setup_complete"]
             _LOG.debug("Loaded setup_complete: " + str(configfile["setup_complete"]) + " into runtime storage from " + Setup.__conf["cfg_path"])
@@ -252,6 +367,14 @@ class Setup:
                 else:
                     _LOG.debug("Skip loading id and name as there are not yet stored in the config file")
 
+                if "rt-id" in configfile and "lt-id" in configfile and "lt-name" in configfile:
+                    Setup.__conf["rt-id"] = configfile["rt-id"]
+                    Setup.__conf["lt-id"] = configfile["lt-id"]
+                    Setup.__conf["lt-name"] = configfile["lt-name"]
+                    _LOG.debug("Loaded remote and lamp timer entity ids and names into runtime storage from " + Setup.__conf["cfg_path"])
+                else:
+                    _LOG.debug("Skip loading remote and lamp timer entity ids and names as there are not yet stored in the config file")
+
                 if "sdcp_port" in configfile:
                     Setup.__conf["sdcp_port"] = configfile["sdcp_port"]
                     _LOG.debug("Loaded SDCP port " + str(configfile["sdcp_port"]) + " into runtime storage from " + Setup.__conf["cfg_path"])
@@ -274,5 +397,83 @@ class Setup:
                     _LOG.debug("Loaded lamp timer poller interval of " + str(configfile["lt_poller_interval"]) + " seconds into runtime storage \
                                from " + Setup.__conf["cfg_path"])
 
+                if "scenes" in configfile:
+                    Setup.__conf["scenes"] = configfile["scenes"]
+                    _LOG.debug("Loaded scenes " + str(list(configfile["scenes"])) + " into runtime storage from " + Setup.__conf["cfg_path"])
+
+                values = {}
+                for key in Setup.__advanced:
+                    if key in configfile:
+                        try:
+                            Setup.validate(key, configfile[key])
+                        except ValueError as v:
+                            _LOG.warning(str(v) + ". Using the default value " + str(Setup.__conf[key]))
+                            continue
+                        values[key] = configfile[key]
+                for low, high in Setup.__ordered:
+                    try:
+                        Setup.validate_order(low, high, values)
+                    except ValueError as v:
+                        _LOG.warning(str(v) + ". Using the default values " + str(Setup.__conf[low]) + " and " + str(Setup.__conf[high]))
+                        values.pop(low, None)
+                        values.pop(high, None)
+                for key, value in values.items():
+                    Setup.__conf[key] = value
+                    _LOG.debug("Loaded " + key + ": " + str(value) + " into runtime storage from " + Setup.__conf["cfg_path"])
+
         else:
             _LOG.info(Setup.__conf["cfg_path"] + " does not exist (yet). Please start the setup process")
+
+    @staticmethod
+    def signature():
+        """Get the modification time and size of the config file or None if it doesn't exist"""
+        try:
+            stat = os.stat(Setup.__conf["cfg_path"])
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def changed_externally() -> bool:
+        """Check if the config file has been changed by someone else than the integration since the last load or change"""
+        return Setup.signature() != Setup.__written
+
+    @staticmethod
+    def reload() -> dict:
+        """Load all settings that can be changed without a new setup from the config file into the runtime storage.
+        Returns all changed keys with their old and new value. Changes to other keys like the ip address or entity ids are ignored"""
+        Setup.__written = Setup.signature()
+        try:
+            with open(Setup.__conf["cfg_path"], "r", encoding="utf-8") as f:
+                configfile = json.load(f)
+        except Exception as e:
+            raise OSError("Error while reading " + Setup.__conf["cfg_path"]) from e
+
+        values = {}
+        for key in Setup.__reloadable + Setup.__advanced:
+            if key in configfile and configfile[key] != Setup.__conf[key]:
+                try:
+                    Setup.validate(key, configfile[key])
+                except ValueError as v:
+                    _LOG.warning(str(v) + ". Keeping the current value " + str(Setup.__conf[key]))
+                    continue
+                values[key] = configfile[key]
+        for low, high in Setup.__ordered:
+            try:
+                Setup.validate_order(low, high, values)
+            except ValueError as v:
+                _LOG.warning(str(v) + ". Keeping the current values " + str(Setup.__conf[low]) + " and " + str(Setup.__conf[high]))
+                values.pop(low, None)
+                values.pop(high, None)
+
+        changes = {}
+        for key, value in values.items():
+            changes[key] = (Setup.__conf[key], value)
+            Setup.__conf[key] = value
+            _LOG.debug("Reloaded " + key + ": " + str(value) + " into runtime storage from " + Setup.__conf["cfg_path"])
+
+        for key in ("ip", "id", "name"):
+            if key in configfile and configfile[key] != Setup.__conf[key]:
+                _LOG.warning("The changed value for " + key + " in " + Setup.__conf["cfg_path"] + " will only be used after a new setup")
+
+        return changes
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Module that includes the config file watcher which applies external changes of the config file without a restart or a new setup"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+import config
+import driver
+import lowpower
+
+_LOG = logging.getLogger(__name__)
+
+POLL_INTERVAL = 10 #Seconds between two checks of the config file if inotify is not available
+DEBOUNCE = 0.5 #Seconds to wait after a change as editors may write the file in multiple steps
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+EVENT = struct.Struct("iIII") #Watch descriptor, mask, cookie, name length
+
+
+
+class Watcher:
+    """Watches the config file with inotify or by polling its modification time if inotify is not available on this platform.
+    Changes that have been made by the integration itself are ignored"""
+
+    __fd = None
+
+    @staticmethod
+    def start():
+        """Start watching the config file if it's not already watched"""
+        if not config.Setup.get("config_reload"):
+            _LOG.debug("Config file reload is deactivated")
+            return
+        if Watcher.__fd is not None or [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == "config_poller" and not task.done()]:
+            return
+        path = config.Setup.get("cfg_path")
+        try:
+            Watcher.__fd = inotify(os.path.dirname(os.path.abspath(path)))
+            driver.loop.add_reader(Watcher.__fd, Watcher.on_event)
+            _LOG.info("Watching " + path + " for changes with inotify")
+        except (OSError, AttributeError) as e:
+            Watcher.stop()
+            _LOG.debug("inotify is not available: " + str(e))
+            driver.loop.create_task(config_poller(), name="config_poller")
+            _LOG.info("Watching " + path + " for changes every " + str(POLL_INTERVAL) + " seconds")
+
+    @staticmethod
+    def stop():
+        """Stop watching the config file"""
+        if Watcher.__fd is not None:
+            driver.loop.remove_reader(Watcher.__fd)
+            os.close(Watcher.__fd)
+            Watcher.__fd = None
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() in ("config_poller", "config_reload"):
+                task.cancel()
+
+    @staticmethod
+    def on_event():
+        """Read all pending inotify events and schedule a reload if the config file has been written or replaced"""
+        name = os.path.basename(config.Setup.get("cfg_path"))
+        try:
+            data = os.read(Watcher.__fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        changed = False
+        while offset + EVENT.size <= len(data):
+            _, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            if data[offset:offset + length].rstrip(b"\0").decode(errors="replace") == name:
+                changed = True
+            offset += length
+        if changed:
+            schedule()
+
+
+
+def inotify(directory: str) -> int:
+    """Create an inotify file descriptor that watches the directory of the config file. Editors often replace the file instead of writing it,
+    so the directory is watched instead of the file itself. Raises an OSError if inotify is not available"""
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    if libc.inotify_add_watch(fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, "inotify_add_watch failed for " + directory)
+    return fd
+
+
+def schedule():
+    """Reload the config file shortly after the last change"""
+    for task in asyncio.all_tasks(driver.loop):
+        if task.get_name() == "config_reload":
+            task.cancel()
+    driver.loop.create_task(delayed_reload(), name="config_reload")
+
+
+
+async def delayed_reload():
+    """Reload the config file after the debounce time"""
+    await asyncio.sleep(DEBOUNCE)
+    await reload()
+
+
+
+async def config_poller():
+    """Config file poller task that is used if inotify is not available"""
+    while True:
+        await lowpower.sleep("config_poller", POLL_INTERVAL)
+        await reload()
+
+
+
+async def reload():
+    """Load the changed settings from the config file if it has been changed externally and apply them"""
+    if not config.Setup.changed_externally():
+        return
+    if not config.Setup.get("setup_complete") or config.Setup.get("setup_reconfigure"):
+        _LOG.debug("Ignore config file change as the setup has not been completed")
+        return
+    try:
+        changes = config.Setup.reload()
+    except OSError as o:
+        _LOG.warning("Could not reload the config file: " + str(o))
+        return
+    if not changes:
+        _LOG.debug("The config file has been changed but no settings that can be reloaded")
+        return
+    _LOG.info("Reloaded changed settings from the config file: " + ", ".join(key + " " + str(old) + " -> " + str(new) for key, (old, new) in changes.items()))
+    await apply(changes)
+
+
+
+async def cancel(name: str):
+    """Cancel a task and wait until it has been cancelled, so it can be started again right away"""
+    tasks = [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == name]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+
+async def apply(changes: dict):
+    """Restart only the tasks and connections that depend on the changed settings. All entities stay registered as they are.
+    Settings that are read each time they are used (e.g. timeouts or the optimistic updates) don't need any action"""
+    import connection # pylint: disable=import-outside-toplevel
+    import events # pylint: disable=import-outside-toplevel
+    import media_player # pylint: disable=import-outside-toplevel
+    import memory # pylint: disable=import-outside-toplevel
+    import proxy # pylint: disable=import-outside-toplevel
+    import sdap # pylint: disable=import-outside-toplevel
+    import sensor # pylint: disable=import-outside-toplevel
+
+    try:
+        ip = config.Setup.get("ip")
+        mp_entity_id = config.Setup.get("id")
+        rt_entity_id = config.Setup.get("rt-id")
+        lt_entity_id = config.Setup.get("lt-id")
+    except ValueError as v:
+        _LOG.warning("Could not apply the changed settings: " + str(v))
+        return
+
+    configured = driver.api.configured_entities.get
+
+    if "mp_poller_interval" in changes and configured(mp_entity_id) is not None:
+        await media_player.MpPollerController.start(mp_entity_id, ip)
+    if ("lt_poller_interval" in changes or "lt_resync_interval" in changes) and configured(lt_entity_id) is not None:
+        await sensor.LtPollerController.start(lt_entity_id, ip)
+    if "picture_poller_interval" in changes:
+        await cancel("picture_poller")
+        if sensor.PictureSensors.configured():
+            sensor.PictureSensors.start(ip)
+    if [key for key in ("sdcp_port", "pjtalk_community", "prewarm_connection") if key in changes]:
+        #All other connections are only open while a command is sent
+        connection.Prewarm.cancel()
+    if "sdap_port" in changes or "sdap_listener" in changes:
+        sdap.Listener.stop()
+        if configured(mp_entity_id) is not None or configured(rt_entity_id) is not None:
+            await sdap.Listener.start()
+    if "event_port" in changes:
+        await events.Stream.stop()
+        await events.Stream.start()
+    if "proxy_port" in changes:
+        await proxy.Proxy.stop()
+        await proxy.Proxy.start()
+    elif "sdcp_port" in changes or "pjtalk_community" in changes:
+        proxy.Proxy.close_upstream()
+    if "memory_report_interval" in changes:
+        await cancel("memory_poller")
+        memory.Report.start()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+"""Module that includes the connection layer to send multiple SDCP requests to the projector over a single TCP connection"""
+
+import asyncio
+import socket
+import logging
+import select
+import threading
+import time
+
+import pysdcp_extended as pysdcp
+from pysdcp_extended.protocol import ACTIONS, COMMANDS, RESPONSE_ERRORS
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+HEADER_SIZE = 10 #Version, category, community (4), action/success, command (2), data length
+INITIAL_TIMEOUT = 2 #Timeout in seconds until the first round trip time has been measured
+#SET commands that change the value of other GET commands than their own
+CACHE_RELATED = {COMMANDS["SET_POWER"]: [COMMANDS["GET_STATUS_POWER"]]}
+PREWARM_MAX_AGE = 60 #Seconds after which a pre-warmed connection is no longer used as the projector may have closed it in the meantime
+
+
+
+def is_open(sock: socket.socket) -> bool:
+    """Check if an idle connection can still be used for a request. The projector closes idle connections, which makes the socket readable
+    with EOF. Unexpected data from the projector would be mistaken for the response of the next request, so readable sockets are never used"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def is_ir_command(command: int, data: int | None = None) -> bool:
+    """Check if a command is a simulated ir command. The projector does not send a response for these commands"""
+    return data is None and str(hex(command)).startswith(("0x17", "0x19", "0x1b"))
+
+
+
+class CountedTimeoutError(TimeoutError):
+    """Raised if the projector could not be connected or didn't respond within the timeout. The timeout has already been counted
+    with RoundTrip.expired, so it must not be counted again by the caller"""
+
+
+
+class ResponseLostError(ConnectionResetError):
+    """Raised if the connection has been closed after a request has been sent but before the response has been received.
+    The action of the request is available as action to decide if the request can be sent again"""
+
+    def __init__(self, msg: str, action: int):
+        super().__init__(msg)
+        self.action = action
+
+
+
+class NakError(Exception):
+    """Raised if the projector responds with a failed status. The error code from the RESPONSE_ERRORS table is available as code"""
+
+    def __init__(self, msg: str, code: int):
+        super().__init__(msg)
+        self.code = code
+
+
+
+class RoundTrip:
+    """Estimates the round trip time for each projector as an exponentially weighted moving average with a variance estimate (like the TCP retransmission timer)
+    and derives the timeout for requests from it. The timeout is bounded by the configured minimum and maximum timeout"""
+
+    __estimates = {}
+
+    ALPHA = 1/8 #Weight of a new sample for the smoothed round trip time
+    BETA = 1/4 #Weight of a new sample for the round trip time variance
+    K = 4 #Number of variances that are added to the smoothed round trip time
+
+    @staticmethod
+    def add(ip: str, rtt: float):
+        """Add a measured round trip time in seconds"""
+        estimate = RoundTrip.__estimates.get(ip)
+        if estimate is None:
+            RoundTrip.__estimates[ip] = {"srtt": rtt, "rttvar": rtt / 2, "backoff": 1, "samples": 1}
+            _LOG.debug("First round trip time to " + ip + ": " + str(round(rtt * 1000)) + " ms. Timeout is now " \
+                       + str(round(RoundTrip.timeout(ip) * 1000)) + " ms")
+            return
+        estimate["rttvar"] = (1 - RoundTrip.BETA) * estimate["rttvar"] + RoundTrip.BETA * abs(estimate["srtt"] - rtt)
+        estimate["srtt"] = (1 - RoundTrip.ALPHA) * estimate["srtt"] + RoundTrip.ALPHA * rtt
+        estimate["backoff"] = 1
+        estimate["samples"] += 1
+
+    @staticmethod
+    def expired(ip: str):
+        """Double the timeout after a request has timed out until the next successful request. A slow response is not mistaken for a lost projector"""
+        estimate = RoundTrip.__estimates.get(ip)
+        if estimate is not None and RoundTrip.timeout(ip) < config.Setup.get("timeout_max"):
+            estimate["backoff"] *= 2
+            _LOG.debug("Request to " + ip + " timed out. Increased timeout to " + str(round(RoundTrip.timeout(ip) * 1000)) + " ms")
+
+    @staticmethod
+    def timeout(ip: str) -> float:
+        """Get the current timeout in seconds for requests to a projector"""
+        timeout_min = config.Setup.get("timeout_min")
+        timeout_max = config.Setup.get("timeout_max")
+        estimate = RoundTrip.__estimates.get(ip)
+        if estimate is None:
+            return min(max(INITIAL_TIMEOUT, timeout_min), timeout_max)
+        timeout = max(estimate["srtt"] + RoundTrip.K * estimate["rttvar"], timeout_min) * estimate["backoff"]
+        return min(timeout, timeout_max)
+
+    @staticmethod
+    def stats(ip: str) -> dict:
+        """Get the current round trip time estimate and timeout in milliseconds for a projector"""
+        estimate = RoundTrip.__estimates.get(ip)
+        if estimate is None:
+            return {"timeout_ms": round(RoundTrip.timeout(ip) * 1000)}
+        return {
+            "srtt_ms": round(estimate["srtt"] * 1000, 1),
+            "rttvar_ms": round(estimate["rttvar"] * 1000, 1),
+            "timeout_ms": round(RoundTrip.timeout(ip) * 1000),
+            "samples": estimate["samples"]
+        }
+
+
+
+class Upstream:
+    """Shared connections to projectors that are owned by the SDCP proxy. While a projector has a shared connection all sessions
+    to this projector hand their requests to the proxy instead of opening their own connection, so there is only one connection"""
+
+    __submitters = {}
+
+    @staticmethod
+    def attach(ip: str, submit):
+        """Send all requests to a projector with a function that takes a complete request and returns the complete response"""
+        Upstream.__submitters[ip] = submit
+
+    @staticmethod
+    def detach(ip: str):
+        """Let sessions open their own connection to a projector again"""
+        Upstream.__submitters.pop(ip, None)
+
+    @staticmethod
+    def get(ip: str):
+        """Get the function that sends a request over the shared connection to a projector or None if there is none"""
+        return Upstream.__submitters.get(ip)
+
+
+
+class Session:
+    """SDCP session that sends all requests over one TCP connection to the projector.
+    The connection will be re-established once if it has been closed by the projector in the meantime.
+    If the SDCP proxy owns a shared connection to the projector the requests are sent over that connection instead (see Upstream)"""
+
+    __slots__ = ("ip", "port", "timeout", "header", "sock", "direct")
+
+    def __init__(self, ip: str, timeout: float = None, direct: bool = False):
+        """:param direct: always use an own connection, even if there is a shared connection to the projector"""
+        self.direct = direct
+        self.ip = ip
+        self.port = config.Setup.get("sdcp_port")
+        if timeout is None:
+            timeout = RoundTrip.timeout(ip)
+        self.timeout = timeout
+        self.header = pysdcp.Header(version=2, category=10, community=config.Setup.get("pjtalk_community"))
+        self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def shared(self):
+        """Get the function that sends a request over the shared connection of the SDCP proxy or None if the session uses an own connection"""
+        return None if self.direct else Upstream.get(self.ip)
+
+    def connect(self):
+        """Open the TCP connection to the projector or take over a pre-warmed connection. Nothing to do if the connection is shared"""
+        self.close()
+        if self.shared() is not None:
+            return
+        sock = Prewarm.take(self.ip, self.port)
+        if sock is not None:
+            sock.settimeout(self.timeout)
+            self.sock = sock
+            _LOG.debug("Using pre-warmed SDCP connection to " + self.ip + ":" + str(self.port))
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        start = time.monotonic()
+        try:
+            sock.connect((self.ip, int(self.port)))
+        except socket.timeout as t:
+            sock.close()
+            RoundTrip.expired(self.ip)
+            raise CountedTimeoutError("Timeout while connecting to " + self.ip + ":" + str(self.port)) from t
+        except OSError:
+            sock.close()
+            raise
+        RoundTrip.add(self.ip, time.monotonic() - start)
+        self.sock = sock
+        _LOG.debug("Opened SDCP connection to " + self.ip + ":" + str(self.port))
+
+    def close(self):
+        """Close the TCP connection to the projector if it's open"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    def _recv_exactly(self, size: int) -> bytes:
+        buffer = b""
+        while len(buffer) < size:
+            chunk = self.sock.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionResetError("Connection has been closed by the projector")
+            buffer += chunk
+        return buffer
+
+    def _send(self, buffer: bytearray) -> float:
+        if self.sock is None:
+            self.connect()
+        start = time.monotonic()
+        self.sock.sendall(buffer)
+        return start
+
+    def _receive(self, command: int, action: int) -> bytes:
+        try:
+            response = self._recv_exactly(HEADER_SIZE)
+            response += self._recv_exactly(response[9])
+        except ConnectionResetError as c:
+            self.close()
+            raise ResponseLostError("Connection has been closed by the projector after sending command 0x{:04x}".format(command), action) from c
+        return response
+
+    def forward(self, buffer: bytes):
+        """Send a complete SDCP request to the projector and return the complete response or None for simulated ir commands.
+        Successful GET responses are added to the response cache and SET requests invalidate the cached responses they affect.
+        Requests of sessions with a shared connection are handed to the SDCP proxy.
+
+        The request is only sent again over a new connection if the connection failed before the request has been written completely.
+        If the connection fails while waiting for the response the projector may already have executed the request, so a ResponseLostError
+        is raised and the retry policy decides if the request can be sent again (see retry.retries)"""
+        submit = self.shared()
+        if submit is not None:
+            return submit(buffer)
+
+        action = buffer[6]
+        command = int.from_bytes(buffer[7:9], "big")
+        wait_for_response = not is_ir_command(command, int.from_bytes(buffer[10:12], "big") if buffer[9] else None)
+
+        try:
+            try:
+                start = self._send(buffer)
+            except (ConnectionResetError, BrokenPipeError):
+                _LOG.debug("SDCP connection has been closed by the projector. Reconnecting")
+                self.connect()
+                start = self._send(buffer)
+            if wait_for_response:
+                response = self._receive(command, action)
+                RoundTrip.add(self.ip, time.monotonic() - start)
+            else:
+                response = None
+        except CountedTimeoutError:
+            #Already counted by connect. socket.timeout is an alias of TimeoutError since Python 3.10, so it has to be handled first
+            self.close()
+            raise
+        except socket.timeout as t:
+            self.close()
+            RoundTrip.expired(self.ip)
+            raise CountedTimeoutError("Timeout while sending command 0x{:04x} to the projector".format(command)) from t
+        except OSError:
+            self.close()
+            if action != ACTIONS["GET"]:
+                Cache.invalidate(self.ip, command)
+            raise
+
+        if action == ACTIONS["GET"]:
+            if response is not None and response[6]:
+                Cache.put(self.ip, command, response)
+        else:
+            Cache.invalidate(self.ip, command)
+
+        return response
+
+    def request(self, action: int, command: int, data: int = None):
+        """Send a request to the projector and return the response data. Simulated ir commands return True as there is no response"""
+        response = self.forward(pysdcp.create_command_buffer(self.header, action, command, data))
+
+        if response is None:
+            return True
+
+        _, is_success, _, response_data = pysdcp.process_command_response(response)
+
+        if not is_success:
+            try:
+                error_msg = RESPONSE_ERRORS[response_data]
+            except KeyError:
+                error_msg = "Unknown error code: {:x}".format(response_data)
+            raise NakError("Received failed status from projector while sending command 0x{:04x}. ".format(command) + error_msg, response_data)
+
+        return response_data
+
+    def drain(self, wait: float = 0.1):
+        """Read and discard all data that the projector has sent since the last request, e.g. replies to simulated ir commands.
+        Waits up to the given time in seconds for late data and raises an exception if the data contains a failed status.
+        Shared connections are drained by the SDCP proxy after each simulated ir command"""
+        if self.sock is None:
+            return
+        self.sock.settimeout(wait)
+        buffer = b""
+        try:
+            while True:
+                chunk = self.sock.recv(1024)
+                if not chunk:
+                    break
+                buffer += chunk
+        except socket.timeout:
+            pass
+        except OSError:
+            self.close()
+        finally:
+            if self.sock is not None:
+                self.sock.settimeout(self.timeout)
+
+        while len(buffer) >= HEADER_SIZE:
+            size = HEADER_SIZE + buffer[9]
+            if len(buffer) < size:
+                break
+            response = buffer[:size]
+            buffer = buffer[size:]
+            _, is_success, command, response_data = pysdcp.process_command_response(response)
+            if not is_success:
+                try:
+                    error_msg = RESPONSE_ERRORS[response_data]
+                except KeyError:
+                    error_msg = "Unknown error code: {:x}".format(response_data)
+                raise NakError("Received failed status from projector for command 0x{:04x}. ".format(command) + error_msg, response_data)
+
+    def get(self, item: str):
+        """Get the current value of an item from the COMMANDS table"""
+        return self.request(ACTIONS["GET"], COMMANDS[item])
+
+    def get_items(self, items: list[str]) -> dict:
+        """Get the current values of multiple items from the COMMANDS table. Items that the projector rejects are skipped"""
+        values = {}
+        for item in items:
+            try:
+                values[item] = self.get(item)
+            except (TimeoutError, OSError):
+                raise
+            except Exception as e:
+                _LOG.warning("Could not get " + item + " from the projector: " + str(e))
+        return values
+
+
+
+class Cache:
+    """Raw responses of the last successful GET requests to the projector, e.g. from the pollers. Used by the SDCP proxy to answer GET requests
+    of other clients without sending them to the projector"""
+
+    __responses = {}
+
+    @staticmethod
+    def put(ip: str, command: int, response: bytes):
+        """Store the response of a GET request"""
+        Cache.__responses[(ip, command)] = (time.monotonic(), bytes(response))
+
+    @staticmethod
+    def get(ip: str, command: int, max_age: float):
+        """Get the stored response of a GET request or None if there is none that is younger than max_age seconds"""
+        cached = Cache.__responses.get((ip, command))
+        if cached is None or time.monotonic() - cached[0] > max_age:
+            return None
+        return cached[1]
+
+    @staticmethod
+    def invalidate(ip: str, command: int):
+        """Remove the stored responses that are affected by a SET request. Simulated ir commands can change any setting"""
+        if is_ir_command(command):
+            for key in [key for key in Cache.__responses if key[0] == ip]:
+                del Cache.__responses[key]
+            return
+        Cache.__responses.pop((ip, command), None)
+        for related in CACHE_RELATED.get(command, []):
+            Cache.__responses.pop((ip, related), None)
+
+
+
+class Prewarm:
+    """Opens a connection to the projector in the background when the remote wakes up, so the first command after wake-up
+    doesn't have to wait for the connect. The connection is taken over by the next session and closed if the remote goes back to standby"""
+
+    __lock = threading.Lock()
+    __sock = None
+    __target = None
+    __opened = 0.0
+    __generation = 0
+
+    @staticmethod
+    async def run(ip: str):
+        """Open and check a connection to the projector in a separate thread. A pre-warmed connection that is still open will be kept.
+        Nothing to do if the SDCP proxy owns a shared connection to the projector"""
+        if Upstream.get(ip) is not None:
+            return
+        with Prewarm.__lock:
+            if Prewarm.__sock is not None and Prewarm.__target == (ip, config.Setup.get("sdcp_port")) \
+                and time.monotonic() - Prewarm.__opened < PREWARM_MAX_AGE:
+                return
+            generation = Prewarm.__generation
+        await asyncio.to_thread(Prewarm.open, ip, generation)
+
+    @staticmethod
+    def open(ip: str, generation: int):
+        """Connect to the projector and send a power status request to make sure the PJ Talk community is accepted"""
+        session = Session(ip)
+        try:
+            session.connect()
+            session.get("GET_STATUS_POWER")
+        except Exception as e:
+            session.close()
+            _LOG.debug("Could not pre-warm the connection to " + ip + ": " + str(e))
+            return
+
+        with Prewarm.__lock:
+            if generation != Prewarm.__generation:
+                #Cancelled while connecting
+                session.close()
+                return
+            Prewarm.__close()
+            Prewarm.__sock, session.sock = session.sock, None
+            Prewarm.__target = (ip, session.port)
+            Prewarm.__opened = time.monotonic()
+        _LOG.debug("Pre-warmed SDCP connection to " + ip + ":" + str(session.port))
+
+    @staticmethod
+    def ready(ip: str, port) -> bool:
+        """Check if there is a recent pre-warmed connection to the given projector"""
+        with Prewarm.__lock:
+            return Prewarm.__sock is not None and Prewarm.__target == (ip, port) and time.monotonic() - Prewarm.__opened <= PREWARM_MAX_AGE
+
+    @staticmethod
+    def take(ip: str, port):
+        """Take over the pre-warmed connection if there is a recent one to the given projector that is still open. Returns the socket or None"""
+        with Prewarm.__lock:
+            if Prewarm.__sock is None or Prewarm.__target != (ip, port) or time.monotonic() - Prewarm.__opened > PREWARM_MAX_AGE:
+                Prewarm.__close()
+                return None
+            sock, Prewarm.__sock = Prewarm.__sock, None
+        if not is_open(sock):
+            sock.close()
+            _LOG.debug("Pre-warmed SDCP connection has been closed by the projector")
+            return None
+        return sock
+
+    @staticmethod
+    def cancel():
+        """Discard a pending pre-warm and close the pre-warmed connection"""
+        with Prewarm.__lock:
+            Prewarm.__generation += 1
+            Prewarm.__close()
+
+    @staticmethod
+    def __close():
+        if Prewarm.__sock is not None:
+            Prewarm.__sock.close()
+            Prewarm.__sock = None
+            _LOG.debug("Closed pre-warmed SDCP connection")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Module that includes the queue for commands that are held back while the projector is still warming up"""
+
+import asyncio
+import logging
+import time
+
+import commands
+import config
+import driver
+import power
+
+_LOG = logging.getLogger(__name__)
+
+
+
+class WarmupQueue:
+    """Holds setting commands that have been sent while the projector is warming up and replays them in order once it's ready.
+    A command replaces an already queued command that changes the same setting"""
+
+    __queue = {}
+    __counter = 0
+
+    @staticmethod
+    def accepts(cmd_name: str, params: dict = None) -> bool:
+        """Check if a command should be held back. Only setting commands are held back and only while the projector is warming up"""
+        if not config.Setup.get("warmup_queue"):
+            return False
+        if power.Transition.get() != power.WARMING:
+            return False
+        return commands.item(cmd_name, params) is not None
+
+    @staticmethod
+    def add(entity_id: str, ip: str, cmd_name: str, params: dict = None):
+        """Add a command to the queue and start the replay task if it's not already running"""
+        if cmd_name in commands.STATEFUL:
+            #Stateful commands like toggles depend on the previous commands and can't replace each other
+            WarmupQueue.__counter += 1
+            key = cmd_name + "#" + str(WarmupQueue.__counter)
+        else:
+            key = commands.item(cmd_name, params)
+
+        if key in WarmupQueue.__queue:
+            superseded = WarmupQueue.__queue.pop(key)[2]
+            _LOG.info("Replaced queued command " + superseded + " with " + cmd_name)
+
+        WarmupQueue.__queue[key] = (entity_id, ip, cmd_name, params, time.monotonic())
+        _LOG.info("Projector is still warming up. Queued command " + cmd_name + " until the projector is ready")
+
+        if not [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == "warmup_queue" and not task.done()]:
+            driver.loop.create_task(replay(), name="warmup_queue")
+
+    @staticmethod
+    def pop_all() -> list:
+        """Remove and return all queued commands in the order they should be sent"""
+        queued = list(WarmupQueue.__queue.values())
+        WarmupQueue.__queue.clear()
+        return queued
+
+    @staticmethod
+    def clear(reason: str):
+        """Discard all queued commands"""
+        if WarmupQueue.__queue:
+            _LOG.warning("Discarded queued commands " + str([queued[2] for queued in WarmupQueue.__queue.values()]) + ". " + reason)
+            WarmupQueue.__queue.clear()
+
+
+
+async def replay():
+    """Wait until the projector has finished warming up and then send all queued commands in order.
+    All commands will be discarded if the projector is not ready within the configured timeout"""
+    import projector # pylint: disable=import-outside-toplevel
+
+    timeout = config.Setup.get("warmup_queue_timeout")
+    start = time.monotonic()
+
+    while power.Transition.get() == power.WARMING:
+        if time.monotonic() - start > timeout:
+            WarmupQueue.clear("The projector was not ready within " + str(timeout) + " seconds")
+            return
+        await asyncio.sleep(0.5)
+
+    if power.Transition.get() != power.ON:
+        WarmupQueue.clear("The projector has not been turned on")
+        return
+
+    for entity_id, ip, cmd_name, params, queued in WarmupQueue.pop_all():
+        _LOG.info("Sending queued command " + cmd_name + " after " + str(round(time.monotonic() - queued, 1)) + " seconds")
+        try:
+            await projector.send_cmd(entity_id, ip, cmd_name, params)
+        except Exception as e:
+            _LOG.warning("Queued command " + cmd_name + " failed: " + str(e))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Module that includes the command dispatcher which coalesces rapid duplicate user commands before they are sent to the projector"""
+
+import asyncio
+import logging
+import time
+
+import ucapi
+
+import commands
+import config
+import driver
+import projector
+
+_LOG = logging.getLogger(__name__)
+
+#Toggle commands where two pending presses cancel each other out
+TOGGLES = ["MODE_HDR_TOGGLE", "PICTURE_MUTING_TOGGLE", ucapi.media_player.Commands.MUTE_TOGGLE]
+
+SETTING = "setting"
+NAVIGATION = "navigation"
+TOGGLE = "toggle"
+OTHER = "other"
+
+
+
+def kind(cmd_name: str, params: dict = None) -> str:
+    """Get the coalescing kind of a command"""
+    if cmd_name in TOGGLES:
+        return TOGGLE
+    if commands.ir(cmd_name) is not None:
+        return NAVIGATION
+    if commands.setting(cmd_name, params) is not None:
+        return SETTING
+    return OTHER
+
+
+
+def report(cmd_name: str, done: asyncio.Future):
+    """Report the result of a command that has been sent without waiting for its confirmation"""
+    if done.cancelled():
+        return
+    exception = done.exception()
+    if exception is not None:
+        _LOG.warning("Unconfirmed command " + cmd_name + " failed: " + str(exception))
+
+
+
+class Pending:
+    """A command that waits to be sent to the projector including the futures of all callers that wait for its result"""
+
+    __slots__ = ("entity_id", "ip", "cmd_name", "params", "kind", "queued", "futures")
+
+    def __init__(self, entity_id: str, ip: str, cmd_name: str, params: dict = None):
+        self.entity_id = entity_id
+        self.ip = ip
+        self.cmd_name = cmd_name
+        self.params = params
+        self.kind = kind(cmd_name, params)
+        self.queued = time.monotonic()
+        self.futures = [driver.loop.create_future()]
+
+    def resolve(self, exception: Exception = None):
+        """Pass the result to all waiting callers"""
+        for future in self.futures:
+            if future.done():
+                continue
+            if exception is None:
+                future.set_result(None)
+            else:
+                future.set_exception(exception)
+
+
+
+class Dispatcher:
+    """Sends user commands one after another to the projector. While a command is being sent, new commands are coalesced:
+    Setting commands replace a pending command for the same setting, two pending presses of the same toggle cancel each other out,
+    the backlog of navigation commands is capped and navigation commands that waited too long are discarded"""
+
+    __pending = []
+    __stats = {"submitted": 0, "sent": 0, "merged": 0, "dropped": 0}
+
+    @staticmethod
+    def stats() -> dict:
+        """Get the number of submitted, sent, merged and dropped commands since the start of the integration"""
+        return dict(Dispatcher.__stats)
+
+    @staticmethod
+    async def submit(entity_id: str, ip: str, cmd_name: str, params: dict = None):
+        """Submit a command and wait until it has been sent, merged or dropped. Raises an exception if sending the command fails.
+        Commands without acknowledgement (see commands.ack_policy) return right away and errors are only logged"""
+        acknowledge = commands.ack_policy(cmd_name) == commands.ACK_SYNC
+
+        if not config.Setup.get("command_coalescing"):
+            if acknowledge:
+                await projector.send_cmd(entity_id, ip, cmd_name, params)
+            else:
+                task = driver.loop.create_task(projector.send_cmd(entity_id, ip, cmd_name, params))
+                task.add_done_callback(lambda done: report(cmd_name, done))
+            return
+
+        Dispatcher.__stats["submitted"] += 1
+        new = Pending(entity_id, ip, cmd_name, params)
+        future = new.futures[0]
+
+        if not Dispatcher.__coalesce(new):
+            Dispatcher.__pending.append(new)
+
+        if not [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == "command_dispatcher" and not task.done()]:
+            driver.loop.create_task(Dispatcher.__worker(), name="command_dispatcher")
+
+        if acknowledge:
+            await future
+        else:
+            #Return without waiting for the projector. Errors will be reported once the command has been sent
+            future.add_done_callback(lambda done: report(cmd_name, done))
+
+    @staticmethod
+    def __coalesce(new: Pending) -> bool:
+        """Coalesce a new command with the pending commands. Returns True if the new command doesn't need to be queued anymore"""
+        pending = Dispatcher.__pending
+
+        if new.kind == SETTING:
+            item = commands.item(new.cmd_name, new.params)
+            for queued in pending:
+                if queued.kind == SETTING and commands.item(queued.cmd_name, queued.params) == item:
+                    _LOG.debug("Merged pending command " + queued.cmd_name + " with " + new.cmd_name)
+                    queued.cmd_name = new.cmd_name
+                    queued.params = new.params
+                    queued.futures.extend(new.futures)
+                    Dispatcher.__stats["merged"] += 1
+                    return True
+
+        elif new.kind == TOGGLE:
+            for queued in pending:
+                if queued.cmd_name == new.cmd_name:
+                    _LOG.debug("Two pending " + new.cmd_name + " commands cancel each other out")
+                    pending.remove(queued)
+                    queued.resolve()
+                    new.resolve()
+                    Dispatcher.__stats["merged"] += 2
+                    return True
+
+        elif new.kind == NAVIGATION:
+            navigation = [queued for queued in pending if queued.kind == NAVIGATION]
+            while navigation and len(navigation) >= config.Setup.get("navigation_backlog"):
+                oldest = navigation.pop(0)
+                _LOG.debug("Dropped pending navigation command " + oldest.cmd_name + " as the backlog is full")
+                pending.remove(oldest)
+                oldest.resolve()
+                Dispatcher.__stats["dropped"] += 1
+
+        return False
+
+    @staticmethod
+    async def __worker():
+        """Send all pending commands one after another and stop once there are no more pending commands"""
+        max_age = config.Setup.get("navigation_max_age") / 1000
+
+        while Dispatcher.__pending:
+            current = Dispatcher.__pending.pop(0)
+
+            if current.kind == NAVIGATION and time.monotonic() - current.queued > max_age:
+                _LOG.debug("Dropped stale navigation command " + current.cmd_name)
+                current.resolve()
+                Dispatcher.__stats["dropped"] += 1
+                continue
+
+            try:
+                await projector.send_cmd(current.entity_id, current.ip, current.cmd_name, current.params)
+                Dispatcher.__stats["sent"] += 1
+                current.resolve()
+            except Exception as e:
+                current.resolve(e)
+
+        stats = Dispatcher.__stats
+        if stats["merged"] or stats["dropped"]:
+            _LOG.debug("Command dispatcher stats: " + str(stats))
@@ -7,26 +7,51 @@ import os
 import asyncio
 import logging
 import logging.handlers
+import time
 
 import ucapi
 
+import capabilities
 import config
+import configwatch
+import events
+import proxy
+import connection
+import lowpower
+import memory
 import setup
 import media_player
 import sensor
-import remote
+import state
+import power
+import projector
+import sdap
+#The remote module is imported where the remote entity is added or updated. This doesn't measurably change the start time as all its dependencies are already loaded
 
 _LOG = logging.getLogger("driver")  # avoid having __main__ in log messages
 
 loop = asyncio.get_event_loop()
 api = ucapi.IntegrationAPI(loop)
 
+startup_timings = {}
+
+
+
+def startup_phase(name: str, start: float):
+    """Store and log the duration of a startup phase that has been started at the given time.perf_counter() value"""
+    duration = round((time.perf_counter() - start) * 1000, 1)
+    startup_timings[name] = duration
+    _LOG.debug("Startup phase " + name + " took " + str(duration) + " ms")
+    return time.perf_counter()
+
 
 
 async def startcheck():
     """
     Called at the start of the integration driver to load the config file into the runtime storage and add all needed entities and create attributes poller tasks
     """
+    phase_start = time.perf_counter()
+
     try:
         config.Setup.load()
     except OSError as o:
@@ -34,17 +59,39 @@ async def startcheck():
         _LOG.critical("Stopping integration driver")
         raise SystemExit(0) from o
 
+    try:
+        state.LastKnown.load()
+    except OSError as o:
+        _LOG.warning(o)
+        _LOG.warning("Last known entity attributes are not available")
+
+    try:
+        capabilities.Capabilities.load()
+    except OSError as o:
+        _LOG.warning(o)
+        _LOG.warning("Probed capabilities are not available. All commands will be added")
+
+    phase_start = startup_phase("config_load", phase_start)
+
     if config.Setup.get("setup_complete"):
 
         try:
             mp_entity_id = config.Setup.get("id")
             mp_entity_name = config.Setup.get("name")
-            rt_entity_id = "remote-"+mp_entity_id
-            config.Setup.set("rt-id", rt_entity_id)
             rt_entity_name = mp_entity_name
-            config.Setup.set_lt_name_id(mp_entity_id, mp_entity_name)
-            lt_entity_id = config.Setup.get("lt-id")
-            lt_entity_name = config.Setup.get("lt-name")
+            #Entity ids and names are stored in the config file since they have been generated once. Only re-derive them if they are missing
+            try:
+                rt_entity_id = config.Setup.get("rt-id")
+            except ValueError:
+                rt_entity_id = "remote-"+mp_entity_id
+                config.Setup.set("rt-id", rt_entity_id)
+            try:
+                lt_entity_id = config.Setup.get("lt-id")
+                lt_entity_name = config.Setup.get("lt-name")
+            except ValueError:
+                config.Setup.set_lt_name_id(mp_entity_id, mp_entity_name)
+                lt_entity_id = config.Setup.get("lt-id")
+                lt_entity_name = config.Setup.get("lt-name")
         except ValueError as v:
             _LOG.error(v)
 
@@ -54,15 +101,26 @@ async def startcheck():
         else:
             await media_player.add_mp(mp_entity_id, mp_entity_name)
 
+        if api.available_entities.contains(lt_entity_id):
+            _LOG.debug("Projector lamp timer sensor entity with id " + lt_entity_id + " is already in storage as available entity")
+        else:
+            await sensor.add_lt_sensor(lt_entity_id, lt_entity_name)
+
+        await sensor.add_picture_sensors(mp_entity_id, mp_entity_name)
+
+        #Add the remote entity last as it has the largest definition with all button mappings and ui pages
         if api.available_entities.contains(rt_entity_id):
             _LOG.debug("Projector remote entity with id " + rt_entity_id + " is already in storage as available entity")
         else:
+            import remote # pylint: disable=import-outside-toplevel
             await remote.add_remote(rt_entity_id, rt_entity_name)
 
-        if api.available_entities.contains(lt_entity_id):
-            _LOG.debug("Projector lamp timer sensor entity with id " + lt_entity_id + " is already in storage as available entity")
-        else:
-            await sensor.add_lt_sensor(lt_entity_id, lt_entity_name)
+        startup_phase("entity_registration", phase_start)
+
+    memory.Report.start()
+    configwatch.Watcher.start()
+    await events.Stream.start()
+    await proxy.Proxy.start()
 
 
 
@@ -97,13 +155,21 @@ async def on_r2_enter_standby() -> None:
     """
     Enter standby notification from Remote Two.
 
-    Set config.R2_IN_STANDBY to True and show a debug log message as there is no permanent connection to the projector that needs to be closed.
+    Set config.R2_IN_STANDBY to True, write pending last known attributes, close a pre-warmed connection to the projector
+    and suspend all periodic tasks in the low power profile.
     """
     _LOG.info("Received enter standby event message from remote")
 
     _LOG.debug("Set config.R2_IN_STANDBY to True")
     config.Setup.set("standby", True)
 
+    state.LastKnown.flush()
+    for task in asyncio.all_tasks(loop):
+        if task.get_name() == "connection_prewarm":
+            task.cancel()
+    connection.Prewarm.cancel()
+    lowpower.Profile.suspend()
+
 
 
 @api.listens_to(ucapi.Events.EXIT_STANDBY)
@@ -111,13 +177,17 @@ async def on_r2_exit_standby() -> None:
     """
     Exit standby notification from Remote Two.
 
-    Just show a debug log message as there is no permanent connection to the projector that needs to be re-established.
+    Set config.R2_IN_STANDBY to False, restore the periodic tasks that have been suspended in the low power profile
+    and pre-warm the connection to the projector for the first command.
     """
     _LOG.info("Received exit standby event message from remote")
 
     _LOG.debug("Set config.R2_IN_STANDBY to False")
     config.Setup.set("standby", False)
 
+    await lowpower.Profile.resume()
+    prewarm()
+
 
 
 @api.listens_to(ucapi.Events.SUBSCRIBE_ENTITIES)
@@ -130,26 +200,99 @@ async def on_subscribe_entities(entity_ids: list[str]) -> None:
     _LOG.info("Received subscribe entities event for entity ids: " + str(entity_ids))
 
     config.Setup.set("standby", False)
+
+    prewarm()
+
+    if config.Setup.get("setup_complete"):
+        #Publish the last known attributes immediately and reconcile them with the projector in the background
+        for entity_id in entity_ids:
+            state.publish_last_known(entity_id)
+        loop.create_task(refresh_entities(entity_ids), name="entity_refresh")
+
+
+
+def prewarm():
+    """Open a connection to the projector in the background so the first command after the remote woke up is sent without waiting for the connect"""
+    if not config.Setup.get("setup_complete") or not config.Setup.get("prewarm_connection"):
+        return
+    #Also used in the low power profile. The connection is only opened once after wake-up and is never kept alive periodically,
+    #so it doesn't add any wakeups
+    try:
+        ip = config.Setup.get("ip")
+    except ValueError:
+        return
+    loop.create_task(connection.Prewarm.run(ip), name="connection_prewarm")
+
+
+
+async def refresh_entities(entity_ids: list[str]) -> None:
+    """Update the attributes of the given entities with the current values from the projector and start the poller tasks.
+    All projector items that are needed by the entities are retrieved only once in a single session and then used for all entities"""
     ip = config.Setup.get("ip")
     mp_entity_id = config.Setup.get("id")
     rt_entity_id = config.Setup.get("rt-id")
     lt_entity_id = config.Setup.get("lt-id")
 
-    if config.Setup.get("setup_complete"):
-        for entity_id in entity_ids:
-            try:
-                if entity_id == mp_entity_id:
-                    await media_player.update_mp(entity_id, ip)
-                    await media_player.MpPollerController.start(entity_id, ip)
-                if entity_id == lt_entity_id:
-                    await sensor.update_lt(entity_id, ip)
-                    await sensor.LtPollerController.start(entity_id, ip)
-                if entity_id == rt_entity_id:
-                    await remote.update_rt(rt_entity_id, ip)
-            except OSError as o:
-                _LOG.critical(o)
-            except Exception as e:
-                _LOG.warning(e)
+    items = []
+    if mp_entity_id in entity_ids:
+        items.extend(media_player.MP_ITEMS)
+    if rt_entity_id in entity_ids:
+        items.append("GET_STATUS_POWER")
+    if lt_entity_id in entity_ids:
+        items.append("GET_STATUS_LAMP_TIMER")
+    items = list(dict.fromkeys(items)) #Remove duplicates but keep the order
+
+    values = {}
+    if items:
+        try:
+            values = await asyncio.to_thread(projector.get_items, ip, items)
+            _LOG.debug("Got " + str(values) + " from the projector for entities " + str(entity_ids))
+        except OSError as o:
+            _LOG.critical(o)
+        except Exception as e:
+            _LOG.warning(e)
+
+    for entity_id in entity_ids:
+        try:
+            if entity_id == mp_entity_id:
+                await media_player.update_mp(entity_id, ip, values)
+            if entity_id == lt_entity_id:
+                await sensor.update_lt(entity_id, ip, values)
+            if entity_id == rt_entity_id:
+                import remote # pylint: disable=import-outside-toplevel
+                await remote.update_rt(rt_entity_id, ip, values)
+        except OSError as o:
+            _LOG.critical(o)
+        except Exception as e:
+            _LOG.warning(e)
+
+    picture_sensors = [entity_id for entity_id in entity_ids if entity_id in sensor.picture_sensor_ids(mp_entity_id)]
+    if picture_sensors:
+        try:
+            await sensor.update_picture(ip)
+        except Exception as e:
+            _LOG.warning(e)
+
+    try:
+        if mp_entity_id in entity_ids:
+            await media_player.MpPollerController.start(mp_entity_id, ip)
+        if lt_entity_id in entity_ids:
+            await sensor.LtPollerController.start(lt_entity_id, ip)
+        if picture_sensors:
+            sensor.PictureSensors.start(ip)
+        if mp_entity_id in entity_ids or rt_entity_id in entity_ids:
+            await sdap.Listener.start()
+    except Exception as e:
+        _LOG.warning(e)
+
+    #Items can only be probed reliably while the projector is on. Probe items that are still unknown, e.g. if the projector was off during the setup
+    if capabilities.Capabilities.pending() and power.Transition.get() == power.ON:
+        try:
+            if await asyncio.to_thread(capabilities.Capabilities.probe, ip):
+                _LOG.info("The supported commands have changed and will be applied to the entities after the next restart of the integration")
+        except Exception as e:
+            _LOG.debug("Could not probe the capabilities of the projector: " + str(e))
+
 
 
 # No event when removing an entity as configured entity. Could be a UC Python library bug
@@ -168,10 +311,14 @@ async def on_unsubscribe_entities(entity_ids: list[str]) -> None:
 
     if mp_entity_id in entity_ids:
         await media_player.MpPollerController.stop()
+        sdap.Listener.stop()
 
     if lt_entity_id in entity_ids:
         await sensor.LtPollerController.stop()
 
+    if [entity_id for entity_id in entity_ids if entity_id in sensor.picture_sensor_ids(mp_entity_id)]:
+        sensor.PictureSensors.stop()
+
 
 
 def setup_logger():
@@ -189,12 +336,31 @@ def setup_logger():
     logging.getLogger("media_player").setLevel(level)
     logging.getLogger("remote").setLevel(level)
     logging.getLogger("sensor").setLevel(level)
+    logging.getLogger("state").setLevel(level)
+    logging.getLogger("connection").setLevel(level)
+    logging.getLogger("power").setLevel(level)
+    logging.getLogger("deferred").setLevel(level)
+    logging.getLogger("sequencer").setLevel(level)
+    logging.getLogger("dispatcher").setLevel(level)
+    logging.getLogger("optimistic").setLevel(level)
+    logging.getLogger("retry").setLevel(level)
+    logging.getLogger("capabilities").setLevel(level)
+    logging.getLogger("history").setLevel(level)
+    logging.getLogger("lamp").setLevel(level)
+    logging.getLogger("sdap").setLevel(level)
+    logging.getLogger("lowpower").setLevel(level)
+    logging.getLogger("memory").setLevel(level)
+    logging.getLogger("configwatch").setLevel(level)
+    logging.getLogger("events").setLevel(level)
+    logging.getLogger("proxy").setLevel(level)
 
 
 
 async def main():
     """Main function that gets logging from all sub modules and starts the driver"""
 
+    driver_start = time.perf_counter()
+
     #Check if integration runs in a PyInstaller bundle on the remote and adjust the logging format, config file path and disable power/mute/input poller task
     if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
 
@@ -211,17 +377,26 @@ async def main():
         _LOG.info("Deactivating power/mute/input poller to reduce battery consumption when running on the remote")
         _LOG.info("The poller task may still be activated afterwards if a custom interval has been set in the manual advanced setup")
         config.Setup.set("mp_poller_interval", 0, False) #Using False to prevent the config file from being created before first time setup
+        _LOG.info("Using the low power profile. Periodic tasks are aligned to a shared " + str(lowpower.TICK) + " second tick and cancelled while the remote is in standby")
     else:
         logging.basicConfig(format="%(asctime)s.%(msecs)03d | %(levelname)-8s | %(name)-14s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
         setup_logger()
 
     _LOG.debug("Starting driver")
 
+    phase_start = time.perf_counter()
     await setup.init()
+    startup_phase("api_init", phase_start)
     await startcheck()
 
+    startup_phase("total", driver_start)
+    _LOG.info("Startup phase timings in ms: " + str(startup_timings))
+
 
 
 if __name__ == "__main__":
     loop.run_until_complete(main())
-    loop.run_forever()
+    try:
+        loop.run_forever()
+    finally:
+        state.LastKnown.flush()
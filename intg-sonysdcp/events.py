@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""Module that includes the event stream which pushes all entity attribute changes as line-delimited JSON to local TCP clients,
+so other systems can follow the projector state without polling the projector themselves"""
+
+import asyncio
+import json
+import logging
+import time
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+MAX_BUFFER = 65536 #Bytes that can be buffered for a client before it's disconnected as too slow
+
+
+
+def event(entity_id: str, attributes: dict, timestamp: float = None, event_type: str = "state") -> bytes:
+    """Create a JSON line for an entity attribute change"""
+    return (json.dumps({
+        "type": event_type,
+        "entity_id": entity_id,
+        "attributes": {str(key): value for key, value in attributes.items()},
+        "timestamp": round(time.time() if timestamp is None else timestamp, 3)
+    }) + "\n").encode()
+
+
+
+class Stream:
+    """TCP server that sends the current attributes of all entities to each new client and afterwards every attribute change as it happens.
+    Clients don't need to send anything. The server is only started if an event port has been set in the config file"""
+
+    __server = None
+    __clients = set()
+
+    @staticmethod
+    async def start():
+        """Start the event stream server if a port has been set and it's not already running"""
+        port = config.Setup.get("event_port")
+        if port == 0 or Stream.__server is not None:
+            return
+        try:
+            Stream.__server = await asyncio.start_server(Stream.handle_client, port=port)
+        except OSError as o:
+            _LOG.warning("Could not start the event stream on port " + str(port) + ": " + str(o))
+            return
+        _LOG.info("Started event stream on port " + str(port))
+
+    @staticmethod
+    async def stop():
+        """Stop the event stream server and disconnect all clients"""
+        if Stream.__server is None:
+            return
+        Stream.__server.close()
+        for writer in list(Stream.__clients):
+            writer.close()
+        Stream.__clients.clear()
+        await Stream.__server.wait_closed()
+        Stream.__server = None
+        _LOG.info("Stopped event stream")
+
+    @staticmethod
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Send a snapshot of all last known attributes to a new client and keep it subscribed until it disconnects"""
+        import state # pylint: disable=import-outside-toplevel
+        peer = str(writer.get_extra_info("peername"))
+        _LOG.info("Event stream client " + peer + " connected")
+
+        for entity_id, known in state.LastKnown.all().items():
+            writer.write(event(entity_id, known["attributes"], known["timestamp"], "snapshot"))
+        Stream.__clients.add(writer)
+
+        try:
+            #Incoming data is ignored. Wait until the client disconnects
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            Stream.__clients.discard(writer)
+            writer.close()
+            _LOG.info("Event stream client " + peer + " disconnected")
+
+    @staticmethod
+    def publish(entity_id: str, attributes: dict):
+        """Send changed attributes of an entity to all clients without waiting for them. Clients that don't read fast enough are disconnected"""
+        if not Stream.__clients:
+            return
+        line = event(entity_id, attributes)
+        for writer in list(Stream.__clients):
+            if writer.is_closing():
+                Stream.__clients.discard(writer)
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BUFFER:
+                _LOG.warning("Disconnecting event stream client " + str(writer.get_extra_info("peername")) + " as it doesn't read the events")
+                Stream.__clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
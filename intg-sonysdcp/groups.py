@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Module that includes projector groups which send the same command to multiple projectors at the same time, e.g. for edge blending or dual screen setups"""
+
+import asyncio
+import logging
+import time
+
+import commands
+import config
+import connection
+
+_LOG = logging.getLogger(__name__)
+
+
+
+def get_groups() -> dict:
+    """Get all projector groups from the config file as a dictionary with the group name and a list of the member ip addresses"""
+    try:
+        return dict(config.Setup.get("groups"))
+    except ValueError:
+        return {}
+
+
+def members(name: str) -> list[str]:
+    """Get the ip addresses of all members of a group"""
+    group = get_groups().get(name)
+    if not group:
+        raise Exception("Projector group " + name + " not found. Please add it to groups in the config file")
+    return list(dict.fromkeys(group)) #Remove duplicates but keep the order
+
+
+
+async def send(cmd_name: str) -> dict:
+    """Send a group command to all members of the group and return a report with the result and latency of each member and the skew.
+
+    All members are connected first. Afterwards the request is sent to all members concurrently, so the projectors receive the command
+    at nearly the same time instead of one round trip after another. The number of members that are handled at the same time is limited
+    by group_parallelism. The skew is the time between the first and the last member that the request has been sent to.
+    Failed members are not retried as a retry would increase the skew
+    """
+    name, command = commands.group_command(cmd_name)
+    request = commands.group_frame(command)
+    if request is None:
+        raise Exception("The command " + command + " can't be sent to a projector group")
+
+    semaphore = asyncio.Semaphore(max(1, config.Setup.get("group_parallelism")))
+    sessions = {ip: connection.Session(ip) for ip in members(name)}
+    results = {ip: {"ip": ip, "result": None, "sent": None, "latency_ms": None} for ip in sessions}
+
+    async def connect(ip: str):
+        async with semaphore:
+            try:
+                await asyncio.to_thread(sessions[ip].connect)
+            except Exception as e:
+                results[ip]["result"] = "ERROR: " + str(e)
+
+    def request_timed(ip: str):
+        results[ip]["sent"] = time.monotonic()
+        sessions[ip].request(*request)
+        results[ip]["latency_ms"] = round((time.monotonic() - results[ip]["sent"]) * 1000, 1)
+
+    async def send_member(ip: str):
+        async with semaphore:
+            try:
+                await asyncio.to_thread(request_timed, ip)
+                results[ip]["result"] = "OK"
+            except Exception as e:
+                results[ip]["result"] = "ERROR: " + str(e)
+
+    try:
+        await asyncio.gather(*[connect(ip) for ip in sessions])
+        await asyncio.gather(*[send_member(ip) for ip in sessions if results[ip]["result"] is None])
+    finally:
+        for session in sessions.values():
+            session.close()
+
+    sent = [result["sent"] for result in results.values() if result["sent"] is not None]
+    start = min(sent) if sent else None
+    report = {
+        "group": name,
+        "command": command,
+        "members": [{"ip": ip, "result": result["result"], "offset_ms": None if result["sent"] is None else round((result["sent"] - start) * 1000, 1),
+                     "latency_ms": result["latency_ms"]} for ip, result in results.items()],
+        "skew_ms": round((max(sent) - start) * 1000, 1) if sent else None
+    }
+
+    _LOG.info("Group " + name + " command " + command + " report: " + ", ".join(
+        member["ip"] + " " + member["result"] + ("" if member["latency_ms"] is None else " (" + str(member["latency_ms"]) + " ms)")
+        for member in report["members"]) + ". Skew: " + str(report["skew_ms"]) + " ms")
+
+    return report
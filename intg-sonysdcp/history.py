@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""Module that includes the lamp hours history which is stored as fixed-width records in append-only files with tiered downsampling"""
+
+import os
+import struct
+import time
+import logging
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<II") #Unix timestamp in seconds, lamp hours
+DAY = 86400
+
+#Tier: (Segment file name format for time.strftime, number of segments that are kept). Older segments will be deleted
+TIERS = {
+    "raw": ("lamp_raw_%Y%m.bin", 3), #Every change of the lamp hours. One segment per month
+    "daily": ("lamp_daily_%Y.bin", 3), #First value of each day. One segment per year
+    "monthly": ("lamp_monthly_%Y.bin", 20) #First value of each month. One segment per year
+}
+
+
+
+class Series:
+    """Time series of one tier that is stored in segment files with fixed-width records. Records are only appended and never rewritten.
+    As all records have the same size and are in chronological order a record can be found by seeking instead of reading the whole file"""
+
+    __slots__ = ("directory", "tier", "name_format", "keep", "prefix")
+
+    def __init__(self, directory: str, tier: str):
+        self.directory = directory
+        self.tier = tier
+        self.name_format, self.keep = TIERS[tier]
+        self.prefix = self.name_format.split("%")[0]
+
+    def segments(self) -> list[str]:
+        """Get the paths of all segment files of this tier in chronological order"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.startswith(self.prefix) and name.endswith(".bin")]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def append(self, timestamp: int, value: int):
+        """Append a record to the segment of the given timestamp and delete the oldest segments if there are too many"""
+        path = os.path.join(self.directory, time.strftime(self.name_format, time.gmtime(timestamp)))
+        new_segment = not os.path.isfile(path)
+        with open(path, "ab") as f:
+            f.write(RECORD.pack(timestamp, value))
+        if new_segment:
+            for old_segment in self.segments()[:-self.keep]:
+                os.remove(old_segment)
+                _LOG.debug("Deleted old lamp hours history segment " + old_segment)
+
+    def last(self):
+        """Get the last record as a (timestamp, value) tuple or None if there are no records"""
+        for path in reversed(self.segments()):
+            size = os.path.getsize(path) - os.path.getsize(path) % RECORD.size
+            if size == 0:
+                continue
+            with open(path, "rb") as f:
+                f.seek(size - RECORD.size)
+                return RECORD.unpack(f.read(RECORD.size))
+        return None
+
+    def before(self, timestamp: int):
+        """Get the last record before a timestamp as a (timestamp, value) tuple or None if there is no such record.
+        Only the matching segment is searched with a binary search"""
+        for path in reversed(self.segments()):
+            count = os.path.getsize(path) // RECORD.size
+            if count == 0:
+                continue
+            with open(path, "rb") as f:
+                if RECORD.unpack(f.read(RECORD.size))[0] >= timestamp:
+                    continue
+                low, high = 0, count - 1
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    f.seek(middle * RECORD.size)
+                    if RECORD.unpack(f.read(RECORD.size))[0] < timestamp:
+                        low = middle
+                    else:
+                        high = middle - 1
+                f.seek(low * RECORD.size)
+                return RECORD.unpack(f.read(RECORD.size))
+        return None
+
+    def first(self):
+        """Get the first record as a (timestamp, value) tuple or None if there are no records"""
+        for path in self.segments():
+            with open(path, "rb") as f:
+                data = f.read(RECORD.size)
+            if len(data) == RECORD.size:
+                return RECORD.unpack(data)
+        return None
+
+
+
+class LampHistory:
+    """History of the lamp hours with a raw, daily and monthly tier. The files are stored in a history directory next to the config file"""
+
+    __series = {}
+    __last = None
+
+    @staticmethod
+    def directory() -> str:
+        """Get the path of the history directory which is located in the same directory as the config file"""
+        return os.path.join(os.path.dirname(config.Setup.get("cfg_path")), "history")
+
+    @staticmethod
+    def series(tier: str) -> Series:
+        """Get the time series of a tier"""
+        if tier not in LampHistory.__series:
+            LampHistory.__series[tier] = Series(LampHistory.directory(), tier)
+        return LampHistory.__series[tier]
+
+    @staticmethod
+    def add(hours: int, timestamp: int = None):
+        """Add the current lamp hours. A raw record is only appended if the hours have changed. The first value of a new day or month
+        is also appended to the daily or monthly tier"""
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        if LampHistory.__last is None:
+            os.makedirs(LampHistory.directory(), exist_ok=True)
+            LampHistory.__last = LampHistory.series("raw").last()
+
+        last = LampHistory.__last
+        if last is not None and last[1] == hours:
+            return
+
+        LampHistory.series("raw").append(timestamp, hours)
+
+        if last is None or time.gmtime(last[0])[:3] != time.gmtime(timestamp)[:3]:
+            LampHistory.series("daily").append(timestamp, hours)
+        if last is None or time.gmtime(last[0])[:2] != time.gmtime(timestamp)[:2]:
+            LampHistory.series("monthly").append(timestamp, hours)
+
+        LampHistory.__last = (timestamp, hours)
+
+    @staticmethod
+    def used(days: int, hours: int, now: int = None) -> int:
+        """Get the lamp hours that have been used in the last days based on the current lamp hours. The start value is the last record
+        before the period from the raw tier or the daily tier if the raw tier doesn't reach back that far. Only a few records have to be read"""
+        if now is None:
+            now = int(time.time())
+        since = now - days * DAY
+        start = LampHistory.series("raw").before(since)
+        if start is None:
+            start = LampHistory.series("daily").before(since)
+        if start is None:
+            #The history started within the period
+            start = LampHistory.series("raw").first()
+        if start is None:
+            return 0
+        return max(hours - start[1], 0)
+
+    @staticmethod
+    def attributes(hours: int) -> dict:
+        """Get the usage attributes for the lamp timer sensor"""
+        return {
+            "hours_last_7_days": LampHistory.used(7, hours),
+            "hours_last_30_days": LampHistory.used(30, hours)
+        }
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Module that includes the lamp clock which estimates the lamp hours from the known power transitions between two readings from the projector"""
+
+import logging
+import time
+
+import config
+
+_LOG = logging.getLogger(__name__)
+
+DRIFT_HOURS = 2 #Difference between the estimated and the read lamp hours that is logged as drift
+
+
+
+class LampClock:
+    """Accumulates the time the lamp has been on since the last lamp hours reading from the projector.
+    The lamp is treated as on from the start of the warm-up until the start of the cool-down"""
+
+    __hours = None
+    __on_seconds = 0.0
+    __on_since = None
+    __synced = None
+    __suspect = False
+
+    @staticmethod
+    def sync(hours: int):
+        """Set the lamp hours that have been read from the projector as the new base for the estimation"""
+        estimate = LampClock.estimate()
+        if estimate is not None and abs(estimate - hours) >= DRIFT_HOURS:
+            _LOG.warning("Estimated lamp hours " + str(estimate) + " drifted from the projector value " + str(hours))
+
+        LampClock.__hours = hours
+        LampClock.__on_seconds = 0.0
+        if LampClock.__on_since is not None:
+            LampClock.__on_since = time.monotonic()
+        LampClock.__synced = time.monotonic()
+        LampClock.__suspect = False
+
+    @staticmethod
+    def power_changed(lamp_on: bool):
+        """Start or stop accumulating the lamp on time after a power transition"""
+        now = time.monotonic()
+        if lamp_on and LampClock.__on_since is None:
+            LampClock.__on_since = now
+        elif not lamp_on and LampClock.__on_since is not None:
+            LampClock.__on_seconds += now - LampClock.__on_since
+            LampClock.__on_since = None
+
+    @staticmethod
+    def suspect_drift():
+        """Force a resync with the next update, e.g. if the power phase could not be followed for some time"""
+        LampClock.__suspect = True
+
+    @staticmethod
+    def on_seconds() -> float:
+        """Get the number of seconds the lamp has been on since the last reading"""
+        seconds = LampClock.__on_seconds
+        if LampClock.__on_since is not None:
+            seconds += time.monotonic() - LampClock.__on_since
+        return seconds
+
+    @staticmethod
+    def estimate():
+        """Get the estimated lamp hours in whole hours or None if the lamp hours have not been read yet"""
+        if LampClock.__hours is None:
+            return None
+        return LampClock.__hours + int(LampClock.on_seconds() // 3600)
+
+    @staticmethod
+    def seconds_to_next_hour():
+        """Get the number of seconds until the estimated lamp hours increase or None if the lamp is off"""
+        if LampClock.__on_since is None:
+            return None
+        return 3600 - LampClock.on_seconds() % 3600
+
+    @staticmethod
+    def needs_resync() -> bool:
+        """Check if the lamp hours should be read from the projector again as the estimation can't be trusted anymore"""
+        if LampClock.__hours is None or LampClock.__suspect:
+            return True
+        return time.monotonic() - LampClock.__synced > config.Setup.get("lt_resync_interval")
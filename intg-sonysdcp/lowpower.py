@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""Module that includes the low power profile which reduces the number of wakeups of the integration, e.g. when it's running on the remote"""
+
+import asyncio
+import collections
+import logging
+import math
+import time
+
+import config
+import driver
+
+_LOG = logging.getLogger(__name__)
+
+TICK = 60 #Seconds. Periodic tasks with an interval of at least one tick wake up on multiples of this tick while the low power profile is active
+SUSPENDED_TASKS = ["mp_poller", "lt_poller", "picture_poller", "power_burst_poller", "memory_poller"] #Tasks that are cancelled while the remote is in standby
+
+
+
+class Wakeups:
+    """Counts the wakeups of all periodic tasks in the last hour"""
+
+    __times = collections.deque()
+    __names = collections.deque()
+
+    @staticmethod
+    def add(name: str):
+        """Count a wakeup of a periodic task"""
+        Wakeups.__times.append(time.monotonic())
+        Wakeups.__names.append(name)
+        Wakeups.__trim()
+
+    @staticmethod
+    def __trim():
+        while Wakeups.__times and time.monotonic() - Wakeups.__times[0] > 3600:
+            Wakeups.__times.popleft()
+            Wakeups.__names.popleft()
+
+    @staticmethod
+    def last_hour() -> dict:
+        """Get the number of wakeups of each task in the last hour"""
+        Wakeups.__trim()
+        return dict(collections.Counter(Wakeups.__names))
+
+
+
+async def sleep(name: str, interval: float):
+    """Sleep between two runs of a periodic task and count the wakeup. While the low power profile is active the wakeup of intervals of at least
+    one tick is delayed to the next multiple of the shared tick, so these tasks wake up at the same time. Shorter intervals are kept as they are
+    (e.g. the power/mute/input poller or the lamp timer resync), as rounding them up would change the configured polling precision"""
+    if Profile.active() and interval >= TICK:
+        now = time.monotonic()
+        interval = math.ceil((now + interval) / TICK) * TICK - now
+    await asyncio.sleep(interval)
+    Wakeups.add(name)
+
+
+
+class Profile:
+    """Low power profile which is always used in bundle mode or if it has been activated in the config file.
+    While the remote is in standby all periodic tasks are cancelled and the SDAP listener is stopped instead of waking up only to skip their work.
+    They will be restored when the remote wakes up again"""
+
+    __suspended = []
+
+    @staticmethod
+    def active() -> bool:
+        """Check if the low power profile is used"""
+        return config.Setup.get("bundle_mode") or config.Setup.get("low_power")
+
+    @staticmethod
+    def suspend():
+        """Cancel all periodic tasks, close the pre-warmed connection and stop the SDAP listener"""
+        if not Profile.active():
+            return
+        import connection # pylint: disable=import-outside-toplevel
+        import sdap # pylint: disable=import-outside-toplevel
+
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() in SUSPENDED_TASKS and not task.done():
+                task.cancel()
+                if task.get_name() not in Profile.__suspended:
+                    Profile.__suspended.append(task.get_name())
+        connection.Prewarm.cancel()
+        if sdap.Listener.running():
+            sdap.Listener.stop()
+            Profile.__suspended.append("sdap_listener")
+
+        _LOG.info("Suspended " + str(Profile.__suspended) + " while the remote is in standby. Wakeups in the last hour: " + str(Wakeups.last_hour()))
+
+    @staticmethod
+    async def resume():
+        """Restart all tasks that have been cancelled by suspend"""
+        if not Profile.__suspended:
+            return
+        import media_player # pylint: disable=import-outside-toplevel
+        import memory # pylint: disable=import-outside-toplevel
+        import power # pylint: disable=import-outside-toplevel
+        import sdap # pylint: disable=import-outside-toplevel
+        import sensor # pylint: disable=import-outside-toplevel
+
+        suspended, Profile.__suspended = Profile.__suspended, []
+        try:
+            ip = config.Setup.get("ip")
+            for name in suspended:
+                if name == "mp_poller":
+                    await media_player.MpPollerController.start(config.Setup.get("id"), ip)
+                elif name == "lt_poller":
+                    await sensor.LtPollerController.start(config.Setup.get("lt-id"), ip)
+                elif name == "picture_poller":
+                    sensor.PictureSensors.start(ip)
+                elif name == "power_burst_poller":
+                    power.Transition.start()
+                elif name == "memory_poller":
+                    memory.Report.start()
+                elif name == "sdap_listener":
+                    await sdap.Listener.start()
+        except ValueError as v:
+            _LOG.warning("Could not restore all suspended tasks: " + str(v))
+            return
+
+        _LOG.info("Restored " + str(suspended) + " after the remote woke up")
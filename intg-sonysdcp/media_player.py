@@ -7,12 +7,22 @@ from typing import Any
 
 import ucapi
 
+import capabilities
 import config
+import connection
 import driver
+import lowpower
+import optimistic
+import power
 import projector
+import retry
+import sdap
+import state
 
 _LOG = logging.getLogger(__name__)
 
+MP_ITEMS = ["GET_STATUS_POWER", "PICTURE_MUTING", "INPUT"] #Projector items needed for all media player attributes
+
 
 
 async def mp_cmd_handler(entity: ucapi.MediaPlayer, cmd_id: str, _params: dict[str, Any] | None) -> ucapi.StatusCodes:
@@ -36,14 +46,14 @@ async def mp_cmd_handler(entity: ucapi.MediaPlayer, cmd_id: str, _params: dict[s
     try:
         if not _params:
             _LOG.info(f"Received {cmd_id} command for {entity.id}")
-            await projector.send_cmd(entity.id, ip, cmd_id)
+            await optimistic.submit(entity.id, ip, cmd_id)
         else:
             _LOG.info(f"Received {cmd_id} command with parameter {_params} for {entity.id}")
-            await projector.send_cmd(entity.id, ip, cmd_id, _params)
+            await optimistic.submit(entity.id, ip, cmd_id, _params)
     except Exception as e:
         if e is None:
             return ucapi.StatusCodes.SERVER_ERROR
-        return ucapi.StatusCodes.BAD_REQUEST
+        return retry.status_code(e)
     return ucapi.StatusCodes.OK
 
 
@@ -53,13 +63,16 @@ async def add_mp(ent_id: str, name: str):
 
     _LOG.info("Add projector media player entity with id " + ent_id + " and name " + name)
 
+    #Use the last known attributes as provisional values until they will be updated from the projector
+    attributes = {**config.MpDef.attributes, **state.LastKnown.get(ent_id)}
+
     definition = ucapi.MediaPlayer(
         ent_id,
         name,
         features=config.MpDef.features,
-        attributes=config.MpDef.attributes,
+        attributes=attributes,
         device_class=config.MpDef.device_class,
-        options=config.MpDef.options,
+        options={**config.MpDef.options, ucapi.media_player.Options.SIMPLE_COMMANDS: capabilities.Capabilities.prune(config.simple_commands)},
         cmd_handler=mp_cmd_handler
     )
 
@@ -144,71 +157,65 @@ has not removed or not added as a configured entity on the remote")
 async def mp_poller(entity_id: str, interval: int, ip: str) -> None:
     """Projector attributes poller task"""
     while True:
-        await driver.asyncio.sleep(interval)
+        await lowpower.sleep("mp_poller", interval)
         if config.Setup.get("standby"):
             continue
+        if sdap.Listener.regular() and power.Transition.get() == power.STANDBY:
+            #Power changes are received with the SDAP advertisements and input and mute can't be changed in standby
+            _LOG.debug("Skip polling. The projector is in standby and SDAP advertisements are received regularly")
+            continue
         try:
             #TODO Implement check if there are too many timeouts/connection errors to the projector and automatically deactivate poller and set entity status to unknown
             await update_mp(entity_id, ip)
         except Exception as e:
             _LOG.warning(e)
+        _LOG.debug("Round trip time estimate for " + ip + ": " + str(connection.RoundTrip.stats(ip)))
 
 
 
-async def update_mp(entity_id: str, ip: str):
-    """Retrieve input source, power state and muted state from the projector, compare them with the known state on the remote and update them if necessary"""
-
-    try:
-        state = projector.get_attr_power(ip)
-        muted = projector.get_attr_muted(ip)
-        source = projector.get_attr_source(ip)
-    except Exception as e:
-        raise Exception(e) from e
+async def update_mp(entity_id: str, ip: str, values: dict = None):
+    """Retrieve input source, power state and muted state from the projector, compare them with the known state on the remote and update them if necessary
 
-    try:
-        stored_states = await driver.api.available_entities.get_states()
-    except Exception as e:
-        raise Exception(e) from e
+    :values: Already retrieved raw projector values (e.g. from a consolidated refresh). If None they will be retrieved from the projector in a single session
+    """
 
-    if stored_states != []:
-        attributes_stored = stored_states[0]["attributes"] # [0] = 1st entity that has been added
-    else:
-        raise Exception("Got empty states from remote. Please make sure to add configured entities")
+    if values is None:
+        try:
+            values = await driver.asyncio.to_thread(projector.get_items, ip, MP_ITEMS)
+        except Exception as e:
+            raise Exception(e) from e
 
-    stored_attributes = {"state": attributes_stored["state"], "muted": attributes_stored["muted"], "source": attributes_stored["source"]}
-    current_attributes = {"state": state, "muted": muted, "source": source}
+    if "GET_STATUS_POWER" not in values:
+        raise Exception("Could not get the power status from the projector")
 
-    attributes_to_check = ["state", "muted", "source"]
-    attributes_to_update = []
-    attributes_to_skip = []
+    #Update the power phase first as the projector rejects the other items in standby
+    power.Transition.set_status(values["GET_STATUS_POWER"])
+    current_attributes = {ucapi.media_player.Attributes.STATE: projector.power_state(values["GET_STATUS_POWER"])}
 
-    for attribute in attributes_to_check:
-        if current_attributes[attribute] != stored_attributes[attribute]:
-            attributes_to_update.append(attribute)
-        else:
-            attributes_to_skip.append(attribute)
+    try:
+        current_attributes[ucapi.media_player.Attributes.MUTED] = projector.muted_state(values["PICTURE_MUTING"])
+        current_attributes[ucapi.media_player.Attributes.SOURCE] = projector.source_name(values["INPUT"])
+    except KeyError as k:
+        if current_attributes[ucapi.media_player.Attributes.STATE] == ucapi.media_player.States.ON:
+            raise Exception("Could not get " + str(k) + " from the projector") from k
+        _LOG.debug("Could not get " + str(k) + " from the projector as it's not powered on. Only updating the power state")
 
-    if not attributes_to_skip:
-        _LOG.debug("Entity attributes for " + str(attributes_to_skip) + " have not changed since the last update")
+    entity = driver.api.configured_entities.get(entity_id)
+    if entity is None:
+        raise Exception("Entity " + entity_id + " not found. Please make sure it's added as a configured entity on the remote")
 
-    if not attributes_to_update:
-        attributes_to_send = {}
-        if "state" in attributes_to_update:
-            attributes_to_send.update({ucapi.media_player.Attributes.STATE: state})
-        if "muted" in attributes_to_update:
-            attributes_to_send.update({ucapi.media_player.Attributes.MUTED: muted})
-        if "source" in attributes_to_update:
-            attributes_to_send.update({ucapi.media_player.Attributes.SOURCE: source})
+    attributes_to_send = {key: value for key, value in current_attributes.items() if entity.attributes.get(key) != value}
 
+    if attributes_to_send:
         try:
-            api_update_attributes = driver.api.configured_entities.update_attributes(entity_id, attributes_to_send)
+            api_update_attributes = state.update_attributes(entity_id, attributes_to_send)
         except Exception as e:
             raise Exception("Error while updating attributes for entity id " + entity_id) from e
 
         if not api_update_attributes:
             raise Exception("Entity " + entity_id + " not found. Please make sure it's added as a configured entity on the remote")
         else:
-            _LOG.info("Updated entity attribute(s) " + str(attributes_to_update) + " for " + entity_id)
+            _LOG.info("Updated entity attribute(s) " + str(attributes_to_send) + " for " + entity_id)
 
     else:
         _LOG.debug("No projector attributes to update. Skipping update process")
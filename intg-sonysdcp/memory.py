@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""Module that includes the memory report with the resident set size over time and tracemalloc snapshots per module"""
+
+import collections
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import config
+import driver
+import lowpower
+
+_LOG = logging.getLogger(__name__)
+
+RSS_SAMPLES = 48 #Number of resident set size samples that are kept
+TOP_MODULES = 10 #Number of modules with the most allocated memory that are logged
+
+
+
+def rss() -> int | None:
+    """Get the current resident set size of the integration in bytes or None if it's not available on this platform"""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+        #Peak instead of current value. Kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    except ImportError:
+        return None
+
+
+def module_name(filename: str) -> str:
+    """Get the module or top level package name for the file name of an allocation"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    if os.path.dirname(filename) == directory:
+        return os.path.splitext(os.path.basename(filename))[0]
+    parts = filename.replace("\\", "/").split("/")
+    if "site-packages" in parts:
+        index = parts.index("site-packages") + 1
+        if index < len(parts):
+            return os.path.splitext(parts[index])[0]
+    if filename.startswith("<"):
+        return filename
+    return "stdlib"
+
+
+def mb(size: int | None) -> str:
+    """Format a size in bytes as megabytes"""
+    return "n/a" if size is None else str(round(size / 1048576, 1)) + " MB"
+
+
+def kb(size: int) -> str:
+    """Format a size in bytes as kilobytes"""
+    return str(round(size / 1024, 1)) + " KB"
+
+
+
+class Report:
+    """Tracks the resident set size over time and the memory that has been allocated by each module. Allocations are only traced
+    while the report is activated with memory_report_interval in the config file as tracing needs additional memory and cpu time"""
+
+    __samples = collections.deque(maxlen=RSS_SAMPLES)
+
+    @staticmethod
+    def start():
+        """Start tracing allocations and the memory poller task if an interval has been set"""
+        interval = config.Setup.get("memory_report_interval")
+        if interval == 0:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if [task for task in driver.asyncio.all_tasks(driver.loop) if task.get_name() == "memory_poller" and not task.done()]:
+            return
+        driver.loop.create_task(memory_poller(interval), name="memory_poller")
+        _LOG.info("Started memory report task with an interval of " + str(interval) + " seconds")
+
+    @staticmethod
+    def sample() -> int | None:
+        """Add a resident set size sample and warn if the memory budget has been exceeded"""
+        current = rss()
+        if current is None:
+            return None
+        Report.__samples.append((int(time.time()), current))
+        budget = config.Setup.get("memory_budget") * 1048576
+        if current > budget:
+            _LOG.warning("Resident set size of " + mb(current) + " exceeds the memory budget of " + mb(budget))
+        return current
+
+    @staticmethod
+    def samples() -> list[tuple[int, int]]:
+        """Get all resident set size samples as (unix timestamp, bytes) tuples"""
+        return list(Report.__samples)
+
+    @staticmethod
+    def modules(limit: int = TOP_MODULES) -> list[tuple[str, int]]:
+        """Get the modules with the most currently allocated memory from a tracemalloc snapshot as (module, bytes) tuples"""
+        if not tracemalloc.is_tracing():
+            return []
+        sizes = collections.Counter()
+        for stat in tracemalloc.take_snapshot().statistics("filename"):
+            sizes[module_name(stat.traceback[0].filename)] += stat.size
+        return sizes.most_common(limit)
+
+    @staticmethod
+    def log():
+        """Log the current resident set size and the modules with the most allocated memory"""
+        current = Report.sample()
+        samples = Report.samples()
+        message = "Resident set size: " + mb(current)
+        if len(samples) > 1:
+            message += " (" + mb(samples[0][1]) + " " + str(round((samples[-1][0] - samples[0][0]) / 3600, 1)) + " hours ago)"
+        _LOG.info(message)
+        modules = Report.modules()
+        if modules:
+            _LOG.info("Allocated memory per module: " + ", ".join(name + " " + kb(size) for name, size in modules))
+
+
+
+async def memory_poller(interval: int):
+    """Memory report task"""
+    while True:
+        Report.log()
+        await lowpower.sleep("memory_poller", interval)
+
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""Module that includes optimistic attribute updates which show the expected result of a command right away and roll it back if the command fails"""
+
+import asyncio
+import logging
+
+import ucapi
+
+import config
+import dispatcher
+import driver
+import power
+import state
+
+_LOG = logging.getLogger(__name__)
+
+#Media player states that are treated as turned on when a power toggle command is received
+POWERED = (power.MP_STATES[power.WARMING], power.MP_STATES[power.ON])
+
+
+
+def expected(cmd_name: str, params: dict = None) -> dict:
+    """Get the expected attributes per entity id after a command has been executed successfully.
+    Returns an empty dict if the command doesn't change any power, mute or input attributes"""
+    mp_id = config.Setup.get("id")
+    rt_id = config.Setup.get("rt-id")
+
+    mp_entity = driver.api.configured_entities.get(mp_id)
+    current = mp_entity.attributes if mp_entity is not None else {}
+
+    match cmd_name:
+        case ucapi.media_player.Commands.ON:
+            new_phase = power.WARMING
+        case ucapi.media_player.Commands.OFF:
+            new_phase = power.COOLING
+        case ucapi.media_player.Commands.TOGGLE:
+            if current.get(ucapi.media_player.Attributes.STATE) in POWERED:
+                new_phase = power.COOLING
+            else:
+                new_phase = power.WARMING
+        case ucapi.media_player.Commands.MUTE | "MUTE":
+            return {mp_id: {ucapi.media_player.Attributes.MUTED: True}}
+        case ucapi.media_player.Commands.UNMUTE | "UNMUTE":
+            return {mp_id: {ucapi.media_player.Attributes.MUTED: False}}
+        case ucapi.media_player.Commands.MUTE_TOGGLE | "PICTURE_MUTING_TOGGLE":
+            if ucapi.media_player.Attributes.MUTED not in current:
+                return {}
+            return {mp_id: {ucapi.media_player.Attributes.MUTED: not current[ucapi.media_player.Attributes.MUTED]}}
+        case ucapi.media_player.Commands.SELECT_SOURCE | "INPUT_HDMI_1" | "INPUT_HDMI_2":
+            if params:
+                source = params.get("source")
+            else:
+                source = cmd_name.replace("INPUT_", "").replace("_", " ")
+            if source not in ("HDMI 1", "HDMI 2"):
+                return {}
+            return {mp_id: {ucapi.media_player.Attributes.SOURCE: source}}
+        case _:
+            return {}
+
+    return {
+        mp_id: {ucapi.media_player.Attributes.STATE: power.MP_STATES[new_phase]},
+        rt_id: {ucapi.remote.Attributes.STATE: power.RT_STATES[new_phase]}
+    }
+
+
+
+class Update:
+    """Optimistic attribute update for a single command. Remembers the previous attributes to be able to roll back the update"""
+
+    __slots__ = ("cmd_name", "attributes", "previous")
+
+    def __init__(self, cmd_name: str, attributes: dict):
+        self.cmd_name = cmd_name
+        self.attributes = attributes
+        self.previous = {}
+
+    def apply(self):
+        """Publish the expected attributes and remember the previous ones"""
+        for entity_id, attributes in self.attributes.items():
+            entity = driver.api.configured_entities.get(entity_id)
+            if entity is None:
+                continue
+            self.previous[entity_id] = {key: entity.attributes.get(key) for key in attributes if key in entity.attributes}
+            state.update_attributes(entity_id, attributes)
+
+    def rollback(self, reason: str):
+        """Restore the previous attributes. Attributes that have been changed in the meantime (e.g. by a poller or a newer command) will be kept"""
+        _LOG.warning("Rolling back optimistic update for command " + self.cmd_name + ". " + reason)
+        for entity_id, previous in self.previous.items():
+            entity = driver.api.configured_entities.get(entity_id)
+            if entity is None:
+                continue
+            attributes = {key: value for key, value in previous.items() if entity.attributes.get(key) == self.attributes[entity_id][key]}
+            if attributes:
+                state.update_attributes(entity_id, attributes)
+
+
+
+async def submit(entity_id: str, ip: str, cmd_name: str, params: dict = None):
+    """Submit a command to the dispatcher. If optimistic updates are enabled and the command changes power, mute or input attributes
+    the expected attributes are published right away and the command is confirmed in the background instead of waiting for the projector"""
+    if not config.Setup.get("optimistic_updates"):
+        await dispatcher.Dispatcher.submit(entity_id, ip, cmd_name, params)
+        return
+
+    try:
+        attributes = expected(cmd_name, params)
+    except ValueError as v:
+        _LOG.debug(v)
+        attributes = {}
+
+    if not attributes:
+        await dispatcher.Dispatcher.submit(entity_id, ip, cmd_name, params)
+        return
+
+    update = Update(cmd_name, attributes)
+    update.apply()
+    _LOG.debug("Published expected attributes " + str(attributes) + " for command " + cmd_name)
+
+    driver.loop.create_task(confirm(update, entity_id, ip, params), name="optimistic_confirm")
+
+
+
+async def confirm(update: Update, entity_id: str, ip: str, params: dict = None):
+    """Send the command in the background and roll back the optimistic update if the projector rejects the command or doesn't respond in time"""
+    timeout = config.Setup.get("optimistic_timeout")
+    try:
+        await asyncio.wait_for(dispatcher.Dispatcher.submit(entity_id, ip, update.cmd_name, params), timeout)
+    except asyncio.TimeoutError:
+        update.rollback("The command has not been confirmed by the projector within " + str(timeout) + " seconds")
+    except Exception as e:
+        update.rollback("The command failed: " + str(e))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""Module that includes the power transition tracker which follows the warm-up and cool-down phases of the projector"""
+
+import asyncio
+import logging
+import time
+
+import ucapi
+from pysdcp_extended.protocol import POWER_STATUS
+
+import config
+import driver
+import lamp
+import projector
+import state
+
+_LOG = logging.getLogger(__name__)
+
+STANDBY = "STANDBY"
+WARMING = "WARMING"
+ON = "ON"
+COOLING = "COOLING"
+
+#Media player state for each power phase. The intermediate phases are shown as buffering (warm-up) and standby (cool-down)
+MP_STATES = {
+    STANDBY: ucapi.media_player.States.OFF,
+    WARMING: ucapi.media_player.States.BUFFERING,
+    ON: ucapi.media_player.States.ON,
+    COOLING: ucapi.media_player.States.STANDBY
+}
+
+#The remote entity only supports on and off
+RT_STATES = {
+    STANDBY: ucapi.remote.States.OFF,
+    WARMING: ucapi.remote.States.ON,
+    ON: ucapi.remote.States.ON,
+    COOLING: ucapi.remote.States.OFF
+}
+
+
+
+def phase(data: int) -> str:
+    """Convert the raw power status value from the projector into a power phase"""
+    if data in (POWER_STATUS["START_UP"], POWER_STATUS["START_UP_LAMP"]):
+        return WARMING
+    if data == POWER_STATUS["POWER_ON"]:
+        return ON
+    if data in (POWER_STATUS["COOLING"], POWER_STATUS["COOLING2"]):
+        return COOLING
+    return STANDBY
+
+
+
+class Transition:
+    """Tracks the current power phase of the projector and polls the power status in short bursts while the projector warms up or cools down"""
+
+    __phase = None
+    __changed = 0.0
+    __refreshed = None
+    __burst_expired = False
+
+    @staticmethod
+    def get():
+        """Get the current power phase or None if it's not known yet"""
+        return Transition.__phase
+
+    @staticmethod
+    def since() -> float:
+        """Get the number of seconds since the last phase change"""
+        return time.monotonic() - Transition.__changed
+
+    @staticmethod
+    def age():
+        """Get the number of seconds since the power phase has been confirmed the last time (e.g. by a poller or an SDAP advertisement)
+        or None if it's not known yet"""
+        if Transition.__refreshed is None:
+            return None
+        return time.monotonic() - Transition.__refreshed
+
+    @staticmethod
+    def in_transition() -> bool:
+        """Check if the projector is currently warming up or cooling down"""
+        return Transition.__phase in (WARMING, COOLING)
+
+    @staticmethod
+    def set(new_phase: str):
+        """Set a new power phase, publish the corresponding entity states and start burst polling if the projector is in a transition phase"""
+        old_phase = Transition.__phase
+        Transition.__refreshed = time.monotonic()
+        if new_phase != old_phase:
+            Transition.__phase = new_phase
+            Transition.__changed = time.monotonic()
+            Transition.__burst_expired = False
+            _LOG.info("Projector power phase changed from " + str(old_phase) + " to " + new_phase)
+            lamp.LampClock.power_changed(new_phase in (WARMING, ON))
+            Transition.publish()
+
+            if new_phase in (ON, STANDBY) and old_phase in (WARMING, COOLING):
+                Transition.on_stable()
+
+        if Transition.in_transition():
+            Transition.start()
+
+    @staticmethod
+    def set_status(data: int):
+        """Set the power phase from a raw power status value from the projector"""
+        Transition.set(phase(data))
+
+    @staticmethod
+    def publish():
+        """Update the state attributes of the media player and remote entity with the current power phase"""
+        current_phase = Transition.__phase
+        try:
+            state.update_attributes(config.Setup.get("id"), {ucapi.media_player.Attributes.STATE: MP_STATES[current_phase]})
+            state.update_attributes(config.Setup.get("rt-id"), {ucapi.remote.Attributes.STATE: RT_STATES[current_phase]})
+        except ValueError as v:
+            _LOG.debug(v)
+
+    @staticmethod
+    def on_stable():
+        """Called once the projector has finished warming up or cooling down. Updates the lamp timer as the lamp hours only change while the projector is on
+        and the picture setting sensors as the picture settings can only be read while the projector is on"""
+        try:
+            lt_id = config.Setup.get("lt-id")
+            ip = config.Setup.get("ip")
+        except ValueError as v:
+            _LOG.debug(v)
+            return
+        driver.loop.create_task(update_lamp_timer(lt_id, ip), name="lt_update")
+        if Transition.__phase == ON:
+            driver.loop.create_task(update_picture_sensors(ip), name="picture_update")
+
+    @staticmethod
+    def expire_burst():
+        """Don't start the burst poller again until the power phase has changed, e.g. if the projector is stuck in a transition phase"""
+        Transition.__burst_expired = True
+
+    @staticmethod
+    def start():
+        """Start the burst poller task if it's not already running and has not timed out in the current power phase"""
+        if Transition.__burst_expired:
+            return
+        if [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == "power_burst_poller" and not task.done()]:
+            return
+        try:
+            ip = config.Setup.get("ip")
+        except ValueError as v:
+            _LOG.debug(v)
+            return
+        driver.loop.create_task(burst_poller(ip), name="power_burst_poller")
+
+    @staticmethod
+    def stop():
+        """Cancel the burst poller task if it's running"""
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() == "power_burst_poller":
+                task.cancel()
+
+
+
+async def update_lamp_timer(lt_id: str, ip: str):
+    """Update the lamp timer sensor after a power transition with the estimated lamp hours"""
+    import sensor # pylint: disable=import-outside-toplevel
+    try:
+        await sensor.update_lt(lt_id, ip, estimate=True)
+    except Exception as e:
+        _LOG.warning(e)
+
+
+
+async def update_picture_sensors(ip: str):
+    """Update the picture setting sensors after the projector has been turned on"""
+    import sensor # pylint: disable=import-outside-toplevel
+    try:
+        await sensor.update_picture(ip)
+    except Exception as e:
+        _LOG.warning(e)
+
+
+
+async def burst_poller(ip: str):
+    """Poll the power status in short intervals while the projector is warming up or cooling down.
+    Stops as soon as the projector has reached a stable power phase or if the transition takes longer than the configured timeout"""
+    interval = config.Setup.get("power_burst_interval")
+    timeout = config.Setup.get("power_burst_timeout")
+    start = time.monotonic()
+
+    _LOG.debug("Started power status burst polling with an interval of " + str(interval) + " seconds")
+
+    while Transition.in_transition():
+        if time.monotonic() - start > timeout:
+            _LOG.warning("The projector has not finished warming up or cooling down within " + str(timeout) + " seconds. Stop burst polling until the power phase changes")
+            Transition.expire_burst()
+            return
+        await asyncio.sleep(interval)
+        try:
+            values = await asyncio.to_thread(projector.get_items, ip, ["GET_STATUS_POWER"])
+            Transition.set_status(values["GET_STATUS_POWER"])
+        except Exception as e:
+            _LOG.debug("Could not get power status during transition: " + str(e))
+
+    _LOG.debug("Stopped power status burst polling. Projector power phase is " + str(Transition.get()))
@@ -2,6 +2,7 @@
 
 """Module that includes functions to execute pySDCP commands"""
 
+import asyncio
 import logging
 
 import ucapi
@@ -9,9 +10,17 @@ import ucapi
 import pysdcp_extended as pysdcp
 from pysdcp_extended.protocol import *
 
+import capabilities
+import commands
 import config
+import connection
+import deferred
 import driver
-import sensor
+import groups
+import power
+import retry
+import scenes
+import state
 
 _LOG = logging.getLogger(__name__)
 
@@ -37,7 +46,57 @@ def projector(ip):
     # Only include attributes that are not None (non default values) when creating the projector object
     valid_attributes = {key: value for key, value in attr.items() if value is not None}
 
-    return pysdcp.Projector(**valid_attributes)
+    pysdcp_projector = WarmProjector(**valid_attributes)
+
+    #Use the timeout derived from the measured round trip times instead of the fixed pysdcp timeout
+    if ip is not None:
+        pysdcp_projector.TCP_TIMEOUT = connection.RoundTrip.timeout(ip)
+
+    return pysdcp_projector
+
+
+
+class WarmProjector(pysdcp.Projector):
+    """pysdcp projector that sends a request with a session if there is a pre-warmed connection (see connection.Prewarm)
+    or a shared connection of the SDCP proxy (see connection.Upstream). SET requests invalidate the affected cached responses (see connection.Cache)"""
+
+    def _send_command(self, action, command, data=None, timeout=None):
+        use_session = self.ip is not None and (connection.Prewarm.ready(self.ip, config.Setup.get("sdcp_port")) or \
+            connection.Upstream.get(self.ip) is not None)
+        if not use_session:
+            try:
+                return super()._send_command(action, command, data, timeout)
+            finally:
+                if self.ip is not None and action != ACTIONS["GET"]:
+                    connection.Cache.invalidate(self.ip, command)
+        with connection.Session(self.ip, timeout if timeout is not None else self.TCP_TIMEOUT) as session:
+            return session.request(action, command, data)
+
+
+
+class AsyncProjector:
+    """Wraps a pysdcp projector object and runs its blocking methods in a separate thread to keep the event loop responsive while waiting for the projector.
+    Failed requests are retried depending on the error class (see retry.call)"""
+
+    def __init__(self, pysdcp_projector: pysdcp.Projector):
+        self.pysdcp_projector = pysdcp_projector
+
+    def __getattr__(self, name):
+        method = getattr(self.pysdcp_projector, name)
+
+        def run_timed(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                #Timeouts of requests that have been sent with a session have already been counted
+                if retry.classify(e) == retry.TIMEOUT and not isinstance(retry.unwrap(e), connection.CountedTimeoutError):
+                    connection.RoundTrip.expired(self.pysdcp_projector.ip)
+                raise
+
+        async def run_in_thread(*args, **kwargs):
+            return await retry.call(run_timed, *args, **kwargs)
+
+        return run_in_thread
 
 
 
@@ -85,31 +144,96 @@ def get_attr_source(ip: str):
 
 
 
+def get_items(ip: str, items: list[str]) -> dict:
+    """Get the current values of multiple items from the COMMANDS table from the projector in a single session and return the raw values"""
+    with connection.Session(ip) as session:
+        return session.get_items(items)
+
+def power_state(data: int):
+    """Convert the raw power status value into the corresponding ucapi media player state including the warm-up and cool-down phases"""
+    return power.MP_STATES[power.phase(data)]
+
+def muted_state(data: int) -> bool:
+    """Convert the raw picture muting value into either False or True"""
+    return data != PICTURE_MUTING["OFF"]
+
+def source_name(data: int) -> str:
+    """Convert the raw input value into the input source name"""
+    if data == INPUTS["HDMI1"]:
+        return "HDMI 1"
+    if data == INPUTS["HDMI2"]:
+        return "HDMI 2"
+    return ""
+
+def lamp_hours(data: int) -> str:
+    """Convert the raw lamp timer value into the lamp hours string"""
+    return "{:d}".format(data)
+
+
+
+def send_ir(ip: str, ir_name: str):
+    """Send a simulated ir command from the COMMANDS_IR table. The projector normally doesn't respond to these commands.
+    Replies that arrive anyway are drained and a failed status will raise an exception"""
+    with connection.Session(ip) as session:
+        session.request(ACTIONS["SET"], COMMANDS_IR[ir_name])
+        session.drain()
+
+
+
 async def send_cmd(entity_id: str, ip: str, cmd_name:str, params = None):
-    """Send a command to the projector and raise an exception if it fails"""
+    """Send a command to the projector and raise an exception if it fails.
+    Commands that are not supported by the projector model are rejected without sending them.
+    Setting commands will be held back and sent later if the projector is still warming up"""
 
-    projector_pysdcp = projector(ip)
+    projector_pysdcp = AsyncProjector(projector(ip))
     mp_id = config.Setup.get("id")
-    rt_id = config.Setup.get("rt-id")
-    lt_id = config.Setup.get("lt-id")
 
     def cmd_error(msg:str = None):
         if msg is None:
             _LOG.error("Error while executing the command: " + cmd_name)
             raise Exception(msg)
+        if isinstance(msg, Exception):
+            capabilities.Capabilities.learn(cmd_name, msg, params)
         _LOG.error(msg)
         _LOG.info("Please check if the projector is reachable from the network where the integration is running. \
 Also make sure if the sdcp port and/or pj talk community haven been changed in the projector")
         raise Exception(msg)
 
+    if commands.is_group_command(cmd_name):
+        #Group members can be other models and don't change the entities of this projector
+        report = await groups.send(cmd_name)
+        failed = [member["ip"] for member in report["members"] if member["result"] != "OK"]
+        if failed:
+            cmd_error("The command " + cmd_name + " failed for group member(s) " + ", ".join(failed))
+        return
+
+    if not capabilities.Capabilities.is_supported(cmd_name, params):
+        _LOG.error("The command " + cmd_name + " is not supported by this projector model")
+        raise Exception("The command " + cmd_name + " is not supported by this projector model")
+
+    if deferred.WarmupQueue.accepts(cmd_name, params):
+        deferred.WarmupQueue.add(entity_id, ip, cmd_name, params)
+        return
+
+    import sensor # pylint: disable=import-outside-toplevel
+    sensor.PictureSensors.refresh_after(ip, cmd_name, params)
+
+    if commands.is_scene_command(cmd_name):
+        try:
+            if cmd_name.startswith(commands.SCENE_SAVE):
+                await retry.call(scenes.save, ip, scenes.scene_name(cmd_name))
+            else:
+                await retry.call(scenes.apply, ip, scenes.scene_name(cmd_name))
+        except (Exception, ConnectionError) as e:
+            cmd_error(e)
+        return
+
     match cmd_name:
 
         case ucapi.media_player.Commands.ON:
             try:
-                if projector_pysdcp.set_power(True):
-                    driver.api.configured_entities.update_attributes(entity_id, {ucapi.media_player.Attributes.STATE: ucapi.media_player.States.ON})
-                    driver.api.configured_entities.update_attributes(rt_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.ON})
-                    sensor.update_lt(lt_id, ip)
+                if await projector_pysdcp.set_power(True):
+                    power.Transition.set(power.WARMING)
                 else:
                     cmd_error()
             except (Exception, ConnectionError) as e:
@@ -117,10 +241,8 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
 
         case ucapi.media_player.Commands.OFF:
             try:
-                if projector_pysdcp.set_power(False):
-                    driver.api.configured_entities.update_attributes(entity_id, {ucapi.media_player.Attributes.STATE: ucapi.media_player.States.OFF})
-                    driver.api.configured_entities.update_attributes(rt_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.OFF})
-                    sensor.update_lt(lt_id, ip)
+                if await projector_pysdcp.set_power(False):
+                    power.Transition.set(power.COOLING)
                 else:
                     cmd_error()
             except (Exception, ConnectionError) as e:
@@ -128,16 +250,14 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
 
         case ucapi.media_player.Commands.TOGGLE:
             try:
-                if projector_pysdcp.get_power():
-                    if projector_pysdcp.set_power(False):
-                        driver.api.configured_entities.update_attributes(entity_id, {ucapi.media_player.Attributes.STATE: ucapi.media_player.States.OFF})
-                        driver.api.configured_entities.update_attributes(rt_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.OFF})
+                if await projector_pysdcp.get_power():
+                    if await projector_pysdcp.set_power(False):
+                        power.Transition.set(power.COOLING)
                     else:
                         cmd_error()
-                elif not projector_pysdcp.get_power():
-                    if projector_pysdcp.set_power(True):
-                        driver.api.configured_entities.update_attributes(entity_id, {ucapi.media_player.Attributes.STATE: ucapi.media_player.States.ON})
-                        driver.api.configured_entities.update_attributes(rt_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.ON})
+                elif not await projector_pysdcp.get_power():
+                    if await projector_pysdcp.set_power(True):
+                        power.Transition.set(power.WARMING)
                     else:
                         cmd_error()
                 else:
@@ -149,14 +269,14 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             ucapi.media_player.Commands.MUTE_TOGGLE | \
             "PICTURE_MUTING_TOGGLE":
             try:
-                if projector_pysdcp.get_muting():
-                    if projector_pysdcp.set_muting(False):
-                        driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: False})
+                if await projector_pysdcp.get_muting():
+                    if await projector_pysdcp.set_muting(False):
+                        state.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: False})
                     else:
                         cmd_error()
-                elif not projector_pysdcp.get_muting():
-                    if projector_pysdcp.set_muting(True):
-                        driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: True})
+                elif not await projector_pysdcp.get_muting():
+                    if await projector_pysdcp.set_muting(True):
+                        state.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: True})
                     else:
                         cmd_error()
                 else:
@@ -168,8 +288,8 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             ucapi.media_player.Commands.MUTE | \
             "MUTE":
             try:
-                if projector_pysdcp.set_muting(True):
-                    driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: True})
+                if await projector_pysdcp.set_muting(True):
+                    state.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: True})
                 else:
                     cmd_error()
             except (Exception, ConnectionError) as e:
@@ -179,8 +299,8 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             ucapi.media_player.Commands.UNMUTE | \
             "UNMUTE":
             try:
-                if projector_pysdcp.set_muting(False):
-                    driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: False})
+                if await projector_pysdcp.set_muting(False):
+                    state.update_attributes(mp_id, {ucapi.media_player.Attributes.MUTED: False})
                 else:
                     cmd_error()
             except (Exception, ConnectionError) as e:
@@ -197,13 +317,13 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
 
             try:
                 if source == "HDMI 1":
-                    if projector_pysdcp.set_HDMI_input(1):
-                        driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.SOURCE: source})
+                    if await projector_pysdcp.set_HDMI_input(1):
+                        state.update_attributes(mp_id, {ucapi.media_player.Attributes.SOURCE: source})
                     else:
                         cmd_error()
                 elif source == "HDMI 2":
-                    if projector_pysdcp.set_HDMI_input(2):
-                        driver.api.configured_entities.update_attributes(mp_id, {ucapi.media_player.Attributes.SOURCE: source})
+                    if await projector_pysdcp.set_HDMI_input(2):
+                        state.update_attributes(mp_id, {ucapi.media_player.Attributes.SOURCE: source})
                     else:
                         cmd_error()
                 else:
@@ -216,7 +336,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "HOME" | \
             "MENU":
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS_IR["MENU"])
+                await retry.call(send_ir, ip, "MENU")
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -224,7 +344,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             ucapi.media_player.Commands.BACK | \
             "BACK":
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS_IR["CURSOR_LEFT"])
+                await retry.call(send_ir, ip, "CURSOR_LEFT")
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -248,7 +368,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "LENS_ZOOM_LARGE" | \
             "LENS_ZOOM_SMALL":
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS_IR[cmd_name.upper()])
+                await retry.call(send_ir, ip, cmd_name.upper())
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -261,7 +381,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_ASPECT_RATIO_SQUEEZE":
             aspect = cmd_name.replace("MODE_ASPECT_RATIO_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["ASPECT_RATIO"], data=ASPECT_RATIOS[aspect])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["ASPECT_RATIO"], data=ASPECT_RATIOS[aspect])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -277,7 +397,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_PRESET_USER":
             preset = cmd_name.replace("MODE_PRESET_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["CALIBRATION_PRESET"], data=CALIBRATION_PRESETS[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["CALIBRATION_PRESET"], data=CALIBRATION_PRESETS[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -290,7 +410,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_MOTIONFLOW_TRUE_CINEMA":
             preset = cmd_name.replace("MODE_MOTIONFLOW_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["MOTIONFLOW"], data=MOTIONFLOW[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["MOTIONFLOW"], data=MOTIONFLOW[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -302,24 +422,24 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             preset = cmd_name.replace("MODE_HDR_", "")
             if preset != "TOGGLE":
                 try:
-                    projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR[preset])
+                    await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR[preset])
                 except (Exception, ConnectionError) as e:
                     cmd_error(e)
             if preset == "TOGGLE":
                 try:
-                    data = projector_pysdcp._send_command(action=ACTIONS["GET"], command=COMMANDS["HDR"])
+                    data = await projector_pysdcp._send_command(action=ACTIONS["GET"], command=COMMANDS["HDR"])
                 except (Exception, ConnectionError) as e:
                     cmd_error(e)
                 if data == HDR["ON"] or data == HDR["AUTO"]:
                     try:
                         _LOG.info("Turn HDR off")
-                        projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR["OFF"])
+                        await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR["OFF"])
                     except (Exception, ConnectionError) as e:
                         cmd_error(e)
                 else:
                     try:
                         _LOG.info("Turn HDR on")
-                        projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR["ON"])
+                        await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["HDR"], data=HDR["ON"])
                     except (Exception, ConnectionError) as e:
                         cmd_error(e)
 
@@ -329,7 +449,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_2D_3D_SELECT_2D":
             preset = cmd_name.replace("MODE_2D_3D_SELECT_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["2D_3D_DISPLAY_SELECT"], data=TWO_D_THREE_D_SELECT[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["2D_3D_DISPLAY_SELECT"], data=TWO_D_THREE_D_SELECT[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -339,7 +459,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_3D_FORMAT_OVER_UNDER":
             preset = cmd_name.replace("MODE_3D_FORMAT_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["3D_FORMAT"], data=THREE_D_FORMATS[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["3D_FORMAT"], data=THREE_D_FORMATS[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -349,7 +469,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_ADVANCED_IRIS_LIMITED":
             preset = cmd_name.replace("MODE_ADVANCED_IRIS_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["ADVANCED_IRIS"], data=ADVANCED_IRIS[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["ADVANCED_IRIS"], data=ADVANCED_IRIS[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -358,7 +478,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "LAMP_CONTROL_HIGH":
             preset = cmd_name.replace("LAMP_CONTROL_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["LAMP_CONTROL"], data=LAMP_CONTROL[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["LAMP_CONTROL"], data=LAMP_CONTROL[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -367,7 +487,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "INPUT_LAG_REDUCTION_OFF":
             preset = cmd_name.replace("INPUT_LAG_REDUCTION_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["INPUT_LAG_REDUCTION"], data=INPUT_LAG_REDUCTION[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["INPUT_LAG_REDUCTION"], data=INPUT_LAG_REDUCTION[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -376,7 +496,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MENU_POSITION_CENTER":
             preset = cmd_name.replace("MENU_POSITION_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["MENU_POSITION"], data=MENU_POSITIONS[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["MENU_POSITION"], data=MENU_POSITIONS[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
@@ -390,7 +510,7 @@ Also make sure if the sdcp port and/or pj talk community haven been changed in t
             "MODE_PICTURE_POSITION_CUSTOM_5":
             preset = cmd_name.replace("MODE_PICTURE_POSITION_", "")
             try:
-                projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["PICTURE_POSITION"], data=PICTURE_POSITIONS[preset])
+                await projector_pysdcp._send_command(action=ACTIONS["SET"], command=COMMANDS["PICTURE_POSITION"], data=PICTURE_POSITIONS[preset])
             except (Exception, ConnectionError) as e:
                 cmd_error(e)
 
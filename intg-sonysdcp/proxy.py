@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""Module that includes the SDCP proxy which lets other SDCP clients share a single connection to the projector with the integration"""
+
+import asyncio
+import collections
+import logging
+
+import config
+import connection
+import driver
+
+_LOG = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 30 #Seconds without a request after which the connection to the projector is closed
+COMMUNITY_ERROR = 0x0201
+TIMEOUT_ERROR = 0xF001
+OTHER_ERROR = 0xF050
+INTEGRATION = "integration" #Queue of the integration's own requests
+
+
+
+def error_response(request: bytes, code: int) -> bytes:
+    """Create a failed SDCP response with an error code for a request"""
+    return bytes(request[0:6]) + b"\x00" + bytes(request[7:9]) + b"\x02" + code.to_bytes(2, "big")
+
+
+
+class Proxy:
+    """SDCP server that accepts many client connections and sends their requests to the projector over one shared connection.
+    The integration's own requests (pollers, commands, scenes and sequences) are sent over the same connection as if the integration
+    was another client, so there is only one connection to the projector while the proxy is running (see connection.Upstream).
+    The requests of all clients are interleaved fairly in rounds with one request per client. GET requests of other clients are answered
+    from the responses of earlier requests if they are younger than proxy_cache_age seconds. The proxy is only started if a proxy port
+    has been set in the config file"""
+
+    __server = None
+    __queues = {}
+    __pending = None
+    __session = None
+    __ip = None
+    __inflight = None
+
+    @staticmethod
+    async def start():
+        """Start the proxy server and the worker task if a port has been set and the proxy is not already running"""
+        port = config.Setup.get("proxy_port")
+        if port == 0 or Proxy.__server is not None:
+            return
+        try:
+            ip = config.Setup.get("ip")
+        except ValueError:
+            _LOG.debug("The SDCP proxy will be started after the setup has been completed")
+            return
+        try:
+            Proxy.__server = await asyncio.start_server(Proxy.handle_client, port=port)
+        except OSError as o:
+            _LOG.warning("Could not start the SDCP proxy on port " + str(port) + ": " + str(o))
+            return
+        Proxy.__ip = ip
+        Proxy.__pending = asyncio.Event()
+        Proxy.__queues = {INTEGRATION: collections.deque()}
+        driver.loop.create_task(worker(), name="proxy_worker")
+        connection.Prewarm.cancel()
+        connection.Upstream.attach(ip, Proxy.submit)
+        _LOG.info("Started SDCP proxy on port " + str(port))
+
+    @staticmethod
+    async def stop():
+        """Stop the proxy server and the worker task, answer all queued requests with an error and close the connection to the projector.
+        Afterwards the integration opens its own connections again"""
+        if Proxy.__server is None:
+            return
+        connection.Upstream.detach(Proxy.__ip)
+        Proxy.__server.close()
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() == "proxy_worker":
+                task.cancel()
+        waiting = [(client, *queued) for client, queue in Proxy.__queues.items() for queued in queue]
+        if Proxy.__inflight is not None:
+            waiting.append(Proxy.__inflight)
+        for client, request, future in waiting:
+            if future.done():
+                continue
+            if client == INTEGRATION:
+                future.set_exception(ConnectionAbortedError("The SDCP proxy has been stopped"))
+            else:
+                future.set_result(error_response(request, OTHER_ERROR))
+        for client in list(Proxy.__queues):
+            if client != INTEGRATION:
+                client.close()
+        Proxy.__queues = {}
+        Proxy.close_upstream()
+        await Proxy.__server.wait_closed()
+        Proxy.__server = None
+        _LOG.info("Stopped SDCP proxy")
+
+    @staticmethod
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read the requests of a client one after another and send back the responses"""
+        peer = str(writer.get_extra_info("peername"))
+        queue = collections.deque()
+        Proxy.__queues[writer] = queue
+        _LOG.debug("SDCP proxy client " + peer + " connected")
+
+        try:
+            while True:
+                header = await reader.readexactly(connection.HEADER_SIZE)
+                request = header + await reader.readexactly(header[9])
+                response = await Proxy.handle(queue, request)
+                if response is not None:
+                    writer.write(response)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            Proxy.__queues.pop(writer, None)
+            writer.close()
+            _LOG.debug("SDCP proxy client " + peer + " disconnected")
+
+    @staticmethod
+    async def handle(queue: collections.deque, request: bytes):
+        """Answer a request from the cache or queue it for the projector. Returns the response or None for simulated ir commands"""
+        community = config.Setup.get("pjtalk_community")
+        if request[2:6] != community.encode():
+            return error_response(request, COMMUNITY_ERROR)
+
+        command = int.from_bytes(request[7:9], "big")
+        if request[6] == connection.ACTIONS["GET"]:
+            cached = connection.Cache.get(Proxy.__ip, command, config.Setup.get("proxy_cache_age"))
+            if cached is not None:
+                _LOG.debug("Answered GET request 0x{:04x} from the cache".format(command))
+                return cached
+
+        return await Proxy.enqueue(queue, request)
+
+    @staticmethod
+    async def enqueue(queue: collections.deque, request: bytes):
+        """Queue a request for the worker task and wait for the response"""
+        if Proxy.__server is None:
+            raise ConnectionAbortedError("The SDCP proxy has been stopped")
+        future = driver.loop.create_future()
+        queue.append((request, future))
+        Proxy.__pending.set()
+        return await future
+
+    @staticmethod
+    def submit(request: bytes):
+        """Send a request of the integration over the shared connection and return the response or None for simulated ir commands.
+        Called by sessions from a separate thread. Errors from the projector connection are raised like for an own connection"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run_coroutine_threadsafe(Proxy.enqueue(Proxy.__queues[INTEGRATION], request), driver.loop).result()
+        #Waiting for the worker inside the event loop would block it. Only used if a request is sent without a separate thread
+        _LOG.debug("Sending request outside of the SDCP proxy as it has been sent from the event loop")
+        with connection.Session(Proxy.__ip, direct=True) as session:
+            return session.forward(request)
+
+    @staticmethod
+    async def send_upstream(client, request: bytes, future: asyncio.Future):
+        """Send a request over the shared connection to the projector and pass the response or error to the waiting client.
+        Replies to simulated ir commands that arrive anyway are drained, so they can't be mistaken for the response of the next request"""
+        if Proxy.__session is None:
+            Proxy.__session = connection.Session(Proxy.__ip, direct=True)
+        session = Proxy.__session
+
+        def forward():
+            if session.sock is not None and not connection.is_open(session.sock):
+                #Closed by the projector while idle. A request sent over it would be lost after it has been written
+                _LOG.debug("SDCP proxy connection has been closed by the projector. Reconnecting")
+                session.close()
+            response = session.forward(request)
+            if response is None:
+                session.drain()
+            return response
+
+        Proxy.__inflight = (client, request, future)
+        try:
+            response = await asyncio.to_thread(forward)
+        except Exception as e:
+            if client == INTEGRATION:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            _LOG.debug("SDCP proxy request failed: " + str(e))
+            if isinstance(e, connection.NakError):
+                #Failed status of a drained ir command reply. Other clients don't expect a reply to simulated ir commands
+                response = None
+            else:
+                response = error_response(request, TIMEOUT_ERROR if isinstance(e, TimeoutError) else OTHER_ERROR)
+        finally:
+            Proxy.__inflight = None
+        if not future.done():
+            future.set_result(response)
+
+    @staticmethod
+    def next_round() -> list:
+        """Take the oldest queued request of each client including the integration"""
+        return [(client, *queue.popleft()) for client, queue in list(Proxy.__queues.items()) if queue]
+
+    @staticmethod
+    def wait_pending():
+        """Get the coroutine that waits for new requests"""
+        return Proxy.__pending.wait()
+
+    @staticmethod
+    def clear_pending():
+        """Reset the new requests event"""
+        Proxy.__pending.clear()
+
+    @staticmethod
+    def upstream_open() -> bool:
+        """Check if the shared connection to the projector is open"""
+        return Proxy.__session is not None
+
+    @staticmethod
+    def close_upstream():
+        """Close the shared connection to the projector. It will be opened again with the next request"""
+        if Proxy.__session is not None:
+            Proxy.__session.close()
+            Proxy.__session = None
+            _LOG.debug("Closed SDCP proxy connection to the projector")
+
+
+
+async def worker():
+    """SDCP proxy worker task that sends all queued requests in rounds with one request per client, so a client with many requests
+    can't hold back the others. The connection to the projector is closed after IDLE_TIMEOUT seconds without requests"""
+    while True:
+        if Proxy.upstream_open():
+            try:
+                await asyncio.wait_for(Proxy.wait_pending(), IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                Proxy.close_upstream()
+                continue
+        else:
+            #No timeout needed without an open connection, so the worker doesn't wake up while no client sends anything
+            await Proxy.wait_pending()
+        Proxy.clear_pending()
+        while True:
+            requests = Proxy.next_round()
+            if not requests:
+                break
+            for client, request, future in requests:
+                await Proxy.send_upstream(client, request, future)
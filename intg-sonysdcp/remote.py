@@ -4,39 +4,155 @@
 
 import asyncio
 import logging
+from functools import cache
 from typing import Any
 import time
 
 import ucapi
 import ucapi.ui
 
+import capabilities
 import driver
 import config
+import dispatcher
+import optimistic
+import power
 import projector
+import retry
+import sequencer
+import state
 
 _LOG = logging.getLogger(__name__)
 
 
 
-async def update_rt(entity_id: str, ip: str):
-    """Retrieve input source, power state and muted state from the projector, compare them with the known state on the remote and update them if necessary"""
+async def update_rt(entity_id: str, ip: str, values: dict = None):
+    """Retrieve the power state from the projector and update the remote entity state attribute
+
+    :values: Already retrieved raw projector values (e.g. from a consolidated refresh). If None the power state will be retrieved from the projector
+    """
 
     try:
-        state = projector.get_attr_power(ip)
+        if values is None:
+            values = await asyncio.to_thread(projector.get_items, ip, ["GET_STATUS_POWER"])
+        power_state = {ucapi.remote.Attributes.STATE: power.RT_STATES[power.phase(values["GET_STATUS_POWER"])]}
+        power.Transition.set_status(values["GET_STATUS_POWER"])
     except Exception as e:
         _LOG.error(e)
         _LOG.warning("Can't get power status from projector. Set to Unavailable")
-        state = {ucapi.remote.Attributes.STATE: ucapi.remote.States.UNAVAILABLE}
+        power_state = {ucapi.remote.Attributes.STATE: ucapi.remote.States.UNAVAILABLE}
 
     try:
-        api_update_attributes = driver.api.configured_entities.update_attributes(entity_id, state)
+        api_update_attributes = state.update_attributes(entity_id, power_state)
     except Exception as e:
         raise Exception("Error while updating state attribute for entity id " + entity_id) from e
 
     if not api_update_attributes:
         raise Exception("Entity " + entity_id + " not found. Please make sure it's added as a configured entity on the remote")
     else:
-        _LOG.info("Updated remote entity state attribute to " + str(state) + " for " + entity_id)
+        _LOG.info("Updated remote entity state attribute to " + str(power_state) + " for " + entity_id)
+
+
+
+class Repetition:
+    """Sends a remote command with repeat, delay and hold on the monotonic clock.
+    Hold resends the command at a fixed cadence (hold_interval) instead of as fast as the projector answers.
+    Only one repetition runs at a time. A running repetition will be cancelled as soon as a new remote command arrives"""
+
+    __slots__ = ("entity_id", "ip", "repeat", "delay", "hold", "interval", "frames", "cancelled")
+    __running = None
+
+    def __init__(self, entity_id: str, ip: str, repeat: int = 1, delay: int = 0, hold: int = 0):
+        """
+        :param repeat: number of rounds
+        :param delay: delay between two rounds in milliseconds
+        :param hold: duration in milliseconds for which the command will be resent in each round
+        """
+        self.entity_id = entity_id
+        self.ip = ip
+        self.repeat = repeat
+        self.delay = delay / 1000
+        self.hold = hold / 1000
+        self.interval = config.Setup.get("hold_interval") / 1000
+        self.frames = 0
+        self.cancelled = asyncio.Event()
+
+        if self.repeat == 1 and self.delay != 0:
+            _LOG.info(str(self.delay) + " seconds delay will be ignored as the command will not be repeated (repeat = 1)")
+            self.delay = 0
+
+    @staticmethod
+    def cancel_running():
+        """Cancel the currently running repetition if there is one"""
+        running = Repetition.__running
+        if running is not None and not running.cancelled.is_set():
+            _LOG.debug("Cancelling running command repetition after " + str(running.frames) + " sent commands")
+            running.cancelled.set()
+
+    async def _wait(self, seconds: float) -> bool:
+        """Wait for the given seconds. Returns True if the repetition has been cancelled in the meantime"""
+        if seconds > 0:
+            try:
+                await asyncio.wait_for(self.cancelled.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        return self.cancelled.is_set()
+
+    async def _send_rounds(self, command: str):
+        """Send all rounds of a command. With hold the command is resent at the hold interval cadence in each round"""
+        for i in range(1, self.repeat + 1):
+            if self.cancelled.is_set():
+                break
+            if self.repeat != 1:
+                _LOG.debug("Round " + str(i) + " for command " + command)
+
+            try:
+                if self.hold > 0:
+                    end = time.monotonic() + self.hold
+                    next_frame = time.monotonic()
+                    while True:
+                        await dispatcher.Dispatcher.submit(self.entity_id, self.ip, command)
+                        self.frames += 1
+                        #Skip frames that could not be sent in time instead of sending them in a burst afterwards
+                        next_frame = max(next_frame + self.interval, time.monotonic())
+                        if next_frame >= end or await self._wait(next_frame - time.monotonic()):
+                            break
+                else:
+                    await dispatcher.Dispatcher.submit(self.entity_id, self.ip, command)
+                    self.frames += 1
+            except Exception:
+                if self.repeat != 1:
+                    _LOG.warning("Execution of the command " + command + " failed. Remaining " + str(self.repeat-i) + " repetitions will no longer be executed")
+                raise
+
+            if i < self.repeat and await self._wait(self.delay):
+                break
+
+    async def execute(self, sequence: list[str], delay: int = 0) -> list[dict]:
+        """Send a command sequence without repetitions over a single connection and return the report with the result of each command"""
+        Repetition.__running = self
+        try:
+            return await sequencer.execute(self.entity_id, self.ip, sequence, delay, self.cancelled)
+        finally:
+            if Repetition.__running is self:
+                Repetition.__running = None
+
+    async def send(self, command: str) -> int:
+        """Send the command with all rounds and return the number of commands that have actually been sent.
+        Raises an exception if sending the command fails"""
+        Repetition.__running = self
+        frames_before = self.frames
+
+        try:
+            await self._send_rounds(command)
+        finally:
+            if Repetition.__running is self:
+                Repetition.__running = None
+
+        if self.repeat != 1 or self.hold > 0:
+            _LOG.debug("Sent command " + command + " " + str(self.frames - frames_before) + " time(s)")
+
+        return self.frames - frames_before
 
 
 
@@ -54,26 +170,23 @@ async def remote_cmd_handler(
     :return: status of the command
     """
 
+    #A new command always stops a running repeat or hold of the previous command
+    Repetition.cancel_running()
+
+    repeat = 1
+    delay = 0
+    hold = 0
+
     if not params:
         _LOG.info(f"Received {cmd_id} command for {entity.id}")
     else:
         _LOG.info(f"Received {cmd_id} command with parameter {params} for {entity.id}")
-        repeat = params.get("repeat")
-        delay = params.get("delay")
-        hold = params.get("hold")
-
-        if hold is None or hold == "":
-            hold = 0
-        if repeat is None:
-            repeat = 1
-        if delay is None:
-            delay = 0
-        else:
-            delay = delay / 1000 #Convert milliseconds to seconds for sleep
-
-        if repeat == 1 and delay != 0:
-            _LOG.info(str(delay) + " seconds delay will be ignored as the command will not be repeated (repeat = 1)")
-            delay = 0
+        if params.get("repeat") is not None:
+            repeat = params.get("repeat")
+        if params.get("delay") is not None:
+            delay = params.get("delay")
+        if params.get("hold") is not None and params.get("hold") != "":
+            hold = params.get("hold")
 
     try:
         ip = config.Setup.get("ip")
@@ -88,74 +201,50 @@ async def remote_cmd_handler(
             ucapi.remote.Commands.OFF | \
             ucapi.remote.Commands.TOGGLE:
             try:
-                await projector.send_cmd(entity.id, ip, cmd_id)
+                await optimistic.submit(entity.id, ip, cmd_id)
             except Exception as e:
                 if e is None:
                     return ucapi.StatusCodes.SERVER_ERROR
-                return ucapi.StatusCodes.BAD_REQUEST
+                return retry.status_code(e)
             return ucapi.StatusCodes.OK
 
         case \
-            ucapi.remote.Commands.SEND_CMD:
+            ucapi.remote.Commands.SEND_CMD | \
+            ucapi.remote.Commands.SEND_CMD_SEQUENCE:
 
-            command = params.get("command")
+            if cmd_id == ucapi.remote.Commands.SEND_CMD:
+                sequence = [params.get("command")]
+            else:
+                sequence = params.get("sequence")
+                _LOG.info(f"Command sequence: {sequence}")
 
+            #Check all commands before the first command is sent
             try:
-                i = 0
-                r = range(repeat)
-                for i in r:
-                    i = i+1
-                    if repeat != 1:
-                        _LOG.debug("Round " + str(i) + " for command " + command)
-                    if hold != 0:
-                        cmd_start = time.time()*1000
-                        while time.time()*1000 - cmd_start < hold:
-                            await projector.send_cmd(entity.id, ip, command)
-                            await asyncio.sleep(0)
-                    else:
-                        await projector.send_cmd(entity.id, ip, command)
-                        await asyncio.sleep(0)
-                    await asyncio.sleep(delay)
-            except Exception as e:
-                if repeat != 1:
-                    _LOG.warning("Execution of the command " + command + " failed. Remaining " + str(repeat-1) + " repetitions will no longer be executed")
-                if e is None:
-                    return ucapi.StatusCodes.SERVER_ERROR
+                sequencer.validate(sequence)
+            except ValueError as v:
+                _LOG.error(v)
                 return ucapi.StatusCodes.BAD_REQUEST
 
-            return ucapi.StatusCodes.OK
-
-        case \
-            ucapi.remote.Commands.SEND_CMD_SEQUENCE:
-
-            sequence = params.get("sequence")
+            if cmd_id == ucapi.remote.Commands.SEND_CMD_SEQUENCE and repeat == 1 and hold == 0:
+                #Sequences without repetitions are sent over a single connection. The delay is used between the sequence commands
+                report = await Repetition(entity.id, ip).execute(sequence, delay)
+                if [step for step in report if step["result"].startswith("ERROR")]:
+                    return ucapi.StatusCodes.BAD_REQUEST
+                return ucapi.StatusCodes.OK
 
-            _LOG.info(f"Command sequence: {sequence}")
+            repetition = Repetition(entity.id, ip, repeat, delay, hold)
 
             for command in sequence:
+                if repetition.cancelled.is_set():
+                    _LOG.info("Command sequence has been cancelled by a new command. Skipping command " + command)
+                    break
                 _LOG.debug("Sending command: " + command)
                 try:
-                    i = 0
-                    r = range(repeat)
-                    for i in r:
-                        i = i+1
-                        if repeat != 1:
-                            _LOG.debug("Round " + str(i) + " for command " + command)
-                        if hold != 0:
-                            cmd_start = time.time()*1000
-                            while time.time()*1000 - cmd_start < hold:
-                                await projector.send_cmd(entity.id, ip, command)
-                                await asyncio.sleep(0)
-                        else:
-                            await projector.send_cmd(entity.id, ip, command)
-                            await asyncio.sleep(0)
-                        await asyncio.sleep(delay)
+                    await repetition.send(command)
                 except Exception as e:
-                    if repeat != 1:
-                        _LOG.warning("Execution of the command " + command + " failed. Remaining " + str(repeat-1) + " repetitions will no longer be executed")
                     if e is None:
                         return ucapi.StatusCodes.SERVER_ERROR
-                    return ucapi.StatusCodes.BAD_REQUEST
+                    return retry.status_code(e)
 
             return ucapi.StatusCodes.OK
 
@@ -166,8 +255,9 @@ async def remote_cmd_handler(
 
 
 
+@cache
 def create_button_mappings() -> list[ucapi.ui.DeviceButtonMapping | dict[str, Any]]:
-    """Create the button mapping of the remote entity"""
+    """Create the button mapping of the remote entity. The result is cached as it never changes during runtime"""
     return [
         ucapi.ui.create_btn_mapping(ucapi.ui.Buttons.BACK, "BACK"),
         ucapi.ui.create_btn_mapping(ucapi.ui.Buttons.HOME, "MENU"),
@@ -194,8 +284,9 @@ def create_button_mappings() -> list[ucapi.ui.DeviceButtonMapping | dict[str, An
 
 
 
+@cache
 def create_ui_pages() -> list[ucapi.ui.UiPage | dict[str, Any]]:
-    """Create a user interface with different pages that includes all commands"""
+    """Create a user interface with different pages that includes all commands. The result is cached as it never changes during runtime"""
 
     ui_page1 = ucapi.ui.UiPage("page1", "Power, Inputs & HDR", grid=ucapi.ui.Size(6, 6))
     ui_page1.add(ucapi.ui.create_ui_text("On", 0, 0, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.Commands.ON))
@@ -232,13 +323,13 @@ def create_ui_pages() -> list[ucapi.ui.UiPage | dict[str, Any]]:
 
     ui_page4 = ucapi.ui.UiPage("page4", "Picture Positions")
     ui_page4.add(ucapi.ui.create_ui_text("-- Picture Positions --", 0, 0, size=ucapi.ui.Size(4, 1)))
-    ui_page4.add(ucapi.ui.create_ui_text("1,85", 0, 1, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_1_85")))
-    ui_page4.add(ucapi.ui.create_ui_text("2,35", 2, 1, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_2_35")))
-    ui_page4.add(ucapi.ui.create_ui_text("Custom 1", 0, 2, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_CUSTOM_1")))
-    ui_page4.add(ucapi.ui.create_ui_text("Custom 2", 2, 2, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_CUSTOM_2")))
-    ui_page4.add(ucapi.ui.create_ui_text("Custom 3", 0, 3, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_CUSTOM_3")))
-    ui_page4.add(ucapi.ui.create_ui_text("Custom 4", 2, 3, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_CUSTOM_4")))
-    ui_page4.add(ucapi.ui.create_ui_text("Custom 5", 1, 4, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("PICTURE_POSITION_CUSTOM_5")))
+    ui_page4.add(ucapi.ui.create_ui_text("1,85", 0, 1, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_1_85")))
+    ui_page4.add(ucapi.ui.create_ui_text("2,35", 2, 1, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_2_35")))
+    ui_page4.add(ucapi.ui.create_ui_text("Custom 1", 0, 2, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_CUSTOM_1")))
+    ui_page4.add(ucapi.ui.create_ui_text("Custom 2", 2, 2, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_CUSTOM_2")))
+    ui_page4.add(ucapi.ui.create_ui_text("Custom 3", 0, 3, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_CUSTOM_3")))
+    ui_page4.add(ucapi.ui.create_ui_text("Custom 4", 2, 3, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_CUSTOM_4")))
+    ui_page4.add(ucapi.ui.create_ui_text("Custom 5", 1, 4, size=ucapi.ui.Size(2, 1), cmd=ucapi.remote.create_send_cmd("MODE_PICTURE_POSITION_CUSTOM_5")))
 
     ui_page5 = ucapi.ui.UiPage("page5", "Motionflow")
     ui_page5.add(ucapi.ui.create_ui_text("-- Motionflow --", 0, 0, size=ucapi.ui.Size(4, 1)))
@@ -291,19 +382,55 @@ def create_ui_pages() -> list[ucapi.ui.UiPage | dict[str, Any]]:
 
 
 
+def prune_ui_pages(ui_pages: list[ucapi.ui.UiPage]) -> list[ucapi.ui.UiPage]:
+    """Remove all ui items with commands that are not supported by the projector model. A section header will be removed together with
+    all of its commands and pages without any remaining commands will be removed completely"""
+    pruned_pages = []
+
+    for ui_page in ui_pages:
+        pruned_page = ucapi.ui.UiPage(ui_page.page_id, ui_page.name, grid=ui_page.grid)
+        section = []
+        section_removed = False
+
+        for ui_item in ui_page.items + [None]:
+            if ui_item is None or (ui_item.command is None and ui_item.text and ui_item.text.startswith("--")):
+                #Keep the previous section unless all of its commands have been removed
+                if not section_removed or [item for item in section if item.command is not None]:
+                    pruned_page.items.extend(section)
+                section = [ui_item]
+                section_removed = False
+                continue
+            if ui_item.command is not None and ui_item.command.params and "command" in ui_item.command.params \
+                and not capabilities.Capabilities.is_supported(ui_item.command.params["command"]):
+                section_removed = True
+                continue
+            section.append(ui_item)
+
+        if [item for item in pruned_page.items if item.command is not None]:
+            pruned_pages.append(pruned_page)
+
+    return pruned_pages
+
+
+
 async def add_remote(ent_id: str, name: str):
     """Function to add a remote entity"""
 
     _LOG.info("Add projector remote entity with id " + ent_id + " and name " + name)
 
+    build_start = time.perf_counter()
+    button_mappings = create_button_mappings()
+    ui_pages = prune_ui_pages(create_ui_pages())
+    _LOG.debug("Got remote button mappings and ui pages in " + str(round((time.perf_counter() - build_start) * 1000, 1)) + " ms")
+
     definition = ucapi.Remote(
         ent_id,
         name,
         features=config.RemoteDef.features,
-        attributes=config.RemoteDef.attributes,
-        simple_commands=config.RemoteDef.simple_commands,
-        button_mapping=create_button_mappings(),
-        ui_pages=create_ui_pages(),
+        attributes={**config.RemoteDef.attributes, **state.LastKnown.get(ent_id)}, #Last known attributes as provisional values
+        simple_commands=capabilities.Capabilities.prune(config.RemoteDef.simple_commands),
+        button_mapping=button_mappings,
+        ui_pages=ui_pages,
         cmd_handler=remote_cmd_handler,
     )
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""Module that includes the classification of SDCP errors and the retry policy with jittered backoff for requests to the projector"""
+
+import asyncio
+import logging
+import random
+import time
+
+import ucapi
+from pysdcp_extended.protocol import RESPONSE_ERRORS
+
+import config
+import connection
+
+_LOG = logging.getLogger(__name__)
+
+TRANSPORT = "transport" #Connection refused, reset or closed by the projector
+TIMEOUT = "timeout" #No response from the projector within the timeout
+NAK = "nak" #Failed status from the projector with an error code
+AUTH = "auth" #Failed status because the PJ Talk community doesn't match
+
+COMMUNITY_ERROR = 0x201
+
+#Error class: Number of retries. Transient errors are retried, permanent errors fail immediately
+RETRIES = {
+    TRANSPORT: 2,
+    TIMEOUT: 1,
+    NAK: 0,
+    AUTH: 0
+}
+
+#NAK error codes that are caused by a temporary problem inside the projector and are therefore retried
+TRANSIENT_NAKS = [0xF001, 0xF010, 0xF020, 0xF030, 0xF040, 0xF050]
+
+#Status code for the command handlers for each error class
+STATUS_CODES = {
+    TRANSPORT: ucapi.StatusCodes.SERVICE_UNAVAILABLE,
+    TIMEOUT: ucapi.StatusCodes.TIMEOUT,
+    NAK: ucapi.StatusCodes.BAD_REQUEST,
+    AUTH: ucapi.StatusCodes.UNAUTHORIZED
+}
+
+
+
+def nak_code(e: Exception):
+    """Get the error code of a failed status from the projector or None if the exception is not caused by a failed status.
+    Errors from pysdcp only contain the error message which is looked up in the RESPONSE_ERRORS table"""
+    if isinstance(e, connection.NakError):
+        return e.code
+    msg = str(e)
+    if "Received failed status" not in msg:
+        return None
+    for code, error_msg in RESPONSE_ERRORS.items():
+        if msg.endswith(error_msg):
+            return code
+    return None
+
+
+def unwrap(e: Exception) -> Exception:
+    """Get the original exception from exceptions that only wrap another exception"""
+    while e.args and isinstance(e.args[0], BaseException):
+        e = e.args[0]
+    return e
+
+
+def idempotent(e: Exception) -> bool:
+    """Check if a failed request can be sent again without being executed twice by the projector.
+    Only requests whose response has been lost after they have been sent need to be checked. Only GET requests can be repeated safely then"""
+    e = unwrap(e)
+    lost = e if isinstance(e, connection.ResponseLostError) else e.__cause__
+    if isinstance(lost, connection.ResponseLostError):
+        return lost.action == connection.ACTIONS["GET"]
+    return True
+
+
+def classify(e: Exception) -> str:
+    """Get the error class of an exception from a request to the projector. Exceptions that only wrap another exception will be unwrapped"""
+    e = unwrap(e)
+
+    code = nak_code(e)
+    if code is not None:
+        return AUTH if code == COMMUNITY_ERROR else NAK
+    if isinstance(e, TimeoutError) or isinstance(e.__cause__, TimeoutError) or str(e).startswith("Timeout"):
+        return TIMEOUT
+    if isinstance(e, OSError) or isinstance(e.__cause__, OSError):
+        return TRANSPORT
+    return NAK
+
+
+def retries(e: Exception) -> int:
+    """Get the number of retries for an error. NAKs are only retried if they are caused by a temporary problem inside the projector.
+    Requests that may already have been executed by the projector are not retried unless they are idempotent"""
+    if not idempotent(e):
+        return 0
+    error_class = classify(e)
+    if error_class == NAK and nak_code(e) in TRANSIENT_NAKS:
+        return RETRIES[TRANSPORT]
+    return RETRIES[error_class]
+
+
+def status_code(e: Exception) -> ucapi.StatusCodes:
+    """Get the status code for the command handlers for an exception from a command"""
+    return STATUS_CODES[classify(e)]
+
+
+
+async def call(func, *args, **kwargs):
+    """Run a blocking function that sends a request to the projector in a separate thread and retry it depending on the error class.
+    Retries use an exponential backoff with full jitter and stop once the configured deadline would be exceeded"""
+    deadline = time.monotonic() + config.Setup.get("retry_deadline")
+    backoff = config.Setup.get("retry_backoff") / 1000
+    attempt = 0
+
+    while True:
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            error_class = classify(e)
+            max_retries = retries(e)
+
+            if attempt >= max_retries:
+                if error_class == AUTH:
+                    _LOG.error("The projector rejected the request because of a different PJ Talk community. Please check the community in the projector and the integration setup")
+                raise
+
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            if time.monotonic() + delay > deadline:
+                _LOG.debug("Not retrying after " + error_class + " error as the retry deadline would be exceeded: " + str(e))
+                raise
+
+            attempt += 1
+            _LOG.debug("Retrying request after " + error_class + " error in " + str(round(delay * 1000)) + " ms (attempt " + str(attempt) \
+                       + " of " + str(max_retries) + "): " + str(e))
+            await asyncio.sleep(delay)
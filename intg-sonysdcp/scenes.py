@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""Module that includes picture scenes which store the current picture settings under a name and restore them with as few requests as possible"""
+
+import logging
+
+from pysdcp_extended.protocol import ACTIONS, COMMANDS
+
+import capabilities
+import commands
+import config
+import connection
+
+_LOG = logging.getLogger(__name__)
+
+#Items from the COMMANDS table that are stored in a scene in the order in which they are restored.
+#The preset comes first as it changes the picture defaults that the other items are based on
+SCENE_ITEMS = ["CALIBRATION_PRESET", "ASPECT_RATIO", "MOTIONFLOW", "HDR", "ADVANCED_IRIS", "PICTURE_POSITION"]
+
+
+
+def scene_name(cmd_name: str) -> str:
+    """Get the scene name from a scene command"""
+    return cmd_name.split(":", 1)[1].strip()
+
+
+def get_scenes() -> dict:
+    """Get all stored scenes"""
+    try:
+        return dict(config.Setup.get("scenes"))
+    except ValueError:
+        return {}
+
+
+
+def save(ip: str, name: str) -> dict:
+    """Read all scene items that are supported by the projector model in a single session and store them as a scene in the config file.
+    Returns the stored values"""
+    items = [item for item in SCENE_ITEMS if capabilities.Capabilities.get(item) != capabilities.UNSUPPORTED]
+
+    with connection.Session(ip) as session:
+        values = session.get_items(items)
+
+    if not values:
+        raise Exception("Could not get any picture settings from the projector for scene " + name)
+
+    scenes = get_scenes()
+    scenes[name] = values
+    config.Setup.set("scenes", scenes)
+
+    _LOG.info("Saved scene " + name + ": " + str(values))
+    return values
+
+
+def apply(ip: str, name: str) -> list[str]:
+    """Compare a stored scene with the current projector settings and only send the items that differ.
+    All requests are sent over a single connection. Returns the items that have been changed"""
+    scene = get_scenes().get(name)
+    if scene is None:
+        raise Exception("Scene " + name + " not found. Please save it first with " + commands.SCENE_SAVE + name)
+
+    items = [item for item in SCENE_ITEMS if item in scene]
+    changed = []
+
+    with connection.Session(ip) as session:
+        current = session.get_items(items)
+        for index, item in enumerate(items):
+            if current.get(item) == scene[item]:
+                continue
+            session.request(ACTIONS["SET"], COMMANDS[item], scene[item])
+            changed.append(item)
+            if item == "CALIBRATION_PRESET":
+                #A different preset also changes the other picture settings to the values stored in the preset
+                current = session.get_items(items[index + 1:])
+
+    _LOG.info("Applied scene " + name + ". Changed " + str(changed) + ", " + str(len(items) - len(changed)) + " item(s) already matched")
+    return changed
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Module that includes the passive SDAP listener which receives the advertisements that are broadcasted by the projector
+and updates the power state without sending any request to the projector"""
+
+import asyncio
+import logging
+import time
+
+import pysdcp_extended
+
+import config
+import driver
+import power
+
+_LOG = logging.getLogger(__name__)
+
+ADVERTISEMENT_TIMEOUT = 90 #Seconds without an advertisement after which the advertisements are no longer treated as regular (3 times the default interval of 30 seconds)
+
+
+
+class AdvertisementProtocol(asyncio.DatagramProtocol):
+    """Decodes the received SDAP advertisements and passes the power status of the configured projector to the power transition tracker"""
+
+    def datagram_received(self, data, addr):
+        try:
+            ip = config.Setup.get("ip")
+        except ValueError:
+            return
+        if addr[0] != ip:
+            return
+
+        try:
+            header, info = pysdcp_extended.process_SDAP(data)
+        except Exception as e:
+            _LOG.debug("Ignored invalid SDAP advertisement from " + addr[0] + ": " + str(e))
+            return
+
+        if header.community != config.Setup.get("pjtalk_community"):
+            _LOG.debug("Ignored SDAP advertisement from " + addr[0] + " with a different PJ talk community")
+            return
+
+        Listener.received(info.power_state)
+
+    def error_received(self, exc):
+        _LOG.debug("SDAP listener error: " + str(exc))
+
+
+
+class Listener:
+    """Listens for SDAP advertisements on the SDAP port while the entities are subscribed"""
+
+    __transport = None
+    __last = None
+
+    @staticmethod
+    async def start():
+        """Start listening if the listener is activated and not already running"""
+        if Listener.__transport is not None:
+            return
+        if not config.Setup.get("sdap_listener"):
+            _LOG.debug("SDAP listener is deactivated")
+            return
+        port = config.Setup.get("sdap_port")
+        try:
+            Listener.__transport, _ = await driver.loop.create_datagram_endpoint(AdvertisementProtocol, local_addr=("0.0.0.0", port))
+        except OSError as o:
+            _LOG.warning("Could not start the SDAP listener on port " + str(port) + ": " + str(o))
+            return
+        _LOG.info("Started SDAP listener on port " + str(port))
+
+    @staticmethod
+    def running() -> bool:
+        """Check if the listener is running"""
+        return Listener.__transport is not None
+
+    @staticmethod
+    def stop():
+        """Stop listening, e.g. during the setup where the SDAP port is needed for the discovery"""
+        if Listener.__transport is None:
+            return
+        Listener.__transport.close()
+        Listener.__transport = None
+        Listener.__last = None
+        _LOG.info("Stopped SDAP listener")
+
+    @staticmethod
+    def received(power_status: int):
+        """Update the power phase with the power status from an advertisement"""
+        Listener.__last = time.monotonic()
+        _LOG.debug("Received SDAP advertisement with power status " + str(power_status))
+        power.Transition.set_status(power_status)
+
+    @staticmethod
+    def regular() -> bool:
+        """Check if advertisements are received regularly so the power status doesn't need to be polled"""
+        return Listener.__last is not None and time.monotonic() - Listener.__last < ADVERTISEMENT_TIMEOUT
@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
-"""Module that includes functions to add a lamp timer sensor entity and to poll the sensor data"""
+"""Module that includes functions to add the lamp timer and picture setting sensor entities and to poll the sensor data"""
 
+import asyncio
 import logging
 
 import ucapi
 
+import capabilities
+import commands
 import config
 import driver
+import history
+import lamp
+import lowpower
+import power
 import projector
+import state
 
 _LOG = logging.getLogger(__name__)
 
@@ -21,7 +29,7 @@ async def add_lt_sensor(ent_id: str, name: str):
         ent_id,
         name,
         features=None, #Mandatory although sensor entities have no features
-        attributes=config.LTSensorDef.attributes,
+        attributes={**config.LTSensorDef.attributes, **state.LastKnown.get(ent_id)}, #Last known attributes as provisional values
         device_class=config.LTSensorDef.device_class,
         options=config.LTSensorDef.options
     )
@@ -34,6 +42,60 @@ async def add_lt_sensor(ent_id: str, name: str):
 
 
 
+#Projector item: (Entity id prefix, entity name prefixes). The ids and names are completed with the media player entity id and name
+PICTURE_SENSORS = {
+    "HDR": ("hdr-", {"en": "HDR ", "de": "HDR "}),
+    "CALIBRATION_PRESET": ("picturemode-", {"en": "Picture Mode ", "de": "Bildmodus "}),
+    "ASPECT_RATIO": ("aspectratio-", {"en": "Aspect Ratio ", "de": "Seitenverhältnis "}),
+    "MOTIONFLOW": ("motionflow-", {"en": "Motionflow ", "de": "Motionflow "})
+}
+
+PICTURE_REFRESH_DELAY = 2 #Seconds to wait after a related command before the picture setting sensors are updated
+
+
+
+def picture_sensor_ids(mp_entity_id: str) -> dict:
+    """Get the entity ids of all picture setting sensors for items that are supported by the projector model and the corresponding projector item"""
+    return {prefix + mp_entity_id: item for item, (prefix, _) in PICTURE_SENSORS.items()
+            if capabilities.Capabilities.get(item) != capabilities.UNSUPPORTED}
+
+
+
+def picture_value(item: str, data: int) -> str:
+    """Convert the raw value of a picture setting into a readable value, e.g. CINEMA_FILM_1 into Cinema Film 1"""
+    values = {table_item: table for table_item, table in commands.SETTINGS.values()}[item]
+    for name, value in values.items():
+        if value == data:
+            return name.replace("_", " ").title()
+    return str(data)
+
+
+
+async def add_picture_sensors(mp_entity_id: str, mp_entity_name: str):
+    """Function to add a sensor entity for each picture setting that is supported by the projector model"""
+
+    for ent_id, item in picture_sensor_ids(mp_entity_id).items():
+        if driver.api.available_entities.contains(ent_id):
+            _LOG.debug("Picture setting sensor entity with id " + ent_id + " is already in storage as available entity")
+            continue
+
+        name = {language: prefix + mp_entity_name for language, prefix in PICTURE_SENSORS[item][1].items()}
+
+        definition = ucapi.Sensor(
+            ent_id,
+            name,
+            features=None, #Mandatory although sensor entities have no features
+            attributes={**config.PictureSensorDef.attributes, **state.LastKnown.get(ent_id)}, #Last known attributes as provisional values
+            device_class=config.PictureSensorDef.device_class,
+            options=None
+        )
+
+        driver.api.available_entities.add(definition)
+
+    _LOG.info("Added picture setting sensor entities as available entities")
+
+
+
 class LtPollerController:
     """(Re)Starts or stops a task to regularly poll lamp times from the projector"""
 
@@ -82,50 +144,65 @@ has not removed or not added as a configured entity on the remote")
 
 
 async def lt_poller(entity_id: str, interval:int, ip: str) -> None:
-    """Projector lamp timer poller task. Runs only when the projector is powered on"""
+    """Projector lamp timer poller task. Runs only when the projector is powered on.
+
+    The lamp hours are estimated from the known power transitions without sending any request to the projector. While the lamp is on
+    the poller wakes up when the estimate reaches the next whole hour. The lamp hours are only read from the projector if a resync is due
+    """
     while True:
-        await driver.asyncio.sleep(interval)
+        next_hour = lamp.LampClock.seconds_to_next_hour()
+        await lowpower.sleep("lt_poller", interval if next_hour is None else min(interval, next_hour + 1))
         if config.Setup.get("standby"):
             continue
-        try:
-            projector_power = projector.get_attr_power(ip)
-            if projector_power == {ucapi.media_player.Attributes.STATE: ucapi.media_player.States.OFF}:
-                _LOG.debug("Skip updating lamp timer. Projector is powered off")
+        age = power.Transition.age()
+        if age is None or age > interval:
+            #The power phase has not been confirmed by the media player poller or SDAP since the last run. Check it directly
+            #and resync as on-time could have been missed
+            lamp.LampClock.suspect_drift()
+            try:
+                values = await driver.asyncio.to_thread(projector.get_items, ip, ["GET_STATUS_POWER"])
+                power.Transition.set_status(values["GET_STATUS_POWER"])
+            except Exception as e:
+                #TODO Implement check if there are too many timeouts/connection errors to the projector and automatically deactivate poller and set entity status to unknown
+                _LOG.warning("Could not check projector power status: " + str(e))
                 continue
-        except ConnectionError:
-            #TODO Implement check if there are too many timeouts/connection errors to the projector and automatically deactivate poller and set entity status to unknown
-            _LOG.warning("Could not check projector power status. Connection refused")
+        if power.Transition.get() in (power.STANDBY, power.COOLING):
+            _LOG.debug("Skip updating lamp timer. Projector is powered off")
             continue
         try:
             #TODO Add check if network and remote is reachable
-            await update_lt(entity_id, ip)
+            await update_lt(entity_id, ip, estimate=True)
         except Exception as e:
             _LOG.warning(e)
 
 
 
-async def update_lt(entity_id: str, ip: str):
-    """Update lamp timer sensor. Compare retrieved lamp hours with the last sensor value from the remote and update it if necessary"""
+async def update_lt(entity_id: str, ip: str, values: dict = None, estimate: bool = False):
+    """Update lamp timer sensor. Compare retrieved lamp hours with the last sensor value from the remote and update it if necessary
+
+    :values: Already retrieved raw projector values (e.g. from a consolidated refresh). If None the lamp hours will be retrieved from the projector
+    :estimate: Use the lamp hours estimated by the lamp clock instead of retrieving them from the projector unless a resync is due
+    """
     try:
-        current_value = projector.get_lamp_hours(ip)
+        if values is None and estimate and not lamp.LampClock.needs_resync():
+            current_value = projector.lamp_hours(lamp.LampClock.estimate())
+        else:
+            if values is None:
+                values = await driver.asyncio.to_thread(projector.get_items, ip, ["GET_STATUS_LAMP_TIMER"])
+            current_value = projector.lamp_hours(values["GET_STATUS_LAMP_TIMER"])
+            lamp.LampClock.sync(values["GET_STATUS_LAMP_TIMER"])
     except Exception as e:
         _LOG.warning("Can't get lamp hours from projector. Use empty sensor value")
         current_value = ""
         raise Exception(e) from e
 
-    try:
-        stored_states = await driver.api.available_entities.get_states()
-    except Exception as e:
-        raise Exception(e) from e
-
-    if stored_states != []:
-        attributes_stored = stored_states[1]["attributes"] # [1] = 2nd entity that has been added
-    else:
-        raise Exception("Got empty states from remote. Please make sure to add configured entities")
+    entity = driver.api.configured_entities.get(entity_id)
+    if entity is None:
+        raise Exception("Sensor entity " + entity_id + " not found. Please make sure it's added as a configured entity on the remote")
 
     try:
-        stored_value = attributes_stored["value"]
-    except KeyError as e:
+        stored_value = entity.attributes[ucapi.sensor.Attributes.VALUE]
+    except KeyError:
         _LOG.info("Lamp timer sensor value has not been set yet")
         stored_value = "0"
 
@@ -134,12 +211,22 @@ async def update_lt(entity_id: str, ip: str):
         attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.UNKNOWN, ucapi.sensor.Attributes.VALUE: current_value, ucapi.sensor.Attributes.UNIT: "h"}
     else:
         attributes_to_send = {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: current_value, ucapi.sensor.Attributes.UNIT: "h"}
+        try:
+            history.LampHistory.add(int(current_value))
+            usage = history.LampHistory.attributes(int(current_value))
+        except OSError as o:
+            _LOG.warning("Could not update the lamp hours history: " + str(o))
+            usage = {}
+        #The usage in the last days also changes without new lamp hours when older hours drop out of the period
+        if [key for key, value in usage.items() if entity.attributes.get(key) != value]:
+            stored_value = None
+        attributes_to_send.update(usage)
 
     if stored_value == current_value:
         _LOG.debug("Lamp hours have not changed since the last update. Skipping update process")
     else:
         try:
-            api_update_attributes = driver.api.configured_entities.update_attributes(entity_id, attributes_to_send)
+            api_update_attributes = state.update_attributes(entity_id, attributes_to_send)
         except Exception as e:
             _LOG.error(e)
             raise Exception("Error while updating sensor value for entity id " + entity_id) from e
@@ -148,3 +235,111 @@ async def update_lt(entity_id: str, ip: str):
             raise Exception("Sensor entity " + entity_id + " not found. Please make sure it's added as a configured entity on the remote")
 
         _LOG.info("Updated lamp timer sensor value to " + current_value)
+
+
+
+class PictureSensors:
+    """Keeps the picture setting sensors up to date. The settings are only read while the projector is powered on,
+    either in a low interval or shortly after a command has been sent that changes one of the settings"""
+
+    __refresh_items = []
+
+    @staticmethod
+    def configured() -> dict:
+        """Get the entity ids of all picture setting sensors that are configured entities on the remote and the corresponding projector item"""
+        try:
+            mp_entity_id = config.Setup.get("id")
+        except ValueError:
+            return {}
+        return {ent_id: item for ent_id, item in picture_sensor_ids(mp_entity_id).items() if driver.api.configured_entities.get(ent_id) is not None}
+
+    @staticmethod
+    def start(ip: str):
+        """Start the picture_poller task if it's not already running and if an interval has been set"""
+        interval = config.Setup.get("picture_poller_interval")
+        if interval == 0:
+            _LOG.debug("Picture setting poller interval set to 0. Sensors will only be updated after related commands")
+            return
+        if [task for task in asyncio.all_tasks(driver.loop) if task.get_name() == "picture_poller" and not task.done()]:
+            return
+        driver.loop.create_task(picture_poller(interval, ip), name="picture_poller")
+        _LOG.info("Started picture setting poller task with an interval of " + str(interval) + " seconds")
+
+    @staticmethod
+    def stop():
+        """Cancel the picture_poller task and a pending refresh"""
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() in ("picture_poller", "picture_refresh"):
+                task.cancel()
+
+    @staticmethod
+    def refresh_after(ip: str, cmd_name: str, params: dict = None):
+        """Update the picture setting sensors shortly after a command that changes one of the settings. Multiple commands in a short time
+        will only result in a single update"""
+        if commands.is_scene_command(cmd_name):
+            items = list(PICTURE_SENSORS)
+        else:
+            item = commands.item(cmd_name, params)
+            if item not in PICTURE_SENSORS:
+                return
+            items = [item]
+
+        for task in asyncio.all_tasks(driver.loop):
+            if task.get_name() == "picture_refresh" and not task.done():
+                task.cancel()
+
+        PictureSensors.__refresh_items = list(dict.fromkeys(PictureSensors.__refresh_items + items))
+        driver.loop.create_task(PictureSensors.delayed_update(ip), name="picture_refresh")
+
+    @staticmethod
+    async def delayed_update(ip: str):
+        """Wait until the projector has applied the last command and update the picture setting sensors of all changed items"""
+        await asyncio.sleep(PICTURE_REFRESH_DELAY)
+        items = PictureSensors.__refresh_items
+        PictureSensors.__refresh_items = []
+        try:
+            await update_picture(ip, items)
+        except Exception as e:
+            _LOG.warning(e)
+
+
+
+async def picture_poller(interval: int, ip: str) -> None:
+    """Picture setting poller task. Runs only when the projector is powered on"""
+    while True:
+        await lowpower.sleep("picture_poller", interval)
+        if config.Setup.get("standby"):
+            continue
+        try:
+            await update_picture(ip)
+        except Exception as e:
+            _LOG.warning(e)
+
+
+
+async def update_picture(ip: str, items: list[str] = None):
+    """Get the current values of the picture settings of all configured picture setting sensors in a single session,
+    compare them with the sensor values on the remote and only update the sensors with changed values.
+    The settings can only be read while the projector is powered on
+
+    :items: Only update the sensors of these projector items. If None all configured sensors will be updated
+    """
+    if power.Transition.get() != power.ON:
+        _LOG.debug("Skip updating picture setting sensors. Projector is not powered on")
+        return
+
+    sensors = {ent_id: item for ent_id, item in PictureSensors.configured().items() if items is None or item in items}
+    if not sensors:
+        return
+
+    values = await asyncio.to_thread(projector.get_items, ip, list(sensors.values()))
+
+    for ent_id, item in sensors.items():
+        if item not in values:
+            continue
+        current_value = picture_value(item, values[item])
+        entity = driver.api.configured_entities.get(ent_id)
+        if entity is None or entity.attributes.get(ucapi.sensor.Attributes.VALUE) == current_value:
+            continue
+        state.update_attributes(ent_id, {ucapi.sensor.Attributes.STATE: ucapi.sensor.States.ON, ucapi.sensor.Attributes.VALUE: current_value})
+        _LOG.info("Updated " + ent_id + " sensor value to " + current_value)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Module that includes the executor for command sequences which sends all commands of a sequence over a single connection"""
+
+import asyncio
+import logging
+import time
+
+import capabilities
+import commands
+import connection
+import deferred
+import projector
+import retry
+import sensor
+
+_LOG = logging.getLogger(__name__)
+
+
+
+def validate(sequence: list[str]):
+    """Check all commands of a sequence before any command will be sent. Raises a ValueError with all unknown or unsupported commands"""
+    unknown = [command for command in sequence if not commands.is_known(command)]
+    if unknown:
+        raise ValueError("Unknown command(s) in sequence: " + ", ".join(unknown))
+    unsupported = [command for command in sequence if not capabilities.Capabilities.is_supported(command)]
+    if unsupported:
+        raise ValueError("Command(s) not supported by this projector model in sequence: " + ", ".join(unsupported))
+
+
+
+async def execute(entity_id: str, ip: str, sequence: list[str], delay: int = 0, cancelled: asyncio.Event = None) -> list[dict]:
+    """Validate and send all commands of a sequence and return a report with the result and latency of each step.
+
+    Commands that consist of a single SDCP request are sent over one shared connection. The next request is sent as soon as the projector
+    has acknowledged the previous one. Simulated ir commands are not acknowledged, so replies that arrive anyway are drained before the next
+    request like for single ir commands (see projector.send_ir). Failed requests are retried depending on the error class (see retry.call).
+    All other commands (e.g. power, mute, input or toggles) and commands that are held back during warm-up are sent with projector.send_cmd.
+    The sequence is aborted after the first command that still fails after all retries.
+
+    :param delay: delay between two commands in milliseconds measured from the start of the previous command
+    :param cancelled: optional event that stops the sequence before the next command if it's set
+    """
+    validate(sequence)
+
+    report = []
+    session = connection.Session(ip)
+
+    def send_step(command: str, request: tuple):
+        session.request(*request)
+        if commands.ir(command) is not None:
+            session.drain()
+
+    next_start = time.monotonic()
+    failed = False
+
+    try:
+        for command in sequence:
+            if failed or (cancelled is not None and cancelled.is_set()):
+                report.append({"command": command, "result": "SKIPPED", "latency_ms": None})
+                continue
+
+            wait = next_start - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            step_start = time.monotonic()
+            next_start = step_start + delay / 1000
+            request = commands.frame(command)
+
+            try:
+                if request is not None and not deferred.WarmupQueue.accepts(command):
+                    await retry.call(send_step, command, request)
+                    sensor.PictureSensors.refresh_after(ip, command)
+                else:
+                    await projector.send_cmd(entity_id, ip, command)
+                result = "OK"
+            except Exception as e:
+                capabilities.Capabilities.learn(command, e)
+                _LOG.error("Error while executing the command " + command + ": " + str(e))
+                result = "ERROR: " + str(e)
+                failed = True
+
+            report.append({"command": command, "result": result, "latency_ms": round((time.monotonic() - step_start) * 1000, 1)})
+    finally:
+        session.close()
+
+    _LOG.info("Command sequence report: " + ", ".join(
+        step["command"] + " " + step["result"] + ("" if step["latency_ms"] is None else " (" + str(step["latency_ms"]) + " ms)") for step in report))
+
+    return report
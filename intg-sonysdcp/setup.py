@@ -7,14 +7,18 @@ import logging
 
 from ipaddress import ip_address
 import socket
+import time
 import ucapi
 
+import capabilities
 import config
+import connection
 import driver
 import projector
 import media_player
+import proxy
+import sdap
 import sensor
-import remote
 
 _LOG = logging.getLogger(__name__)
 
@@ -198,6 +202,9 @@ async def handle_driver_setup(msg: ucapi.DriverSetupRequest,) -> ucapi.SetupActi
         return ucapi.SetupError(error_type=ucapi.IntegrationSetupError.TIMEOUT)
     except Exception:
         return ucapi.SetupError()
+    finally:
+        #The proxy has been stopped for the setup. Start it again for the new projector or after a failed setup for the previous one
+        await proxy.Proxy.start()
 
     try:
         mp_entity_id = config.Setup.get("id")
@@ -212,9 +219,13 @@ async def handle_driver_setup(msg: ucapi.DriverSetupRequest,) -> ucapi.SetupActi
         _LOG.error(v)
         return ucapi.SetupError()
 
+    import remote # pylint: disable=import-outside-toplevel
     await media_player.add_mp(mp_entity_id, mp_entity_name)
     await remote.add_remote(rt_entity_id, rt_entity_name)
     await sensor.add_lt_sensor(lt_entity_id, lt_entity_name)
+    await sensor.add_picture_sensors(mp_entity_id, mp_entity_name)
+
+    await proxy.Proxy.start()
 
     _LOG.info("Setup complete")
     config.Setup.set("setup_complete", True)
@@ -284,6 +295,9 @@ async def  handle_user_data_response(msg: ucapi.UserDataResponse) -> ucapi.Setup
             return ucapi.SetupError(error_type=ucapi.IntegrationSetupError.TIMEOUT)
         except Exception:
             return ucapi.SetupError()
+        finally:
+            #The proxy has been stopped for the setup. Start it again for the new projector or after a failed setup for the previous one
+            await proxy.Proxy.start()
 
         try:
             mp_entity_id = config.Setup.get("id")
@@ -298,9 +312,11 @@ async def  handle_user_data_response(msg: ucapi.UserDataResponse) -> ucapi.Setup
             _LOG.error(v)
             return ucapi.SetupError()
 
+        import remote # pylint: disable=import-outside-toplevel
         await media_player.add_mp(mp_entity_id, mp_entity_name)
         await remote.add_remote(rt_entity_id, rt_entity_name)
         await sensor.add_lt_sensor(lt_entity_id, lt_entity_name)
+        await sensor.add_picture_sensors(mp_entity_id, mp_entity_name)
 
     if not skip_mp_poller:
         mp_entity_id = config.Setup.get("id")
@@ -309,6 +325,8 @@ async def  handle_user_data_response(msg: ucapi.UserDataResponse) -> ucapi.Setup
         lt_entity_id = config.Setup.get("lt-id")
         await sensor.LtPollerController.start(lt_entity_id, ip)
 
+    await proxy.Proxy.start()
+
     config.Setup.set("setup_complete", True)
     _LOG.info("Setup complete")
     return ucapi.SetupComplete()
@@ -319,6 +337,11 @@ async def setup_projector(ip:str = ""):
     """Discovery protector ip if empty. Check if sdcp port is open and trigger a test command to check if the pj talk community is correct.
     Add all entities to the remote and create poller tasks"""
 
+    #The SDAP port is needed for the discovery. The listener will be started again when the entities are subscribed
+    sdap.Listener.stop()
+    #The setup needs its own connection to the projector which may have a new ip address. The setup handlers start the proxy again afterwards, also if the setup fails
+    await proxy.Proxy.stop()
+
     try:
         #Run blocking function set_entity_data which may need to run up to 30 seconds asynchronously in a separate thread
         #to be able to still respond to the websocket server heartbeat ping messages in the meantime and prevent a disconnect from the websocket server
@@ -353,6 +376,12 @@ async def setup_projector(ip:str = ""):
         _LOG.error("Test command failed. Please check if the entered PJ talk community \"" + config.Setup.get("pjtalk_community") + "\" is correct")
         raise ConnectionRefusedError from e
 
+    #Find out which setting items are supported by this model to only add the supported commands to the entities
+    try:
+        await asyncio.to_thread(capabilities.Capabilities.probe, ip)
+    except Exception as e:
+        _LOG.warning("Could not probe the capabilities of the projector. All commands will be added: " + str(e))
+
 
 
 def set_entity_data(man_ip: str = None):
@@ -417,9 +446,11 @@ def port_check(ip, port):
     """Function to check if a specified port from a specified ip is open"""
 
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(2)
+    s.settimeout(connection.RoundTrip.timeout(ip))
     try:
+        start = time.monotonic()
         s.connect((ip, int(port)))
+        connection.RoundTrip.add(ip, time.monotonic() - start)
         s.shutdown(socket.SHUT_RDWR)
         return True
     except Exception:
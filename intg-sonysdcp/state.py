@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""Module that includes the last known entity attributes which are stored in a file to be able to publish them immediately after a restart"""
+
+import json
+import os
+import time
+import logging
+
+import config
+import driver
+import events
+
+_LOG = logging.getLogger(__name__)
+
+SAVE_DELAY = 5 #Seconds to collect attribute changes before the state file is written
+
+
+
+class LastKnown:
+    """Runtime storage of the last known attributes of all entities including a timestamp of the last change.
+    The storage is mirrored to a state file in the same directory as the config file"""
+
+    __states = {}
+    __save_handle = None
+
+    @staticmethod
+    def path():
+        """Get the path of the state file which is located in the same directory as the config file"""
+        return os.path.join(os.path.dirname(config.Setup.get("cfg_path")), "state.json")
+
+    @staticmethod
+    def load():
+        """Load all last known attributes from the state file into the runtime storage"""
+        state_path = LastKnown.path()
+        if not os.path.isfile(state_path):
+            _LOG.debug(state_path + " does not exist (yet). No last known attributes available")
+            return
+
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                LastKnown.__states = json.load(f)
+        except Exception as e:
+            LastKnown.__states = {}
+            raise OSError("Error while reading " + state_path) from e
+
+        _LOG.debug("Loaded last known attributes for " + str(list(LastKnown.__states)) + " from " + state_path)
+
+    @staticmethod
+    def save(data: str = None):
+        """Store all last known attributes from the runtime storage in the state file. The file is written to a temporary file first
+        and then replaces the state file, so a crash while writing doesn't leave a truncated state file"""
+        state_path = LastKnown.path()
+        temp_path = state_path + ".tmp"
+        if data is None:
+            data = json.dumps(LastKnown.__states)
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, state_path)
+        except Exception as e:
+            raise OSError("Error while storing last known attributes into " + state_path) from e
+
+    @staticmethod
+    def schedule_save():
+        """Store the last known attributes in the state file after SAVE_DELAY seconds. All changes until then are written at once
+        in a separate thread to keep the event loop free"""
+        if LastKnown.__save_handle is not None:
+            return
+        LastKnown.__save_handle = driver.loop.call_later(SAVE_DELAY, LastKnown.__save_later)
+
+    @staticmethod
+    def __save_later():
+        LastKnown.__save_handle = None
+        #Serialize in the event loop so the thread gets a consistent copy
+        data = json.dumps(LastKnown.__states)
+
+        def write():
+            try:
+                LastKnown.save(data)
+            except OSError as o:
+                _LOG.warning(o)
+
+        driver.loop.run_in_executor(None, write)
+
+    @staticmethod
+    def flush():
+        """Write a scheduled save immediately, e.g. before the remote enters standby or the driver stops"""
+        if LastKnown.__save_handle is None:
+            return
+        LastKnown.__save_handle.cancel()
+        LastKnown.__save_handle = None
+        try:
+            LastKnown.save()
+        except OSError as o:
+            _LOG.warning(o)
+
+    @staticmethod
+    def get(entity_id: str) -> dict:
+        """Get the last known attributes of an entity. Returns an empty dict if no attributes are known"""
+        try:
+            return dict(LastKnown.__states[entity_id]["attributes"])
+        except KeyError:
+            return {}
+
+    @staticmethod
+    def age(entity_id: str):
+        """Get the age of the last known attributes of an entity in seconds or None if no attributes are known"""
+        try:
+            return time.time() - LastKnown.__states[entity_id]["timestamp"]
+        except KeyError:
+            return None
+
+    @staticmethod
+    def all() -> dict:
+        """Get the last known attributes and the timestamp of the last change of all entities"""
+        return {entity_id: {"attributes": dict(known["attributes"]), "timestamp": known["timestamp"]} for entity_id, known in LastKnown.__states.items()}
+
+    @staticmethod
+    def set(entity_id: str, attributes: dict) -> dict:
+        """Merge attributes into the last known attributes of an entity and schedule storing them in the state file if a value has changed.
+        Returns the changed attributes"""
+        known = LastKnown.__states.setdefault(entity_id, {"attributes": {}, "timestamp": 0})
+        changed = {str(key): value for key, value in attributes.items() if known["attributes"].get(str(key)) != value}
+        if not changed:
+            return changed
+
+        known["attributes"].update(changed)
+        known["timestamp"] = time.time()
+        LastKnown.schedule_save()
+
+        return changed
+
+
+
+def update_attributes(entity_id: str, attributes: dict) -> bool:
+    """Update attributes of a configured entity on the remote, remember them as the last known attributes and publish the changes to the event stream"""
+    api_update_attributes = driver.api.configured_entities.update_attributes(entity_id, attributes)
+    if api_update_attributes:
+        changed = LastKnown.set(entity_id, attributes)
+        if changed:
+            events.Stream.publish(entity_id, changed)
+    return api_update_attributes
+
+
+
+def publish_last_known(entity_id: str) -> bool:
+    """Publish the last known attributes of an entity as provisional values until they will be reconciled by the next update from the projector"""
+    attributes = LastKnown.get(entity_id)
+    if not attributes:
+        _LOG.debug("No last known attributes for " + entity_id + " available")
+        return False
+
+    if not driver.api.configured_entities.update_attributes(entity_id, attributes):
+        _LOG.debug("Entity " + entity_id + " is not a configured entity. Skip publishing last known attributes")
+        return False
+
+    _LOG.info("Published last known attributes " + str(attributes) + " for " + entity_id + " from " + str(round(LastKnown.age(entity_id))) \
+              + " seconds ago as provisional values")
+    return True
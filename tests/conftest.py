@@ -0,0 +1,53 @@
+"""Shared fixtures for the tests of the integration driver modules"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intg-sonysdcp"))
+
+import config # pylint: disable=wrong-import-position
+import driver # pylint: disable=wrong-import-position
+
+
+
+class FakeEntities:
+    """Minimal replacement for the available and configured entities of the ucapi integration api"""
+
+    def __init__(self):
+        self.entities = {}
+
+    def add(self, entity):
+        self.entities[entity.id] = entity
+
+    def contains(self, entity_id: str) -> bool:
+        return entity_id in self.entities
+
+    def get(self, entity_id: str):
+        return self.entities.get(entity_id)
+
+    def update_attributes(self, entity_id: str, attributes: dict) -> bool:
+        entity = self.entities.get(entity_id)
+        if entity is None:
+            return False
+        entity.attributes.update(attributes)
+        return True
+
+
+
+class FakeApi:
+    """Minimal replacement for the ucapi integration api"""
+
+    def __init__(self):
+        self.available_entities = FakeEntities()
+        self.configured_entities = FakeEntities()
+
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    """Use a config file in a temporary directory and a fake integration api"""
+    config.Setup.set("cfg_path", str(tmp_path / "config.json"), False)
+    monkeypatch.setattr(driver, "api", FakeApi())
+    return tmp_path
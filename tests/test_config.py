@@ -0,0 +1,75 @@
+"""Tests for the validation of manually changed settings in the config file"""
+
+import json
+import os
+
+import pytest
+
+import config
+
+
+
+def write_config(path, values: dict):
+    """Write a config file and make sure its signature differs from the last one written by the integration"""
+    with open(path / "config.json", "w", encoding="utf-8") as f:
+        json.dump({"setup_complete": True, "ip": "127.0.0.1", "id": "VPL-1", "name": "VPL", **values}, f)
+    stat = os.stat(path / "config.json")
+    os.utime(path / "config.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+
+@pytest.mark.parametrize("key, value", [
+    ("mp_poller_interval", "30"),
+    ("mp_poller_interval", -1),
+    ("navigation_backlog", 0),
+    ("sdcp_port", 70000),
+    ("sdap_listener", 1),
+    ("timeout_max", None)
+])
+def test_invalid_values_are_rejected(key, value):
+    with pytest.raises(ValueError):
+        config.Setup.validate(key, value)
+
+
+@pytest.mark.parametrize("key, value", [
+    ("mp_poller_interval", 0),
+    ("power_burst_interval", 1.5),
+    ("sdap_listener", False),
+    ("groups", {"blend": ["192.168.1.20"]})
+])
+def test_valid_values_are_accepted(key, value):
+    config.Setup.validate(key, value)
+
+
+def test_load_keeps_default_for_invalid_advanced_setting(cfg):
+    write_config(cfg, {"navigation_backlog": 0, "hold_interval": 100})
+    config.Setup.load()
+    assert config.Setup.get("navigation_backlog") == 2
+    assert config.Setup.get("hold_interval") == 100
+    config.Setup.set("hold_interval", 250, False)
+
+
+def test_reload_skips_invalid_values(cfg):
+    write_config(cfg, {"mp_poller_interval": 20, "lt_poller_interval": 1800})
+    config.Setup.load()
+    write_config(cfg, {"mp_poller_interval": "30", "lt_poller_interval": 900})
+    assert config.Setup.changed_externally()
+    changes = config.Setup.reload()
+    assert changes == {"lt_poller_interval": (1800, 900)}
+    assert config.Setup.get("mp_poller_interval") == 20
+    config.Setup.set("lt_poller_interval", 1800, False)
+
+
+def test_timeout_min_greater_than_timeout_max_is_rejected(cfg):
+    with pytest.raises(ValueError):
+        config.Setup.validate_order("timeout_min", "timeout_max", {"timeout_min": 5})
+    config.Setup.validate_order("timeout_min", "timeout_max", {"timeout_min": 5, "timeout_max": 10})
+
+    write_config(cfg, {"timeout_min": 1})
+    config.Setup.load()
+    write_config(cfg, {"timeout_min": 5, "timeout_max": 3, "hold_interval": 300})
+    changes = config.Setup.reload()
+    assert changes == {"hold_interval": (250, 300)}
+    assert config.Setup.get("timeout_min") == 1
+    assert config.Setup.get("timeout_max") == 4
+    config.Setup.set("timeout_min", 0.5, False)
+    config.Setup.set("hold_interval", 250, False)
@@ -0,0 +1,80 @@
+"""Tests for the connection layer with a fake projector"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+from pysdcp_extended.protocol import ACTIONS, COMMANDS
+
+import config
+import connection
+
+
+
+class IdleClosingProjector:
+    """SDCP server that answers each request with success and closes a connection after close_after requests"""
+
+    def __init__(self, close_after: int):
+        self.close_after = close_after
+        self.connections = 0
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client: socket.socket):
+        with client:
+            for _ in range(self.close_after):
+                header = client.recv(connection.HEADER_SIZE)
+                if len(header) < connection.HEADER_SIZE:
+                    return
+                data = client.recv(header[9]) if header[9] else b""
+                client.sendall(header[0:6] + b"\x01" + header[7:9] + b"\x02" + (data or b"\x00\x01"))
+
+    def close(self):
+        self.server.close()
+
+
+
+@pytest.fixture
+def projector_cfg(cfg):
+    """Configure the integration for a fake projector on localhost that closes the connection after the pre-warm request"""
+    fake = IdleClosingProjector(1)
+    config.Setup.set("ip", "127.0.0.1", False)
+    config.Setup.set("sdcp_port", fake.port, False)
+    config.Setup.set("pjtalk_community", "SONY", False)
+    yield fake
+    connection.Prewarm.cancel()
+    fake.close()
+
+
+def test_closed_prewarmed_connection_is_not_used(projector_cfg):
+    asyncio.run(connection.Prewarm.run("127.0.0.1"))
+    assert connection.Prewarm.ready("127.0.0.1", projector_cfg.port)
+    #Give the projector time to close the idle connection
+    time.sleep(0.1)
+
+    with connection.Session("127.0.0.1") as session:
+        assert session.request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], 1) == 1
+
+    assert projector_cfg.connections == 2
+
+
+def test_open_prewarmed_connection_is_used(projector_cfg):
+    projector_cfg.close_after = 2
+    asyncio.run(connection.Prewarm.run("127.0.0.1"))
+
+    with connection.Session("127.0.0.1") as session:
+        assert session.request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], 1) == 1
+
+    assert projector_cfg.connections == 1
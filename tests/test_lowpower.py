@@ -0,0 +1,34 @@
+"""Tests for the wakeup alignment of the low power profile"""
+
+import asyncio
+
+import pytest
+
+import config
+import lowpower
+
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    """Activate the low power profile and record the sleep durations instead of sleeping"""
+    durations = []
+
+    async def sleep(duration):
+        durations.append(duration)
+
+    monkeypatch.setattr(lowpower.asyncio, "sleep", sleep)
+    config.Setup.set("low_power", True, False)
+    yield durations
+    config.Setup.set("low_power", False, False)
+
+
+def test_short_intervals_are_not_aligned(slept):
+    asyncio.run(lowpower.sleep("mp_poller", 20))
+    assert slept == [20]
+
+
+def test_long_intervals_are_aligned_to_the_tick(slept, monkeypatch):
+    monkeypatch.setattr(lowpower.time, "monotonic", lambda: 1000.0)
+    asyncio.run(lowpower.sleep("lt_poller", 90))
+    assert slept == [140.0]
@@ -0,0 +1,62 @@
+"""Tests for the memory report"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import config
+import memory
+
+
+
+#Runs startcheck with all entities in a fresh interpreter, so the measured memory doesn't depend on pytest and the other tests
+STARTCHECK = """
+import asyncio
+import json
+import sys
+
+sys.path.insert(0, sys.argv[1])
+import conftest
+import config
+import driver
+import memory
+
+config.Setup.set("cfg_path", sys.argv[2], False)
+with open(sys.argv[2], "w", encoding="utf-8") as f:
+    json.dump({"setup_complete": True, "ip": "127.0.0.1", "id": "VPL-1", "name": "VPL", "config_reload": False}, f)
+driver.api = conftest.FakeApi()
+
+async def run():
+    driver.loop = asyncio.get_running_loop()
+    await driver.startcheck()
+
+asyncio.run(run())
+print(json.dumps({"registered": driver.api.available_entities.contains("remote-VPL-1"), "rss": memory.Report.sample(),
+    "budget": config.Setup.get("memory_budget") * 1048576}))
+"""
+
+
+def test_rss_is_available():
+    assert memory.rss() > 0
+
+
+def test_rss_with_all_entities_is_within_budget(tmp_path):
+    result = subprocess.run([sys.executable, "-c", STARTCHECK, os.path.dirname(os.path.abspath(__file__)), str(tmp_path / "config.json")],
+                            capture_output=True, text=True, timeout=60, check=True)
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    assert measured["registered"]
+    assert measured["rss"] < measured["budget"]
+
+
+def test_report_warns_if_budget_is_exceeded(cfg, caplog):
+    config.Setup.set("memory_budget", 1, False)
+    try:
+        with caplog.at_level(logging.WARNING, logger="memory"):
+            current = memory.Report.sample()
+    finally:
+        config.Setup.set("memory_budget", 48, False)
+    assert current > 1048576
+    assert "exceeds the memory budget" in caplog.text
+    assert memory.Report.samples()[-1][1] == current
@@ -0,0 +1,232 @@
+"""Tests for the SDCP proxy with a fake projector"""
+
+import asyncio
+import socket
+import types
+
+import pytest
+from pysdcp_extended.protocol import ACTIONS, COMMANDS
+
+import config
+import connection
+import driver
+import projector
+import proxy
+import setup
+
+
+
+def free_port() -> int:
+    """Get a free local TCP port"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(action: int, command: int, data: int = None, community: bytes = b"SONY") -> bytes:
+    """Create a complete SDCP request"""
+    body = b"" if data is None else data.to_bytes(2, "big")
+    return bytes([2, 10]) + community + bytes([action]) + command.to_bytes(2, "big") + bytes([len(body)]) + body
+
+
+
+class FakeProjector:
+    """SDCP server that answers all requests with success and the request data and records the requests and connections.
+    Connections are closed after close_after requests like the projector closes idle connections"""
+
+    def __init__(self, close_after: int = None):
+        self.close_after = close_after
+        self.requests = []
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        answered = 0
+        try:
+            while answered != self.close_after:
+                header = await reader.readexactly(connection.HEADER_SIZE)
+                data = await reader.readexactly(header[9])
+                self.requests.append(header + data)
+                await asyncio.sleep(0.005)
+                writer.write(bytes(header[0:6]) + b"\x01" + bytes(header[7:9]) + b"\x02" + (data or b"\x00\x01"))
+                await writer.drain()
+                answered += 1
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+
+@pytest.fixture
+def proxy_cfg(cfg):
+    """Configure the integration for a fake projector on localhost and a proxy on a free port"""
+    values = {"ip": "127.0.0.1", "proxy_port": free_port(), "pjtalk_community": "SONY", "proxy_cache_age": 10}
+    for key, value in values.items():
+        config.Setup.set(key, value, False)
+    yield values
+    config.Setup.set("proxy_port", 0, False)
+
+
+async def start(fake: FakeProjector):
+    driver.loop = asyncio.get_running_loop()
+    config.Setup.set("sdcp_port", await fake.start(), False)
+    await proxy.Proxy.start()
+
+
+async def exchange(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, buffer: bytes) -> bytes:
+    writer.write(buffer)
+    header = await reader.readexactly(connection.HEADER_SIZE)
+    return header + await reader.readexactly(header[9])
+
+
+def test_requests_of_all_clients_are_interleaved_fairly(proxy_cfg):
+    fake = FakeProjector()
+
+    async def client(tag: int, count: int):
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy_cfg["proxy_port"])
+        #Send all requests at once so they are queued in the proxy at the same time
+        writer.write(b"".join(request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], tag) for _ in range(count)))
+        for _ in range(count):
+            header = await reader.readexactly(connection.HEADER_SIZE)
+            await reader.readexactly(header[9])
+        writer.close()
+
+    async def run():
+        await start(fake)
+        try:
+            await asyncio.gather(client(1, 6), client(2, 2), client(3, 2))
+        finally:
+            await proxy.Proxy.stop()
+
+    asyncio.run(run())
+
+    order = [int.from_bytes(buffer[10:12], "big") for buffer in fake.requests]
+    assert fake.connections == 1
+    assert sorted(order) == [1] * 6 + [2] * 2 + [3] * 2
+    #Client 1 gets at most one request per round, so the requests of client 2 and 3 are not held back until its queue is empty
+    assert order[:3].count(1) == 1
+    assert order[:7].count(2) == 2 and order[:7].count(3) == 2
+
+
+def test_get_requests_are_answered_from_the_cache(proxy_cfg):
+    fake = FakeProjector()
+    cached = request(ACTIONS["GET"], COMMANDS["INPUT"])[0:6] + b"\x01" + COMMANDS["INPUT"].to_bytes(2, "big") + b"\x02\x00\x03"
+
+    async def run():
+        await start(fake)
+        try:
+            connection.Cache.put("127.0.0.1", COMMANDS["INPUT"], cached)
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy_cfg["proxy_port"])
+            first = await exchange(reader, writer, request(ACTIONS["GET"], COMMANDS["INPUT"]))
+            #A SET invalidates the cached response, so the next GET is sent to the projector
+            await exchange(reader, writer, request(ACTIONS["SET"], COMMANDS["INPUT"], 2))
+            second = await exchange(reader, writer, request(ACTIONS["GET"], COMMANDS["INPUT"]))
+            writer.close()
+            return first, second
+        finally:
+            await proxy.Proxy.stop()
+
+    first, second = asyncio.run(run())
+
+    assert first == cached
+    assert second != cached
+    assert [buffer[6] for buffer in fake.requests] == [ACTIONS["SET"], ACTIONS["GET"]]
+
+
+def test_requests_with_a_different_community_are_rejected(proxy_cfg):
+    fake = FakeProjector()
+
+    async def run():
+        await start(fake)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy_cfg["proxy_port"])
+            response = await exchange(reader, writer, request(ACTIONS["GET"], COMMANDS["INPUT"], community=b"ABCD"))
+            writer.close()
+            return response
+        finally:
+            await proxy.Proxy.stop()
+
+    response = asyncio.run(run())
+
+    assert response[6] == 0
+    assert int.from_bytes(response[10:12], "big") == proxy.COMMUNITY_ERROR
+    assert fake.requests == []
+
+
+def test_integration_requests_share_the_proxy_connection(proxy_cfg):
+    fake = FakeProjector()
+
+    async def run():
+        await start(fake)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy_cfg["proxy_port"])
+            values, client_response = await asyncio.gather(
+                asyncio.to_thread(projector.get_items, "127.0.0.1", ["INPUT", "ASPECT_RATIO"]),
+                exchange(reader, writer, request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], 5)))
+            power = await asyncio.to_thread(projector.projector("127.0.0.1").get_power)
+            writer.close()
+            return values, client_response, power
+        finally:
+            await proxy.Proxy.stop()
+
+    values, client_response, power = asyncio.run(run())
+
+    assert values == {"INPUT": 1, "ASPECT_RATIO": 1}
+    assert client_response[6] == 1
+    assert power is True
+    assert fake.connections == 1
+    assert len(fake.requests) == 4
+    assert connection.Upstream.get("127.0.0.1") is None
+
+
+def test_connection_closed_by_the_projector_is_not_used(proxy_cfg):
+    fake = FakeProjector(close_after=1)
+
+    async def run():
+        await start(fake)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy_cfg["proxy_port"])
+            first = await exchange(reader, writer, request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], 1))
+            #Give the projector time to close the connection
+            await asyncio.sleep(0.1)
+            second = await exchange(reader, writer, request(ACTIONS["SET"], COMMANDS["ASPECT_RATIO"], 2))
+            writer.close()
+            return first, second
+        finally:
+            await proxy.Proxy.stop()
+
+    first, second = asyncio.run(run())
+
+    assert first[6] == 1 and second[6] == 1
+    assert fake.connections == 2
+    assert len(fake.requests) == 2
+
+
+def test_proxy_is_restarted_after_a_failed_setup(proxy_cfg, monkeypatch):
+    fake = FakeProjector()
+
+    def no_advertisement(_ip):
+        raise TimeoutError("No SDAP advertisement received")
+
+    monkeypatch.setattr(setup, "set_entity_data", no_advertisement)
+    msg = types.SimpleNamespace(input_values={"ip": "127.0.0.1", "sdcp_port": free_port(), "sdap_port": free_port(),
+        "pjtalk_community": "SONY", "mp_poller_interval": 20, "lt_poller_interval": 1800})
+
+    async def run():
+        await start(fake)
+        try:
+            result = await setup.handle_user_data_response(msg)
+            return result, connection.Upstream.get("127.0.0.1") is not None
+        finally:
+            await proxy.Proxy.stop()
+
+    result, running = asyncio.run(run())
+
+    assert result.error_type == setup.ucapi.IntegrationSetupError.TIMEOUT
+    assert running